@@ -0,0 +1,707 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import time
+import asyncio
+import traceback
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+try:
+    import aiohttp
+except ImportError:
+    raise ImportError("AsyncOpenAPIDetector requires aiohttp, install it with: pip install alibabacloud_filedetect[async]")
+from alibabacloud_sas20181203.client import Client as Sas20181203Client
+from alibabacloud_sas20181203 import models as sas_20181203_models
+from alibabacloud_tea_util import models as util_models
+
+from .ERR_CODE import ERR_CODE
+from .Config import Config
+from .DetectResult import DetectResult
+from .Decompress import Decompress
+from .ScanTask import ScanTask
+from .FileHash import calcFileMd5
+from .HashCache import HashCache
+from .PollScheduler import PollScheduler
+from .RateLimiter import RateLimiter
+from .VerdictCache import VerdictCache
+from .OpenAPIDetector import OpenAPIDetector
+
+
+# 检测失败，携带错误码和扩展错误信息
+class _DetectError(Exception):
+    def __init__(self, error_code, error_string, content_error=False):
+        Exception.__init__(self, error_string)
+        self.error_code = error_code
+        self.error_string = error_string
+        self.content_error = content_error # 是否为服务端针对样本内容返回的错误，可分发给相同md5的其他调用方
+
+
+# 相同md5的检测请求共用一个检测协程，所有调用方都已取消时才取消检测
+# 检测按发起检测的调用方的文件路径或URL进行，其他调用方只接受检测成功的结果和服务端针对样本内容返回的错误
+class _DetectJob(object):
+    def __init__(self, future):
+        self.future = future
+        self.refs = 0 # 等待检测结果的调用方个数
+        self.aborted = False # 检测器反初始化时中止
+
+
+# 异步批量合并器：在等待窗口内收集请求，达到批量上限或等待超时后合并为一次API调用
+class _AsyncBatcher(object):
+    """
+    @param process 合并处理一批请求的协程函数，参数为[(key, future)]，需为每个future设置结果
+    @param max_batch_size 单批最大请求数
+    @param linger_time 凑批等待时间，单位为毫秒
+    @param concurrency 同时进行的API调用个数
+    """
+    def __init__(self, process, max_batch_size, linger_time, concurrency):
+        self.__process = process
+        self.__max_batch_size = max(1, max_batch_size)
+        self.__linger_time = max(0, linger_time)
+        self.__items = []
+        self.__event = asyncio.Event()
+        self.__semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.__running = set()
+        self.__loop_future = asyncio.ensure_future(self.__loop())
+
+
+    # 提交请求，等待所在批次处理完成后返回结果
+    async def submit(self, key):
+        future = asyncio.get_event_loop().create_future()
+        self.__items.append((key, future))
+        self.__event.set()
+        return await future
+
+
+    # 停止合并器，未处理的请求以ERR_ABORT结束
+    async def close(self):
+        self.__loop_future.cancel()
+        for future in list(self.__running):
+            future.cancel()
+        await asyncio.gather(self.__loop_future, *self.__running, return_exceptions=True)
+        items = self.__items
+        self.__items = []
+        _rejectAll(items, _DetectError(ERR_CODE.ERR_ABORT, None))
+
+
+    async def __loop(self):
+        while True:
+            await self.__event.wait()
+            if self.__linger_time > 0 and len(self.__items) < self.__max_batch_size:
+                await asyncio.sleep(self.__linger_time / 1000.0)
+            while self.__items:
+                batch = self.__items[:self.__max_batch_size]
+                del self.__items[:self.__max_batch_size]
+                # 跳过调用方已取消的请求
+                batch = [item for item in batch if not item[1].done()]
+                if not batch:
+                    continue
+                await self.__semaphore.acquire()
+                future = asyncio.ensure_future(self.__run(batch))
+                self.__running.add(future)
+                future.add_done_callback(self.__running.discard)
+            self.__event.clear()
+
+
+    async def __run(self, batch):
+        try:
+            await self.__process(batch)
+        except asyncio.CancelledError:
+            _rejectAll(batch, _DetectError(ERR_CODE.ERR_ABORT, None))
+            raise
+        except Exception as e:
+            _rejectAll(batch, _DetectError(ERR_CODE.ERR_CALL_API,
+                ScanTask.getErrorMessage("Batch", "ERR_NETWORK", traceback.format_exc())))
+        finally:
+            self.__semaphore.release()
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _reject(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+
+def _rejectAll(items, error):
+    for key, future in items:
+        _reject(future, error)
+
+
+# 基于asyncio的检测器：API调用和文件上传均为非阻塞IO，每个待检测样本只是一个协程，不占用线程
+# 与OpenAPIDetector不同，不是单例，需在事件循环中创建、初始化和使用
+class AsyncOpenAPIDetector(object):
+    def __init__(self):
+        self.is_inited = False
+        self.client = None
+        self.client_opt = None
+        self.http_session = None
+        self.rate_limiter = None
+        self.poll_scheduler = None
+        self.verdict_cache = None
+        self.hash_cache = None
+        self.__config = Config()
+        self.__decompress = None
+        self.__lookup_batcher = None
+        self.__upload_url_batcher = None
+        self.__upload_semaphore = None
+        self.__jobs = {} # md5 -> 进行中的检测
+
+
+    """
+    初始化配置参数，参数与OpenAPIDetector.initConfig相同
+    线程池、流水线、进程池以及持久化检测结果库相关参数不生效
+    upload_thread_num为同时上传文件并发起检测的样本数，<= 0 时与thread_pool_size一致
+    """
+    def initConfig(self, **kwargs):
+        if self.is_inited is True:
+            return ERR_CODE.ERR_INIT
+        self.__config = Config(**kwargs)
+        return ERR_CODE.ERR_SUCC
+
+
+    """
+    初始化解压缩配置参数
+    @param open 是否识别压缩文件并解压
+    @param maxlayer 最大解压层数，open参数为true时生效
+    @param maxfilecount 最大解压文件数，open参数为true时生效
+    """
+    def initDecompress(self, open, maxlayer, maxfilecount):
+        if self.is_inited is False:
+            return ERR_CODE.ERR_INIT
+        self.__decompress = Decompress(open, maxlayer, maxfilecount)
+        return ERR_CODE.ERR_SUCC
+
+
+    # 检测器初始化，需在事件循环中调用
+    async def init(self, accessKeyId, accessKeySecret, securityToken=None, regionId="cn-shanghai"):
+        if self.is_inited is True:
+            return ERR_CODE.ERR_INIT
+        config = self.__config
+
+        openapi_config = OpenAPIDetector.createOpenApiConfig(accessKeyId, accessKeySecret, securityToken, regionId,
+                                                             config.ENDPOINT, config.PROTOCOL)
+        self.client = Sas20181203Client(openapi_config)
+        self.client_opt = util_models.RuntimeOptions()
+        self.client_opt.connectTimeout = config.HTTP_CONNECT_TIMEOUT
+        self.client_opt.readTimeout = config.HTTP_READ_TIMEOUT
+
+        upload_num = config.UPLOAD_THREAD_NUM if config.UPLOAD_THREAD_NUM > 0 else config.THREAD_POOL_SIZE
+        pool_size = config.HTTP_POOL_SIZE if config.HTTP_POOL_SIZE > 0 else upload_num
+        connector = aiohttp.TCPConnector(limit=pool_size, force_close=not config.HTTP_KEEP_ALIVE)
+        self.http_session = aiohttp.ClientSession(connector=connector)
+        self.__upload_semaphore = asyncio.Semaphore(max(1, upload_num))
+
+        self.rate_limiter = RateLimiter(config.API_QPS, config.REQUEST_TOO_FREQUENTLY_SLEEP_TIME / 1000.0)
+        self.poll_scheduler = PollScheduler(config.QUERY_RESULT_INTERVAL, config.QUERY_RESULT_INTERVAL_MAX)
+        self.verdict_cache = VerdictCache(config.VERDICT_CACHE_SIZE, config.VERDICT_CACHE_BLACK_TTL,
+                                          config.VERDICT_CACHE_WHITE_TTL, config.VERDICT_CACHE_ERROR_TTL)
+        hash_cache = HashCache(config.HASH_CACHE_PATH, config.HASH_CACHE_XATTR)
+        self.hash_cache = hash_cache if hash_cache.isEnabled() else None
+
+        self.__lookup_batcher = _AsyncBatcher(self.__lookupBatch, config.LOOKUP_BATCH_SIZE,
+                                              config.LOOKUP_BATCH_LINGER, config.LOOKUP_THREAD_NUM)
+        self.__upload_url_batcher = _AsyncBatcher(self.__uploadUrlBatch, config.UPLOAD_URL_BATCH_SIZE,
+                                                  config.UPLOAD_URL_BATCH_LINGER, config.UPLOAD_URL_THREAD_NUM)
+        self.__jobs = {}
+        self.is_inited = True
+        return ERR_CODE.ERR_SUCC
+
+
+    # 检测器反初始化，进行中的检测以ERR_ABORT结束
+    async def uninit(self):
+        if self.is_inited is False:
+            return
+        self.is_inited = False
+
+        jobs = list(self.__jobs.values())
+        self.__jobs = {}
+        for job in jobs:
+            job.aborted = True
+            job.future.cancel()
+        await asyncio.gather(*[job.future for job in jobs], return_exceptions=True)
+        await self.__lookup_batcher.close()
+        await self.__upload_url_batcher.close()
+        await self.http_session.close()
+        if self.hash_cache is not None:
+            self.hash_cache.close()
+
+        self.client = None
+        self.client_opt = None
+        self.http_session = None
+        self.rate_limiter = None
+        self.poll_scheduler = None
+        self.verdict_cache = None
+        self.hash_cache = None
+        self.__lookup_batcher = None
+        self.__upload_url_batcher = None
+        self.__upload_semaphore = None
+
+
+    """
+    文件检测，调用方被取消时，若没有其他相同md5的调用方在等待，则同时取消检测
+    @param file_path 待检测文件路径
+    @param timeout 超时时长，单位毫秒， < 0 无限等待
+    @return 检测结果
+    """
+    async def detect(self, file_path, timeout):
+        start_time = self.__currentTimeMillis()
+        if self.is_inited is False:
+            return self.__errorResult(None, ERR_CODE.ERR_INIT, None, start_time)
+        if not os.path.isfile(file_path):
+            return self.__errorResult(None, ERR_CODE.ERR_FILE_NOT_FOUND, file_path, start_time)
+        size = os.path.getsize(file_path)
+
+        # 计算md5时读文件会阻塞，在线程池中执行
+        loop = asyncio.get_event_loop()
+        if self.hash_cache is not None:
+            hash_future = loop.run_in_executor(None, self.hash_cache.calcMd5, file_path, self.__config.MD5_BUFFER_SIZE)
+        else:
+            hash_future = loop.run_in_executor(None, calcFileMd5, file_path, self.__config.MD5_BUFFER_SIZE)
+        try:
+            md5 = await asyncio.wait_for(hash_future, self.__remaining(timeout, start_time))
+        except asyncio.TimeoutError:
+            return self.__errorResult(None, ERR_CODE.ERR_TIMEOUT_QUEUE, file_path, start_time)
+        if md5 is None:
+            return self.__errorResult(None, ERR_CODE.ERR_FILE_NOT_FOUND, file_path, start_time)
+        return await self.__detectMd5(md5, file_path, size, True, timeout, start_time)
+
+
+    """
+    URL文件检测
+    @param url 待检测文件下载链接URL
+    @param md5 文件md5
+    @param timeout 超时时长，单位毫秒， < 0 无限等待
+    @return 检测结果
+    """
+    async def detectUrl(self, url, md5, timeout):
+        start_time = self.__currentTimeMillis()
+        if md5 is not None:
+            # 转小写
+            md5 = md5.lower()
+        if md5 is None or len(md5) != 32 or re.match(r'^[a-f0-9]{32}$', md5) is None:
+            return self.__errorResult(md5, ERR_CODE.ERR_MD5, md5, start_time)
+        if url is None:
+            return self.__errorResult(md5, ERR_CODE.ERR_URL, url, start_time)
+        if self.__isValidUrl(url) is False:
+            return self.__errorResult(md5, ERR_CODE.ERR_URL, "Malformed URL: {}".format(url), start_time)
+        if self.is_inited is False:
+            return self.__errorResult(md5, ERR_CODE.ERR_INIT, None, start_time)
+        return await self.__detectMd5(md5, url, 0, False, timeout, start_time)
+
+
+    # 获取进行中的检测个数，相同md5的检测只计一次
+    def getPendingCount(self):
+        return len(self.__jobs)
+
+
+    """
+    @brief 获取检测结果缓存统计信息
+    @return dict，包括size(缓存个数) hits(命中次数) misses(未命中次数) evictions(淘汰次数)，未初始化时返回None
+    """
+    def getVerdictCacheStats(self):
+        verdict_cache = self.verdict_cache
+        if verdict_cache is None:
+            return None
+        return verdict_cache.getStats()
+
+
+    async def __detectMd5(self, md5, path, size, islocal, timeout, start_time):
+        cached = self.verdict_cache.get(md5)
+        if cached is not None:
+            cached.time = self.__currentTimeMillis() - start_time
+            return cached
+
+        while True:
+            job = self.__jobs.get(md5)
+            owner = job is None
+            if owner:
+                job = _DetectJob(asyncio.ensure_future(self.__runDetect(md5, path, size, islocal)))
+                self.__jobs[md5] = job
+                job.future.add_done_callback(lambda future, job=job: self.__onJobDone(md5, job))
+            job.refs += 1
+            try:
+                # 超时只结束本次等待，检测本身由其他调用方继续等待
+                result, shareable = await asyncio.wait_for(asyncio.shield(job.future),
+                                                           self.__remaining(timeout, start_time))
+            except asyncio.TimeoutError:
+                return self.__errorResult(md5, ERR_CODE.ERR_TIMEOUT, path, start_time)
+            except asyncio.CancelledError:
+                if job.aborted:
+                    return self.__errorResult(md5, ERR_CODE.ERR_ABORT, None, start_time)
+                raise
+            finally:
+                job.refs -= 1
+                if job.refs <= 0 and not job.future.done():
+                    job.future.cancel()
+            if owner or shareable:
+                break
+            # 文件未找到、上传失败、URL无法下载等错误只与发起检测的调用方有关，按本调用方的文件重新检测
+            if self.__jobs.get(md5) is job:
+                del self.__jobs[md5]
+        result = result.copy()
+        result.time = self.__currentTimeMillis() - start_time
+        return result
+
+
+    def __onJobDone(self, md5, job):
+        if self.__jobs.get(md5) is job:
+            del self.__jobs[md5]
+        if job.future.cancelled() or job.future.exception() is not None:
+            return
+        if self.verdict_cache is not None:
+            self.verdict_cache.put(md5, job.future.result()[0])
+
+
+    # 返回(检测结果, 是否可分发给相同md5的其他调用方)
+    async def __runDetect(self, md5, path, size, islocal):
+        result = DetectResult()
+        result.md5 = md5
+        try:
+            await self.__pollResult(result, md5, path, size, islocal)
+        except _DetectError as e:
+            result.error_code = e.error_code
+            result.error_string = e.error_string
+            return result, e.content_error
+        return result, True
+
+
+    # 查询检测结果，未检测过时上传文件并发起检测，检测中时等待后再次查询
+    async def __pollResult(self, result, md5, path, size, islocal):
+        category = PollScheduler.getCategory(path, size)
+        detect_begin_time = 0 # 发起检测的时间
+        detecting_time = 0 # 最近一次查询到检测中的时间
+        poll_count = 0 # 发起检测后查询检测结果的次数
+        while True:
+            last_time = self.__currentTimeMillis()
+            result_info, org_result = await self.__lookup_batcher.submit(md5)
+            if result_info.result == ScanTask.GET_RESULT_FAIL:
+                upload_url = None
+                if islocal is True:
+                    upload_url = await self.__upload_url_batcher.submit((md5, size))
+                async with self.__upload_semaphore:
+                    await self.__uploadAndDetect(md5, path, islocal, upload_url)
+                detect_begin_time = self.__currentTimeMillis()
+                poll_count = 0
+            elif result_info.result == ScanTask.IS_DETECTING:
+                if detect_begin_time <= 0:
+                    detect_begin_time = last_time # 样本已由其他请求发起检测，从首次查询开始计时
+                detecting_time = last_time
+                poll_count += 1
+            else:
+                if detect_begin_time > 0:
+                    # 检测结果在最近两次查询之间产生，取中间时刻作为检测完成时间
+                    finish_time = last_time
+                    if detecting_time > detect_begin_time:
+                        finish_time = (detecting_time + last_time) // 2
+                    self.poll_scheduler.record(category, max(0, finish_time - detect_begin_time))
+                await self.__getListCompressFileResult(result, md5, org_result)
+                result.error_code = ERR_CODE.ERR_SUCC
+                if result_info.result == ScanTask.IS_BLACK:
+                    result.result = DetectResult.RESULT.RES_BLACK
+                else:
+                    result.result = DetectResult.RESULT.RES_WHITE
+                result.score = result_info.score
+                result.virus_type = result_info.virus_type
+                result.ext_info = result_info.ext
+                return
+
+            # 等待下一次查询，等待期间只挂起协程
+            curr_time = self.__currentTimeMillis()
+            delay = self.__config.QUERY_RESULT_INTERVAL - (curr_time - last_time)
+            if self.__config.ADAPTIVE_POLL:
+                delay = max(delay, self.poll_scheduler.nextDelay(category, curr_time - detect_begin_time, poll_count))
+            await self.__sleep(delay)
+
+
+    async def __lookupBatch(self, batch):
+        api_name = "GetFileDetectResult"
+        while batch:
+            md5_list = list(OrderedDict.fromkeys([md5 for md5, future in batch]))
+            try:
+                request = sas_20181203_models.GetFileDetectResultRequest(md5_list, type=0)
+                await self.__acquire(api_name)
+                response = await self.client.get_file_detect_result_with_options_async(request, self.client_opt)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                code = getattr(error, "code", None)
+                self.rate_limiter.feedback(api_name, self.__isThrottled(code))
+                if self.__isThrottled(code):
+                    continue # 请求太过频繁，由限速器暂停后重新请求
+                if code == "GetResultFail" and len(md5_list) > 1:
+                    # 整批查询失败时无法区分具体样本，退化为逐个查询
+                    for md5 in md5_list:
+                        await self.__lookupBatch([item for item in batch if item[0] == md5])
+                    return
+                if code == "GetResultFail":
+                    for md5, future in batch:
+                        _resolve(future, (ScanTask.ResultInfo().init_result(ScanTask.GET_RESULT_FAIL), None))
+                    return
+                _rejectAll(batch, _DetectError(ERR_CODE.ERR_CALL_API, self.__apiErrorMessage(api_name, error)))
+                return
+
+            org_results = self.__mapByMd5(md5_list, response.body.result_list)
+            throttled = []
+            for md5, future in batch:
+                org_result = org_results.get(md5)
+                code = org_result.code if org_result is not None else None
+                if org_result is None or code == "GetResultFail":
+                    result_info = ScanTask.ResultInfo().init_result(ScanTask.GET_RESULT_FAIL)
+                elif self.__isThrottled(code):
+                    throttled.append((md5, future))
+                    continue
+                elif org_result.result is None and code is not None and code != "200":
+                    _reject(future, _DetectError(ERR_CODE.ERR_CALL_API,
+                        ScanTask.getErrorMessage(api_name, code, org_result.message), True))
+                    continue
+                else:
+                    score = org_result.score if org_result.score is not None else 0
+                    res = org_result.result if org_result.result is not None else 0
+                    result_info = ScanTask.ResultInfo().init_result(res, score, org_result.virus_type, org_result.ext)
+                _resolve(future, (result_info, org_result))
+
+            self.rate_limiter.feedback(api_name, len(throttled) > 0)
+            if len(throttled) == 0:
+                return
+            batch = throttled # 部分样本请求太过频繁，由限速器暂停后重新查询
+
+
+    async def __uploadUrlBatch(self, batch):
+        api_name = "CreateFileDetectUploadUrl"
+        while batch:
+            sizes = OrderedDict()
+            for (md5, size), future in batch:
+                sizes.setdefault(md5, size)
+            md5_list = list(sizes.keys())
+            try:
+                hash_key_context_list = [
+                    sas_20181203_models.CreateFileDetectUploadUrlRequestHashKeyContextList(
+                        hash_key = md5,
+                        file_size = size
+                    ) for md5, size in sizes.items()
+                ]
+                request = sas_20181203_models.CreateFileDetectUploadUrlRequest(type=0, hash_key_context_list=hash_key_context_list)
+                await self.__acquire(api_name)
+                response = await self.client.create_file_detect_upload_url_with_options_async(request, self.client_opt)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                throttled = self.__isThrottled(getattr(error, "code", None))
+                self.rate_limiter.feedback(api_name, throttled)
+                if throttled:
+                    continue # 请求太过频繁，由限速器暂停后重新请求
+                _rejectAll(batch, _DetectError(ERR_CODE.ERR_CALL_API, self.__apiErrorMessage(api_name, error)))
+                return
+
+            upload_urls = self.__mapByMd5(md5_list, response.body.upload_url_list)
+            throttled = []
+            for (md5, size), future in batch:
+                upload_url = upload_urls.get(md5)
+                code = upload_url.code if upload_url is not None else None
+                if self.__isThrottled(code):
+                    throttled.append(((md5, size), future))
+                    continue
+                if upload_url is None or (upload_url.file_exist is not True and upload_url.context is None):
+                    message = upload_url.message if upload_url is not None else "upload url not returned"
+                    _reject(future, _DetectError(ERR_CODE.ERR_CALL_API, ScanTask.getErrorMessage(api_name, code, message)))
+                    continue
+                _resolve(future, upload_url)
+
+            self.rate_limiter.feedback(api_name, len(throttled) > 0)
+            if len(throttled) == 0:
+                return
+            batch = throttled # 部分样本请求太过频繁，由限速器暂停后重新获取
+
+
+    async def __uploadAndDetect(self, md5, path, islocal, upload_url):
+        while True:
+            api_name = ""
+            api_callerr = ERR_CODE.ERR_CALL_API
+            try:
+                if islocal is True and upload_url.file_exist is not True:
+                    # 上传文件
+                    api_name = "UploadFile"
+                    api_callerr = ERR_CODE.ERR_UPLOAD
+                    await self.__uploadFile(path, upload_url.public_url, upload_url.context)
+                    upload_url.file_exist = True # 已上传，发起检测重试时无需再次上传
+
+                # 发起检测
+                api_name = "CreateFileDetect"
+                api_callerr = ERR_CODE.ERR_CALL_API
+                if islocal is True:
+                    request = sas_20181203_models.CreateFileDetectRequest(
+                        type=0,
+                        hash_key=md5,
+                        oss_key=upload_url.context.oss_key
+                    )
+                else:
+                    request = sas_20181203_models.CreateFileDetectRequest(
+                        type=0,
+                        hash_key=md5,
+                        download_url=path
+                    )
+                if self.__decompress is not None:
+                    request.from_map(
+                        {
+                            "Decompress": self.__decompress.isOpen(),
+                            "DecompressMaxLayer": self.__decompress.getMaxLayer(),
+                            "DecompressMaxFileCount": self.__decompress.getMaxFileCount()
+                        }
+                    )
+                await self.__acquire(api_name)
+                await self.client.create_file_detect_with_options_async(request, self.client_opt)
+                self.rate_limiter.feedback(api_name, False)
+                return
+            except (asyncio.CancelledError, _DetectError):
+                raise
+            except Exception as error:
+                if self.__isThrottled(getattr(error, "code", None)):
+                    self.rate_limiter.feedback(api_name, True)
+                    continue # 请求太过频繁，由限速器暂停后重新请求
+                raise _DetectError(api_callerr, self.__apiErrorMessage(api_name, error))
+
+
+    async def __uploadFile(self, path, url, context):
+        fields = [
+            ('key', context.oss_key),
+            ('policy', context.policy),
+            ('OSSAccessKeyId', context.access_id),
+            ('success_action_status', '200'),
+            ('Signature', context.signature)
+        ]
+        timeout = aiohttp.ClientTimeout(sock_connect=self.__config.HTTP_CONNECT_TIMEOUT/1000.0,
+                                        sock_read=self.__config.HTTP_UPLOAD_TIMEOUT/1000.0)
+        with open(path, "rb") as f:
+            data = aiohttp.FormData()
+            for name, value in fields:
+                data.add_field(name, value)
+            data.add_field("file", f, filename=os.path.basename(path), content_type="application/octet-stream")
+            async with self.http_session.post(url, data=data, timeout=timeout) as response:
+                await response.read()
+                if response.status != 200:
+                    raise _DetectError(ERR_CODE.ERR_UPLOAD, ScanTask.getErrorMessage("UploadFile", "ERR_NETWORK",
+                        self.__statusMessage(response.status, response.reason, url)))
+
+
+    async def __getListCompressFileResult(self, result, md5, org_result):
+        if org_result is None or org_result.result is None or org_result.compress is None:
+            return # 结果值不合法
+        if org_result.result == ScanTask.IS_DETECTING:
+            return # 在检测中
+        if not org_result.compress:
+            return # 不是压缩包
+
+        api_name = "ListCompressFileDetectResult"
+        cur_page = 1
+        page_size = 50
+        result.compresslist = []
+        while True:
+            try:
+                request = sas_20181203_models.ListCompressFileDetectResultRequest(cur_page, md5, page_size)
+                await self.__acquire(api_name)
+                response = await self.client.list_compress_file_detect_result_with_options_async(request, self.client_opt)
+                self.rate_limiter.feedback(api_name, False)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                if self.__isThrottled(getattr(error, "code", None)):
+                    self.rate_limiter.feedback(api_name, True)
+                    continue # 请求太过频繁，由限速器暂停后重新请求
+                result.compresslist.append(DetectResult.CompressFileDetectResultInfo(
+                    self.__apiErrorMessage(api_name, error)))
+                return # 报错退出
+
+            cnt = 0
+            for comp_org_result in response.body.result_list:
+                cnt += 1
+                comp_res = DetectResult.CompressFileDetectResultInfo(comp_org_result.path)
+                if comp_org_result.score is not None:
+                    comp_res.score = comp_org_result.score
+                if comp_org_result.result is not None:
+                    if comp_org_result.result == ScanTask.IS_BLACK:
+                        comp_res.result = DetectResult.RESULT.RES_BLACK
+                        vinfo = DetectResult.VirusInfo()
+                        vinfo.virus_type = comp_org_result.virus_type
+                        vinfo.ext_info = comp_org_result.ext
+                        comp_res.setVirusInfo(vinfo)
+                    elif comp_org_result.result == ScanTask.IS_OK:
+                        comp_res.result = DetectResult.RESULT.RES_WHITE
+                    result.compresslist.append(comp_res)
+            if cnt != page_size:
+                return # 查询完成，退出
+            cur_page += 1 # 加载下一页
+
+
+    # 按限速预约令牌，令牌不足时挂起协程等待
+    async def __acquire(self, api_name):
+        wait_time = self.rate_limiter.reserve(api_name)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+
+    async def __sleep(self, ms):
+        if ms > 0:
+            await asyncio.sleep(ms / 1000.0)
+
+
+    # 按md5建立结果索引，服务端未回传md5时按请求顺序对应
+    def __mapByMd5(self, md5_list, result_list):
+        result_list = result_list or []
+        results = {}
+        for item in result_list:
+            if item.hash_key is not None:
+                results[item.hash_key.lower()] = item
+        if len(results) == 0 and len(result_list) == len(md5_list):
+            results = dict(zip(md5_list, result_list))
+        return results
+
+
+    def __isThrottled(self, code):
+        return code == "RequestTooFrequently" or code == "Throttling.User"
+
+
+    def __apiErrorMessage(self, api_name, error):
+        code = getattr(error, "code", None)
+        if code is not None:
+            return ScanTask.getErrorMessage(api_name, code, getattr(error, "message", None))
+        return ScanTask.getErrorMessage(api_name, "ERR_NETWORK", traceback.format_exc())
+
+
+    def __statusMessage(self, status, reason, url):
+        if 400 <= status < 500:
+            return "{} Client Error: {} for url: {}".format(status, reason, url)
+        elif 500 <= status < 600:
+            return "{} Server Error: {} for url: {}".format(status, reason, url)
+        return "{} Network Error: {} for url: {}".format(status, reason, url)
+
+
+    def __errorResult(self, md5, error_code, error_string, start_time):
+        result = DetectResult()
+        result.md5 = md5
+        result.error_code = error_code
+        result.error_string = error_string
+        result.time = self.__currentTimeMillis() - start_time
+        return result
+
+
+    # 剩余的等待时间，单位为秒，None表示无限等待
+    def __remaining(self, timeout, start_time):
+        if timeout < 0:
+            return None
+        return max(0, timeout - (self.__currentTimeMillis() - start_time)) / 1000.0
+
+
+    def __isValidUrl(self, url):
+        try:
+            parsed = urlparse(url)
+            return (bool(parsed.scheme) and bool(parsed.netloc))
+        except Exception as e:
+            return False
+
+
+    def __currentTimeMillis(self):
+        return int(round(time.time() * 1000))
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import logging
+import threading
+import traceback
+from collections import deque, OrderedDict
+from concurrent.futures import as_completed
+from alibabacloud_sas20181203 import models as sas_20181203_models
+
+from .ERR_CODE import ERR_CODE
+from .ScanTask import ScanTask
+from .FileHash import calcFileMd5Batch
+
+
+# 批量合并器：在等待窗口内收集任务，达到批量上限或等待超时后合并处理
+class Batcher(object):
+    def __init__(self, max_batch_size, linger_time, thread_num, thread_name_prefix, max_queue_size=0):
+        self._max_batch_size = max(1, max_batch_size) # 单批最大任务数
+        self._linger_time = max(0, linger_time) # 凑批等待时间，单位为毫秒
+        self._max_queue_size = max_queue_size # 等待处理的最大任务数，<= 0 表示不限制，超过时add阻塞等待
+        self._items = deque()
+        lock = threading.Lock()
+        self._cond = threading.Condition(lock)
+        self._not_full = threading.Condition(lock)
+        self._shutdown = False
+        self._threads = []
+        for num in range(max(1, thread_num)):
+            t = threading.Thread(name='%s_%d' % (thread_name_prefix, num), target=self._loop)
+            t.daemon = True
+            self._threads.append(t)
+
+
+    # 启动合并线程
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+
+    # 添加任务，队列已满时等待，合并器已停止时返回False
+    def add(self, item):
+        with self._cond:
+            while self._max_queue_size > 0 and len(self._items) >= self._max_queue_size and not self._shutdown:
+                self._not_full.wait()
+            if self._shutdown:
+                return False
+            self._items.append(item)
+            if len(self._items) == 1 or len(self._items) >= self._max_batch_size:
+                self._cond.notify()
+        return True
+
+
+    def isShutdown(self):
+        return self._shutdown
+
+
+    # 等待合并处理的任务个数
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+
+    # 停止合并器，未处理的任务交由rejectItem处理
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+            self._not_full.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+        with self._cond:
+            items = list(self._items)
+            self._items.clear()
+        for item in items:
+            self.rejectItem(item)
+
+
+    # 合并处理一批任务，由子类实现
+    def processBatch(self, items):
+        raise NotImplementedError()
+
+
+    # 拒绝处理任务，由子类实现
+    def rejectItem(self, item):
+        raise NotImplementedError()
+
+
+    def _nextBatch(self):
+        with self._cond:
+            while not self._items and not self._shutdown:
+                self._cond.wait()
+            deadline = time.time() + self._linger_time / 1000.0
+            while len(self._items) < self._max_batch_size and not self._shutdown:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if self._shutdown:
+                return None
+            batch = []
+            while self._items and len(batch) < self._max_batch_size:
+                batch.append(self._items.popleft())
+            if self._items:
+                self._cond.notify()
+            if self._max_queue_size > 0:
+                self._not_full.notify_all()
+            return batch
+
+
+    def _loop(self):
+        while True:
+            batch = self._nextBatch()
+            if batch is None:
+                return
+            try:
+                self.processBatch(batch)
+            except BaseException as e:
+                logging.exception(e)
+
+
+# 批量调用API的合并器基类，负责将处理完的任务交还检测队列
+class ApiBatcher(Batcher):
+    def __init__(self, detector, config, max_batch_size, linger_time, thread_num, thread_name_prefix):
+        Batcher.__init__(self, max_batch_size, linger_time, thread_num, thread_name_prefix)
+        self._detector = detector
+        self._config = config
+
+
+    def processBatch(self, tasks):
+        client = self._detector.client
+        client_opt = self._detector.client_opt
+        if client is None:
+            for task in tasks:
+                task.errorCallback(ERR_CODE.ERR_INIT, None)
+            return
+        self._process(client, client_opt, tasks)
+
+
+    def rejectItem(self, task):
+        task.errorCallback(ERR_CODE.ERR_ABORT, None)
+
+
+    # 调用API处理一批任务，由子类实现
+    def _process(self, client, client_opt, tasks):
+        raise NotImplementedError()
+
+
+    # 过滤已超时的任务；合并器已停止时拒绝全部任务
+    def _liveTasks(self, tasks):
+        tasks = [task for task in tasks if not task.checkTimeout()]
+        if self.isShutdown():
+            for task in tasks:
+                self.rejectItem(task)
+            return []
+        return tasks
+
+
+    # 按md5建立结果索引，服务端未回传md5时按请求顺序对应
+    def _mapByMd5(self, md5_list, result_list):
+        result_list = result_list or []
+        results = {}
+        for item in result_list:
+            if item.hash_key is not None:
+                results[item.hash_key.lower()] = item
+        if len(results) == 0 and len(result_list) == len(md5_list):
+            results = dict(zip(md5_list, result_list))
+        return results
+
+
+    # 将任务重新分发到检测流水线继续处理
+    def _requeue(self, task):
+        self._detector.dispatch(task)
+
+
+    # 记录每个任务因请求太过频繁被限流的次数
+    def _onThrottled(self, tasks):
+        for task in tasks:
+            task.onThrottled()
+
+
+    def _isThrottled(self, code):
+        return code == "RequestTooFrequently" or code == "Throttling.User"
+
+
+    def _apiErrorMessage(self, api_name, error):
+        code = getattr(error, "code", None)
+        if code is not None:
+            return ScanTask.getErrorMessage(api_name, code, getattr(error, "message", None))
+        return ScanTask.getErrorMessage(api_name, "ERR_NETWORK", traceback.format_exc())
+
+
+# 检测结果批量查询：将多个任务的md5合并为一次GetFileDetectResult请求，再将结果分发回各任务
+class LookupBatcher(ApiBatcher):
+    def __init__(self, detector, config):
+        ApiBatcher.__init__(self, detector, config, config.LOOKUP_BATCH_SIZE, config.LOOKUP_BATCH_LINGER,
+                            config.LOOKUP_THREAD_NUM, "LookupBatcher")
+
+
+    def _process(self, client, client_opt, tasks):
+        self.__lookup(client, client_opt, tasks)
+
+
+    def __lookup(self, client, client_opt, tasks):
+        api_name = "GetFileDetectResult"
+        while True:
+            tasks = self._liveTasks(tasks)
+            if len(tasks) == 0:
+                return
+
+            md5_list = list(OrderedDict.fromkeys([task.getMd5() for task in tasks]))
+            try:
+                request = sas_20181203_models.GetFileDetectResultRequest(md5_list, type=0)
+                self._detector.rate_limiter.acquire(api_name)
+                with self._detector.metrics.timer("api_latency_ms", {"action": api_name}):
+                    response = client.get_file_detect_result_with_options(request, client_opt)
+            except Exception as error:
+                code = getattr(error, "code", None)
+                self._detector.rate_limiter.feedback(api_name, self._isThrottled(code))
+                if self._isThrottled(code):
+                    self._detector.metrics.inc("throttles_total", {"action": api_name})
+                    self._onThrottled(tasks)
+                    continue # 请求太过频繁，由限速器暂停后重新请求
+                if code == "GetResultFail" and len(md5_list) > 1:
+                    # 整批查询失败时无法区分具体样本，退化为逐个查询
+                    for md5 in md5_list:
+                        self.__lookup(client, client_opt, [task for task in tasks if task.getMd5() == md5])
+                    return
+                if code == "GetResultFail":
+                    for task in tasks:
+                        self.__fanOut(task, ScanTask.ResultInfo().init_result(ScanTask.GET_RESULT_FAIL), None)
+                    return
+                error_string = self._apiErrorMessage(api_name, error)
+                for task in tasks:
+                    task.errorCallback(ERR_CODE.ERR_CALL_API, error_string)
+                return
+
+            org_results = self._mapByMd5(md5_list, response.body.result_list)
+            throttled = []
+            for task in tasks:
+                org_result = org_results.get(task.getMd5())
+                code = org_result.code if org_result is not None else None
+                if org_result is None or code == "GetResultFail":
+                    result_info = ScanTask.ResultInfo().init_result(ScanTask.GET_RESULT_FAIL)
+                elif self._isThrottled(code):
+                    throttled.append(task)
+                    continue
+                elif org_result.result is None and code is not None and code != "200":
+                    task.contentErrorCallback(ERR_CODE.ERR_CALL_API, ScanTask.getErrorMessage(api_name, code, org_result.message))
+                    continue
+                else:
+                    score = org_result.score if org_result.score is not None else 0
+                    result = org_result.result if org_result.result is not None else 0
+                    result_info = ScanTask.ResultInfo().init_result(result, score, org_result.virus_type, org_result.ext)
+                self.__fanOut(task, result_info, org_result)
+
+            self._detector.rate_limiter.feedback(api_name, len(throttled) > 0)
+            if len(throttled) == 0:
+                return
+            # 部分样本请求太过频繁，由限速器暂停后重新查询
+            self._detector.metrics.inc("throttles_total", {"action": api_name})
+            self._onThrottled(throttled)
+            tasks = throttled
+
+
+    # 将查询结果交还任务，重新放入队列继续处理
+    def __fanOut(self, task, result_info, org_result):
+        task.setLookupResult(result_info, org_result)
+        self._requeue(task)
+
+
+# 上传地址批量获取：将未检测过的本地文件合并为一次CreateFileDetectUploadUrl请求
+class UploadUrlBatcher(ApiBatcher):
+    def __init__(self, detector, config):
+        ApiBatcher.__init__(self, detector, config, config.UPLOAD_URL_BATCH_SIZE, config.UPLOAD_URL_BATCH_LINGER,
+                            config.UPLOAD_URL_THREAD_NUM, "UploadUrlBatcher")
+
+
+    def _process(self, client, client_opt, tasks):
+        api_name = "CreateFileDetectUploadUrl"
+        while True:
+            tasks = self._liveTasks(tasks)
+            if len(tasks) == 0:
+                return
+
+            sizes = OrderedDict()
+            for task in tasks:
+                sizes.setdefault(task.getMd5(), task.getSize())
+            md5_list = list(sizes.keys())
+            try:
+                hash_key_context_list = [
+                    sas_20181203_models.CreateFileDetectUploadUrlRequestHashKeyContextList(
+                        hash_key = md5,
+                        file_size = size
+                    ) for md5, size in sizes.items()
+                ]
+                request = sas_20181203_models.CreateFileDetectUploadUrlRequest(type=0, hash_key_context_list=hash_key_context_list)
+                self._detector.rate_limiter.acquire(api_name)
+                with self._detector.metrics.timer("api_latency_ms", {"action": api_name}):
+                    response = client.create_file_detect_upload_url_with_options(request, client_opt)
+            except Exception as error:
+                throttled = self._isThrottled(getattr(error, "code", None))
+                self._detector.rate_limiter.feedback(api_name, throttled)
+                if throttled:
+                    self._detector.metrics.inc("throttles_total", {"action": api_name})
+                    self._onThrottled(tasks)
+                    continue # 请求太过频繁，由限速器暂停后重新请求
+                error_string = self._apiErrorMessage(api_name, error)
+                for task in tasks:
+                    task.errorCallback(ERR_CODE.ERR_CALL_API, error_string)
+                return
+
+            upload_urls = self._mapByMd5(md5_list, response.body.upload_url_list)
+            throttled = []
+            for task in tasks:
+                upload_url = upload_urls.get(task.getMd5())
+                code = upload_url.code if upload_url is not None else None
+                if self._isThrottled(code):
+                    throttled.append(task)
+                    continue
+                if upload_url is None or (upload_url.file_exist is not True and upload_url.context is None):
+                    message = upload_url.message if upload_url is not None else "upload url not returned"
+                    task.errorCallback(ERR_CODE.ERR_CALL_API, ScanTask.getErrorMessage(api_name, code, message))
+                    continue
+                task.setUploadUrl(upload_url)
+                self._requeue(task)
+
+            self._detector.rate_limiter.feedback(api_name, len(throttled) > 0)
+            if len(throttled) == 0:
+                return
+            # 部分样本请求太过频繁，由限速器暂停后重新获取
+            self._detector.metrics.inc("throttles_total", {"action": api_name})
+            self._onThrottled(throttled)
+            tasks = throttled
+
+
+# 文件md5批量计算：将待计算md5的任务分片提交到进程池，多个CPU核并行计算
+# 批量较小时进程间通信的开销不划算，交回计算md5阶段的线程计算
+class HashBatcher(Batcher):
+    LINGER_TIME = 10 # 凑批等待时间，单位为毫秒
+
+
+    def __init__(self, detector, config, executor, process_num):
+        self.__shard_size = max(1, config.HASH_BATCH_SIZE)
+        Batcher.__init__(self, self.__shard_size * max(1, process_num), self.LINGER_TIME, 2, "HashBatcher")
+        self._detector = detector
+        self._config = config
+        self.__executor = executor
+
+
+    def processBatch(self, tasks):
+        if len(tasks) < self._config.HASH_PROCESS_MIN_BATCH:
+            self.__hashLocal(tasks)
+            return
+        hash_cache = self._detector.hash_cache
+        futures = {}
+        for i in range(0, len(tasks), self.__shard_size):
+            shard = tasks[i:i + self.__shard_size]
+            # 计算前记录文件标识，用于判断计算期间文件是否变化
+            stats = [self.__stat(task.getPath()) if hash_cache is not None else None for task in shard]
+            try:
+                future = self.__executor.submit(calcFileMd5Batch, [task.getPath() for task in shard],
+                                                self._config.MD5_BUFFER_SIZE)
+            except Exception as e:
+                logging.exception(e)
+                self._detector.metrics.inc("retries_total", {"reason": "hash_process_error"}, len(shard))
+                self.__hashLocal(shard)
+                continue
+            futures[future] = (shard, stats, time.monotonic())
+
+        for future in as_completed(futures):
+            shard, stats, submit_time = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                # 进程池异常退出，交回线程计算
+                logging.exception(e)
+                self._detector.metrics.inc("retries_total", {"reason": "hash_process_error"}, len(shard))
+                self.__hashLocal(shard)
+                continue
+            # 按分片的耗时平均到每个文件，包括在进程池中排队的时间
+            elapsed = (time.monotonic() - submit_time) * 1000 / len(shard)
+            for task, st, (path, size, md5) in zip(shard, stats, results):
+                self._detector.metrics.observe("hash_time_ms", elapsed)
+                if md5 is None:
+                    task.errorCallback(ERR_CODE.ERR_FILE_NOT_FOUND, path)
+                    continue
+                if hash_cache is not None and st is not None:
+                    hash_cache.put(path, st, md5)
+                task.setMd5(md5)
+                self._detector.dispatch(task)
+
+
+    def rejectItem(self, task):
+        task.errorCallback(ERR_CODE.ERR_ABORT, None)
+
+
+    def __hashLocal(self, tasks):
+        for task in tasks:
+            task.setHashLocal()
+            self._detector.dispatch(task)
+
+
+    def __stat(self, path):
+        try:
+            return os.stat(path)
+        except OSError as e:
+            return None
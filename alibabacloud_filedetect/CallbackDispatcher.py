@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from .Batcher import Batcher
+from .IDetectResultCallback import IDetectResultCallback
+from .IDetectResultBatchCallback import IDetectResultBatchCallback
+
+
+# 回调分发器：检测结果先放入有界队列，由独立的线程回调，回调较慢时不占用检测线程
+# 队列满时检测线程等待，避免结果无限积压；批量回调接口一次返回同一批次的多个结果
+class CallbackDispatcher(Batcher):
+    def __init__(self, config):
+        Batcher.__init__(self, config.CALLBACK_BATCH_SIZE, config.CALLBACK_BATCH_LINGER,
+                         config.CALLBACK_THREAD_NUM, "CallbackDispatcher", max(1, config.CALLBACK_QUEUE_SIZE))
+        self.__unfinished = 0 # 已放入队列、尚未回调完成的结果数
+        self.__idle = threading.Condition()
+
+
+    # 包装调用方的回调，检测结果交由分发线程回调
+    def wrap(self, callback):
+        return _DispatchedCallback(self, callback)
+
+
+    def add(self, item):
+        with self.__idle:
+            self.__unfinished += 1
+        if Batcher.add(self, item):
+            return True
+        self.__done(1)
+        return False
+
+
+    """
+    等待已放入队列的结果全部回调完成
+    @param timeout 等待时长，单位为秒，None表示无限等待
+    @return True 已全部回调完成 False 超时
+    """
+    def waitIdle(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.__idle:
+            while self.__unfinished > 0:
+                if deadline is None:
+                    self.__idle.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.__idle.wait(remaining)
+        return True
+
+
+    def processBatch(self, items):
+        try:
+            self.deliver(items)
+        finally:
+            self.__done(len(items))
+
+
+    # 按回调对象分组，批量回调接口每组回调一次
+    def deliver(self, items):
+        groups = OrderedDict()
+        for callback, seq, file_path, res in items:
+            group = groups.get(id(callback))
+            if group is None:
+                group = (callback, [])
+                groups[id(callback)] = group
+            group[1].append((seq, file_path, res))
+        for callback, results in groups.values():
+            if isinstance(callback, IDetectResultBatchCallback):
+                self.__call(callback.onScanResults, results)
+                continue
+            for seq, file_path, res in results:
+                self.__call(callback.onScanResult, seq, file_path, res)
+
+
+    # 分发器停止时，剩余的结果在调用方线程中回调，保证每个结果都有回调
+    def rejectItem(self, item):
+        self.processBatch([item])
+
+
+    def __done(self, count):
+        with self.__idle:
+            self.__unfinished -= count
+            if self.__unfinished <= 0:
+                self.__idle.notify_all()
+
+
+    def __call(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            logging.exception(e)
+
+
+# 将单个检测结果转为批量回调，未启用回调分发线程时使用
+class BatchCallbackAdapter(IDetectResultCallback):
+    def __init__(self, callback):
+        self.__callback = callback
+
+
+    def onScanResult(self, seq, file_path, res):
+        self.__callback.onScanResults([(seq, file_path, res)])
+
+
+class _DispatchedCallback(IDetectResultCallback):
+    def __init__(self, dispatcher, callback):
+        self.__dispatcher = dispatcher
+        self.__callback = callback
+
+
+    def onScanResult(self, seq, file_path, res):
+        item = (self.__callback, seq, file_path, res)
+        if not self.__dispatcher.add(item):
+            # 分发器已停止，在当前线程中回调
+            self.__dispatcher.deliver([item])
@@ -9,12 +9,91 @@ class Config(object):
             request_too_frequently_sleep_time = 100,
             http_connect_timeout = 6000,
             http_read_timeout = 6000, 
-            http_upload_timeout = 60000
+            http_upload_timeout = 60000,
+            lookup_batch_size = 50,
+            lookup_batch_linger = 10,
+            lookup_thread_num = 4,
+            upload_url_batch_size = 50,
+            upload_url_batch_linger = 10,
+            upload_url_thread_num = 2,
+            md5_buffer_size = 1048576,
+            http_pool_size = 0,
+            http_keep_alive = True,
+            adaptive_poll = True,
+            query_result_interval_max = 5000,
+            api_qps = None,
+            verdict_cache_size = 0,
+            verdict_cache_black_ttl = 86400000,
+            verdict_cache_white_ttl = 3600000,
+            verdict_cache_error_ttl = 0,
+            verdict_store_path = None,
+            hash_cache_path = None,
+            hash_cache_xattr = False,
+            hash_thread_num = 0,
+            upload_thread_num = 0,
+            poll_thread_num = 0,
+            hash_backend = "thread",
+            hash_process_num = 0,
+            hash_batch_size = 32,
+            hash_process_min_batch = 8,
+            callback_thread_num = 0,
+            callback_queue_size = 10000,
+            callback_batch_size = 100,
+            callback_batch_linger = 10,
+            metrics_port = 0,
+            metrics_host = "127.0.0.1",
+            endpoint = None,
+            protocol = None
         ):
         self.THREAD_POOL_SIZE = thread_pool_size # 线程池大小
         self.QUEUE_SIZE_MAX = queue_size_max # 队列最大个数
         self.QUERY_RESULT_INTERVAL = query_result_interval # 查询检测结果间隔时间，单位为毫秒
-        self.REQUEST_TOO_FREQUENTLY_SLEEP_TIME = request_too_frequently_sleep_time # 单样本请求太过频繁时，需要休眠时间，单位为毫秒
+        self.REQUEST_TOO_FREQUENTLY_SLEEP_TIME = request_too_frequently_sleep_time # 请求太过频繁被限流后，暂停调用该API的时间，单位为毫秒
         self.HTTP_CONNECT_TIMEOUT = http_connect_timeout # 与服务器的网络连接超时时间，单位为毫秒
         self.HTTP_READ_TIMEOUT = http_read_timeout # 建立连接后，等待服务器响应的超时时间，单位为毫秒
         self.HTTP_UPLOAD_TIMEOUT = http_upload_timeout # 上传文件超时时间，单位为毫秒
+        self.LOOKUP_BATCH_SIZE = lookup_batch_size # 批量查询检测结果时单次请求的最大md5个数
+        self.LOOKUP_BATCH_LINGER = lookup_batch_linger # 批量查询凑批等待时间，单位为毫秒
+        self.LOOKUP_THREAD_NUM = lookup_thread_num # 批量查询线程数
+        self.UPLOAD_URL_BATCH_SIZE = upload_url_batch_size # 批量获取上传地址时单次请求的最大文件个数
+        self.UPLOAD_URL_BATCH_LINGER = upload_url_batch_linger # 批量获取上传地址凑批等待时间，单位为毫秒
+        self.UPLOAD_URL_THREAD_NUM = upload_url_thread_num # 批量获取上传地址线程数
+        self.MD5_BUFFER_SIZE = md5_buffer_size # 计算文件md5时的读缓冲区大小，单位为字节
+        self.HTTP_POOL_SIZE = http_pool_size # 上传文件连接池大小，<= 0 时与线程池大小一致
+        self.HTTP_KEEP_ALIVE = http_keep_alive # 上传文件是否复用连接
+        self.ADAPTIVE_POLL = adaptive_poll # 是否根据同类样本的检测耗时自适应调整查询检测结果间隔
+        self.QUERY_RESULT_INTERVAL_MAX = query_result_interval_max # 自适应查询检测结果的最大间隔，单位为毫秒
+        # API调用频率上限，单位为次/秒。数字表示每个API使用相同的上限，dict按API名称分别设置，<= 0 表示不限速
+        # None表示使用默认上限RateLimiter.DEFAULT_QPS。遇到限流时自动降低调用频率，之后逐步回升至上限
+        self.API_QPS = api_qps
+        self.VERDICT_CACHE_SIZE = verdict_cache_size # 检测结果缓存最大个数，0表示不缓存
+        self.VERDICT_CACHE_BLACK_TTL = verdict_cache_black_ttl # 黑样本检测结果缓存有效期，单位为毫秒
+        self.VERDICT_CACHE_WHITE_TTL = verdict_cache_white_ttl # 白样本检测结果缓存有效期，单位为毫秒
+        self.VERDICT_CACHE_ERROR_TTL = verdict_cache_error_ttl # 调用API错误结果缓存有效期，单位为毫秒，0表示不缓存
+        # 持久化检测结果库文件路径，None表示不启用。进程重启后仍可使用，同一主机的多个进程可共用一个文件
+        # 结果有效期与检测结果缓存相同
+        self.VERDICT_STORE_PATH = verdict_store_path
+        # 文件md5缓存，文件的设备号、inode、大小、修改时间均未变化时不再读取文件计算md5
+        self.HASH_CACHE_PATH = hash_cache_path # 文件md5缓存的SQLite文件路径，None表示不使用
+        self.HASH_CACHE_XATTR = hash_cache_xattr # 是否将文件md5保存在文件扩展属性(user.*)中，仅Linux支持
+        # 检测流水线各阶段的线程数，各阶段使用独立的队列和线程池，互不抢占线程
+        self.HASH_THREAD_NUM = hash_thread_num # 计算md5阶段线程数，<= 0 时与CPU核数一致
+        self.UPLOAD_THREAD_NUM = upload_thread_num # 上传文件并发起检测阶段线程数，<= 0 时与线程池大小一致
+        self.POLL_THREAD_NUM = poll_thread_num # 处理检测结果阶段线程数，<= 0 时为线程池大小的1/4
+        # 计算md5的方式，"thread"在计算md5阶段的线程中计算，"process"将文件分批提交到进程池，适合大量小文件
+        # 使用"process"时，主程序需放在 if __name__ == "__main__": 下执行，且要求Python 3.7及以上
+        self.HASH_BACKEND = hash_backend
+        self.HASH_PROCESS_NUM = hash_process_num # 计算md5的进程数，<= 0 时与CPU核数一致
+        self.HASH_BATCH_SIZE = hash_batch_size # 每次提交到进程池的最大文件个数
+        self.HASH_PROCESS_MIN_BATCH = hash_process_min_batch # 批量小于该值时不提交到进程池，在线程中计算
+        # 回调分发线程数，> 0 时检测结果放入队列，由独立的线程回调，回调较慢时不影响检测；<= 0 时在检测线程中直接回调
+        self.CALLBACK_THREAD_NUM = callback_thread_num
+        self.CALLBACK_QUEUE_SIZE = callback_queue_size # 等待回调的最大结果数，队列满时检测线程等待
+        self.CALLBACK_BATCH_SIZE = callback_batch_size # 批量回调接口单次返回的最大结果数
+        self.CALLBACK_BATCH_LINGER = callback_batch_linger # 批量回调凑批等待时间，单位为毫秒
+        self.METRICS_PORT = metrics_port # 指标HTTP服务端口，> 0 时通过 GET /metrics 提供Prometheus文本格式的指标，<= 0 表示不启用
+        self.METRICS_HOST = metrics_host # 指标HTTP服务监听地址
+        # API服务地址，如"127.0.0.1:8080"，None表示按regionId选择tds.aliyuncs.com或tds.ap-southeast-1.aliyuncs.com
+        # 用于接入私有网络地址或本地模拟服务
+        self.ENDPOINT = endpoint
+        self.PROTOCOL = protocol # API请求协议，"https"或"http"，None表示使用https
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import copy
 from enum import Enum
 
 from .ERR_CODE import ERR_CODE
@@ -32,6 +33,7 @@ class DetectResult(object):
         self.virus_type = None # 病毒类型，如“黑客工具”
         self.ext_info = None # 扩展信息为json字符串
         self.compresslist = None
+        self.timing = self.TimingInfo() # 各阶段耗时明细
 
 
     # 检测结果是否完成，True: 可通过getDetectResultInfo查看结果; False: 可通过getErrorInfo获取错误信息
@@ -39,6 +41,15 @@ class DetectResult(object):
         return self.error_code == ERR_CODE.ERR_SUCC
 
 
+    # 复制检测结果
+    def copy(self):
+        res = copy.copy(self)
+        if res.compresslist is not None:
+            res.compresslist = list(res.compresslist)
+        res.timing = copy.copy(res.timing)
+        return res
+
+
     # 获取错误信息
     def getErrorInfo(self):
         if self.isSucc():
@@ -48,6 +59,7 @@ class DetectResult(object):
         info.time = self.time
         info.error_code = self.error_code
         info.error_string = self.error_string
+        info.timing = self.timing
         return info
 
 
@@ -66,6 +78,7 @@ class DetectResult(object):
         info.result = self.result
         info.score = self.score
         info.compresslist = self.compresslist
+        info.timing = self.timing
         return info
 
           
@@ -84,6 +97,7 @@ class DetectResult(object):
             # 当网络出现问题时(未获取到服务应答)，返回 
             # {"action":"xxx", "error_code":"NetworkError", "error_message":"zzz"}
             self.error_string = None
+            self.timing = None # 各阶段耗时明细
 
 
     class VirusInfo(object):
@@ -99,6 +113,7 @@ class DetectResult(object):
             self.result = DetectResult.RESULT.RES_UNKNOWN # 检测结果
             self.score = 0 # 分值，取值范围0-100
             compresslist = None # 如果是压缩包，并且开启了压缩包解压参数，则此处会输出压缩包内文件检测结果
+            self.timing = None # 各阶段耗时明细
             self.__virusinfo = vinfo
         
         # 获取病毒信息,如result为RES_BLACK，可通过此接口获取病毒信息
@@ -106,6 +121,19 @@ class DetectResult(object):
             return self.__virusinfo
     
 
+    # 检测各阶段的耗时明细，耗时单位为毫秒，用于定位慢样本的耗时来源（本地磁盘、网络或服务端检测）
+    # 使用缓存或相同md5的其他任务的检测结果时，只包括本任务自身经历的阶段
+    class TimingInfo(object):
+        def __init__(self):
+            self.queue_time = 0 # 从发起检测到开始处理的排队时间
+            self.hash_time = 0 # 计算md5的耗时，使用进程池时包括凑批和在进程池中排队的时间
+            self.lookup_time = 0 # 查询检测结果的累计耗时，包括凑批、API调用和被限流后的等待
+            self.upload_time = 0 # 获取上传地址、上传文件和发起检测的耗时
+            self.upload_bytes = 0 # 上传的字节数，文件已存在于服务端时为0
+            self.poll_count = 0 # 查询检测结果的次数
+            self.throttle_count = 0 # 因请求太过频繁被限流的次数
+
+
     class CompressFileDetectResultInfo(object):
         def __init__(self, path=None):
             self.path = path # 压缩文件路径
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+import os
+import stat
+import queue
+import fnmatch
+import logging
+import threading
+
+
+# 目录遍历器：多个线程并行遍历目录，遍历结果通过有界队列逐个返回
+# 调用方处理较慢时队列写满，遍历线程随之暂停，内存占用与目录大小无关
+class DirectoryWalker(object):
+    _SENTINEL = object()
+    _PUT_INTERVAL = 0.1 # 输出队列满时检查是否已停止的间隔，单位为秒
+    _BATCH_SIZE = 128 # 遍历线程按批写入输出队列，减少线程间交接的开销
+
+
+    """
+    @param roots 待遍历的目录或文件，可以是单个路径或路径列表
+    @param include 包含的文件名通配符列表，如["*.exe", "*.dll"]，None表示全部文件
+    @param exclude 排除的通配符列表，匹配文件名或目录名，包含路径分隔符时匹配相对路径，匹配的目录整体跳过
+    @param min_size 最小文件大小，单位为字节
+    @param max_size 最大文件大小，单位为字节，< 0 表示不限制
+    @param follow_symlinks 是否跟随符号链接
+    @param thread_num 遍历线程数
+    @param queue_size 输出队列大小，即已遍历、等待调用方处理的最大文件个数
+    """
+    def __init__(self, roots, include=None, exclude=None, min_size=0, max_size=-1,
+                 follow_symlinks=False, thread_num=4, queue_size=1000):
+        if isinstance(roots, str):
+            roots = [roots]
+        self.__roots = [os.path.abspath(root) for root in roots]
+        self.__include = list(include) if include else None
+        self.__exclude = list(exclude) if exclude else []
+        self.__min_size = min_size
+        self.__max_size = max_size
+        self.__follow_symlinks = follow_symlinks
+        self.__thread_num = max(1, thread_num)
+        self.__queue_size = max(1, queue_size)
+
+
+    # 逐个返回(文件路径, stat结果)，只返回普通文件，硬链接只返回一次
+    def __iter__(self):
+        return self.walk()
+
+
+    def walk(self):
+        state = _WalkState(max(1, self.__queue_size // self._BATCH_SIZE))
+        files = []
+        for root in self.__roots:
+            try:
+                st = os.stat(root) if self.__follow_symlinks else os.lstat(root)
+            except OSError as e:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                state.addDir(root, root, st)
+            elif self.__accept(os.path.basename(root), os.path.basename(root), st) and state.markFile(st):
+                files.append((root, st))
+        threads = []
+        for i in range(self.__thread_num):
+            t = threading.Thread(name="DirectoryWalker-{}".format(i), target=self.__run, args=(state,))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        state.finishIfIdle()
+        try:
+            for item in files:
+                yield item
+            while True:
+                batch = state.output.get()
+                if batch is self._SENTINEL:
+                    break
+                for item in batch:
+                    yield item
+        finally:
+            # 调用方提前结束遍历时停止遍历线程
+            state.stop()
+            for t in threads:
+                t.join()
+
+
+    def __run(self, state):
+        while True:
+            item = state.takeDir()
+            if item is None:
+                return
+            root, dir_path = item
+            try:
+                self.__scanDir(state, root, dir_path)
+            except Exception as e:
+                logging.exception(e)
+            finally:
+                state.dirDone()
+
+
+    def __scanDir(self, state, root, dir_path):
+        try:
+            it = os.scandir(dir_path)
+        except OSError as e:
+            return
+        prefix_len = len(root) if root.endswith(os.sep) else len(root) + 1
+        batch = []
+        with it:
+            for entry in it:
+                if state.isStopped():
+                    return
+                rel_path = entry.path[prefix_len:]
+                try:
+                    if entry.is_dir(follow_symlinks=self.__follow_symlinks):
+                        if not self.__isExcluded(entry.name, rel_path):
+                            state.addDir(root, entry.path, entry.stat() if self.__follow_symlinks else None)
+                        continue
+                    if not entry.is_file(follow_symlinks=self.__follow_symlinks):
+                        # 跳过符号链接、管道、设备等非普通文件
+                        continue
+                    st = entry.stat(follow_symlinks=self.__follow_symlinks)
+                except OSError as e:
+                    continue
+                if self.__accept(entry.name, rel_path, st) and state.markFile(st):
+                    batch.append((entry.path, st))
+                    if len(batch) >= self._BATCH_SIZE:
+                        if not state.put(batch):
+                            return
+                        batch = []
+        if batch:
+            state.put(batch)
+
+
+    def __accept(self, name, rel_path, st):
+        if not stat.S_ISREG(st.st_mode):
+            return False
+        if st.st_size < self.__min_size or (self.__max_size >= 0 and st.st_size > self.__max_size):
+            return False
+        if self.__isExcluded(name, rel_path):
+            return False
+        if self.__include is not None:
+            return any(self.__match(pattern, name, rel_path) for pattern in self.__include)
+        return True
+
+
+    def __isExcluded(self, name, rel_path):
+        return any(self.__match(pattern, name, rel_path) for pattern in self.__exclude)
+
+
+    def __match(self, pattern, name, rel_path):
+        if os.sep in pattern or "/" in pattern:
+            return fnmatch.fnmatch(rel_path.replace(os.sep, "/"), pattern.replace(os.sep, "/"))
+        return fnmatch.fnmatch(name, pattern)
+
+
+# 一次遍历的共享状态
+class _WalkState(object):
+    def __init__(self, queue_size):
+        self.output = queue.Queue(queue_size)
+        self.__dirs = []
+        self.__pending = 0 # 待遍历以及正在遍历的目录个数
+        self.__visited_dirs = set()
+        self.__visited_files = set()
+        self.__stopped = False
+        self.__finished = False
+        self.__cond = threading.Condition()
+
+
+    def isStopped(self):
+        return self.__stopped
+
+
+    # 输出队列满时等待，已停止时返回False
+    def put(self, item):
+        while not self.__stopped:
+            try:
+                self.output.put(item, timeout=DirectoryWalker._PUT_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+    def addDir(self, root, dir_path, st=None):
+        with self.__cond:
+            # 跟随符号链接时避免循环遍历
+            if st is not None:
+                key = (st.st_dev, st.st_ino)
+                if key in self.__visited_dirs:
+                    return
+                self.__visited_dirs.add(key)
+            self.__dirs.append((root, dir_path))
+            self.__pending += 1
+            self.__cond.notify()
+
+
+    def takeDir(self):
+        with self.__cond:
+            while not self.__dirs and not self.__finished and not self.__stopped:
+                self.__cond.wait()
+            if self.__stopped or not self.__dirs:
+                return None
+            # 深度优先，减少待遍历目录的积压
+            return self.__dirs.pop()
+
+
+    def dirDone(self):
+        with self.__cond:
+            self.__pending -= 1
+        self.finishIfIdle()
+
+
+    # 所有目录遍历完成后结束遍历线程，并通知调用方
+    def finishIfIdle(self):
+        with self.__cond:
+            if self.__pending > 0 or self.__finished:
+                return
+            self.__finished = True
+            self.__cond.notify_all()
+        self.put(DirectoryWalker._SENTINEL)
+
+
+    # 只有一个链接的文件不会重复，不需要记录
+    def markFile(self, st):
+        if st.st_nlink <= 1:
+            return True
+        key = (st.st_dev, st.st_ino)
+        with self.__cond:
+            if key in self.__visited_files:
+                return False
+            self.__visited_files.add(key)
+            return True
+
+
+    def stop(self):
+        with self.__cond:
+            self.__stopped = True
+            self.__cond.notify_all()
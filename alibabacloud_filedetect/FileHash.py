@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024 # 默认读文件缓冲区大小，单位为字节
+MIN_BUFFER_SIZE = 64 * 1024
+
+
+"""
+分块计算文件md5，内存占用只与缓冲区大小有关，与文件大小无关
+hashlib对大块数据计算摘要、readinto读文件时均会释放GIL，其他线程可并行执行
+@param path 文件路径
+@param buffer_size 读文件缓冲区大小，单位为字节
+@return 文件md5，文件不存在或无法读取时返回None
+"""
+def calcFileMd5(path, buffer_size=DEFAULT_BUFFER_SIZE):
+    if not os.path.isfile(path):
+        return None
+    return _calcFileMd5(path, bytearray(max(buffer_size, MIN_BUFFER_SIZE)))
+
+
+"""
+批量计算文件md5，多个文件共用一个读缓冲区
+为顶层函数，可提交到进程池执行
+@param paths 文件路径列表
+@param buffer_size 读文件缓冲区大小，单位为字节
+@return [(文件路径, 文件大小, 文件md5)]，文件不存在或无法读取时大小为-1，md5为None
+"""
+def calcFileMd5Batch(paths, buffer_size=DEFAULT_BUFFER_SIZE):
+    buf = bytearray(max(buffer_size, MIN_BUFFER_SIZE))
+    results = []
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            results.append((path, -1, None))
+            continue
+        md5 = _calcFileMd5(path, buf)
+        results.append((path, size if md5 is not None else -1, md5))
+    return results
+
+
+def _calcFileMd5(path, buf):
+    md5 = hashlib.md5()
+    view = memoryview(buf)
+    try:
+        with open(path, "rb", buffering=0) as f:
+            while True:
+                size = f.readinto(buf)
+                if not size:
+                    break
+                md5.update(view[:size])
+    except (IOError, OSError):
+        return None
+    return md5.hexdigest()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+
+from .FileHash import calcFileMd5
+
+
+# 文件md5缓存：以文件标识(设备号, inode, 大小, 修改时间)为键，文件未变化时无需重新读取文件计算md5
+# 可保存在SQLite文件中，也可保存在文件的扩展属性(user.*)中，两者都启用时优先读取扩展属性
+# 不使用ctime，因为写入扩展属性本身会更新ctime
+class HashCache(object):
+    XATTR_NAME = "user.alibabacloud_filedetect.md5"
+    BUSY_TIMEOUT = 10 # 数据库被其他进程锁定时的最长等待时间，单位为秒
+
+
+    """
+    @param path SQLite文件路径，None表示不使用
+    @param use_xattr 是否使用文件扩展属性，仅Linux支持
+    """
+    def __init__(self, path=None, use_xattr=False):
+        self.__path = path
+        self.__use_xattr = use_xattr and hasattr(os, "getxattr")
+        self.__local = threading.local() # 每个线程使用各自的数据库连接
+        self.__conns = []
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+        if self.__path is not None:
+            conn = self.__getConn()
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS file_hash ("
+                    "dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, md5 TEXT, update_time REAL, "
+                    "PRIMARY KEY (dev, ino))")
+
+
+    def isEnabled(self):
+        return self.__path is not None or self.__use_xattr
+
+
+    def __getConn(self):
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.__path, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.__local.conn = conn
+            with self.__lock:
+                self.__conns.append(conn)
+        return conn
+
+
+    # 查询文件md5，文件不存在、已变化或未缓存时返回None
+    def get(self, file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError as e:
+            return None
+        md5 = self.__getXattr(file_path, st)
+        if md5 is None:
+            md5 = self.__getDb(st)
+        with self.__lock:
+            if md5 is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+        return md5
+
+
+    """
+    计算文件md5并缓存，计算期间文件发生变化时不缓存
+    @return 文件md5，文件不存在或无法读取时返回None
+    """
+    def calcMd5(self, file_path, buffer_size):
+        try:
+            st = os.stat(file_path)
+        except OSError as e:
+            return None
+        md5 = calcFileMd5(file_path, buffer_size)
+        if md5 is not None:
+            self.put(file_path, st, md5)
+        return md5
+
+
+    # 缓存已计算的文件md5，st为计算md5前获取的stat结果，计算期间文件发生变化时不缓存
+    def put(self, file_path, st, md5):
+        try:
+            st_after = os.stat(file_path)
+        except OSError as e:
+            return
+        if self.__identity(st) == self.__identity(st_after):
+            self.__putXattr(file_path, st, md5)
+            self.__putDb(st, md5)
+
+
+    # 获取统计信息
+    def getStats(self):
+        with self.__lock:
+            return {"hits": self.__hits, "misses": self.__misses}
+
+
+    def close(self):
+        with self.__lock:
+            conns = self.__conns
+            self.__conns = []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                pass
+
+
+    def __identity(self, st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+    def __getXattr(self, file_path, st):
+        if not self.__use_xattr:
+            return None
+        try:
+            value = os.getxattr(file_path, self.XATTR_NAME).decode("ascii")
+        except (OSError, UnicodeDecodeError) as e:
+            return None
+        # 扩展属性随文件保存，修改文件内容后仍存在，需校验大小和修改时间
+        items = value.split(":")
+        if len(items) != 3 or items[1] != str(st.st_size) or items[2] != str(st.st_mtime_ns):
+            return None
+        return items[0]
+
+
+    def __putXattr(self, file_path, st, md5):
+        if not self.__use_xattr:
+            return
+        value = "{}:{}:{}".format(md5, st.st_size, st.st_mtime_ns)
+        try:
+            os.setxattr(file_path, self.XATTR_NAME, value.encode("ascii"))
+        except OSError as e:
+            # 文件系统不支持或没有写权限
+            pass
+
+
+    def __getDb(self, st):
+        if self.__path is None:
+            return None
+        try:
+            row = self.__getConn().execute(
+                "SELECT md5 FROM file_hash WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+                self.__identity(st)).fetchone()
+        except sqlite3.Error as e:
+            logging.exception(e)
+            return None
+        return row[0] if row is not None else None
+
+
+    def __putDb(self, st, md5):
+        if self.__path is None:
+            return
+        try:
+            conn = self.__getConn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO file_hash VALUES (?, ?, ?, ?, ?, ?)",
+                             self.__identity(st) + (md5, time.time()))
+        except sqlite3.Error as e:
+            logging.exception(e)
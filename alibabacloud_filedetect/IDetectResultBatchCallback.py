@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+
+from abc import ABCMeta, abstractmethod
+
+
+class IDetectResultBatchCallback(metaclass=ABCMeta):
+    """
+    批量返回调用接口，启用回调分发线程时一次返回多个检测结果，便于批量写入
+    未启用回调分发线程时，每次返回一个检测结果
+    @param results 检测结果列表，元素为(seq, file_path, res)，含义同IDetectResultCallback.onScanResult
+    """
+    @abstractmethod
+    def onScanResults(self, results):
+        pass
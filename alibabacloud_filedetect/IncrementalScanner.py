@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import threading
+
+from .IDetectResultCallback import IDetectResultCallback
+from .DirectoryWalker import DirectoryWalker
+
+
+# 增量扫描：清单中记录每个文件的标识(设备号, inode, 大小, 修改时间)、md5和检测结果
+# 再次扫描时只检测新增、已修改以及检测结果已过期的文件，扫描耗时与变化量相关，与目录大小无关
+class IncrementalScanner(object):
+    MANIFEST_VERSION = 1
+
+
+    """
+    @param detector 检测器对象，需已初始化
+    @param manifest_path 清单文件路径，不存在时为首次扫描
+    @param verdict_ttl 检测结果有效期，单位为毫秒，超过后重新检测，<= 0 表示一直有效
+    @param walker_options 目录遍历参数，如include、exclude、max_size等，参见DirectoryWalker，可选
+    """
+    def __init__(self, detector, manifest_path, verdict_ttl=86400000, **walker_options):
+        self.__detector = detector
+        self.__walker_options = walker_options
+        self.__manifest_path = manifest_path
+        self.__verdict_ttl = verdict_ttl
+        self.__files = self.__loadManifest()
+        self.__lock = threading.Condition()
+        self.__pending = 0
+        self.__walk_stats = {} # 检测中的文件 -> 遍历时获取的stat结果
+
+
+    # 获取清单中文件的记录，未检测过时返回None
+    def getEntry(self, file_path):
+        with self.__lock:
+            entry = self.__files.get(os.path.abspath(file_path))
+            return dict(entry) if entry is not None else None
+
+
+    """
+    增量扫描目录或文件，扫描结束后将清单写回文件
+    @param path 待扫描的目录或文件
+    @param timeout 单个文件的检测超时时长，单位为毫秒
+    @param callback 检测结果回调，只有实际发起检测的文件会回调，可选
+    @return dict，包括files(文件总数) submitted(发起检测数) skipped(未变化跳过数)
+            succeeded(检测成功数) failed(检测失败数) changed(检测期间被修改、未记录的文件数) removed(已删除文件数)
+    """
+    def scan(self, path, timeout, callback=None):
+        root = os.path.abspath(path)
+        stats = {"files": 0, "submitted": 0, "skipped": 0, "succeeded": 0, "failed": 0, "changed": 0, "removed": 0}
+        seen = set()
+        result_callback = self.__createCallback(stats, callback)
+
+        for file_path, st in DirectoryWalker(root, **self.__walker_options):
+            seen.add(file_path)
+            stats["files"] += 1
+            with self.__lock:
+                entry = self.__files.get(file_path)
+            if entry is not None and not self.__isChanged(entry, st):
+                stats["skipped"] += 1
+                continue
+            stats["submitted"] += 1
+            self.__submit(file_path, st, timeout, result_callback)
+
+        # 等待本次发起的检测全部结束
+        with self.__lock:
+            while self.__pending > 0:
+                self.__lock.wait()
+            # 删除已不存在的文件，扫描范围以外的记录保持不变
+            for file_path in list(self.__files.keys()):
+                if file_path not in seen and self.__isUnder(file_path, root):
+                    del self.__files[file_path]
+                    stats["removed"] += 1
+            self.__saveManifest()
+        return stats
+
+
+    def __submit(self, file_path, st, timeout, result_callback):
+        with self.__lock:
+            self.__pending += 1
+            self.__walk_stats[file_path] = st
+        # 检测队列满时等待队列可用
+        self.__detector.detect(file_path, timeout, result_callback, True)
+
+
+    def __createCallback(self, stats, callback):
+        on_result = self.__onResult
+        class ScanCallback(IDetectResultCallback):
+            def onScanResult(self, seq, file_path, result):
+                on_result(stats, file_path, result)
+                if callback is not None:
+                    callback.onScanResult(seq, file_path, result)
+        return ScanCallback()
+
+
+    # 记录遍历时获取的文件标识，而非检测结束时的标识，检测结果对应的是遍历时的文件内容
+    # 检测期间文件发生变化时不记录，下次扫描时重新检测
+    def __onResult(self, stats, file_path, result):
+        with self.__lock:
+            st = self.__walk_stats.pop(file_path, None)
+        entry = None
+        changed = False
+        if result.isSucc() and st is not None:
+            changed = not self.__isSameFile(file_path, st)
+            if not changed:
+                entry = {
+                    "dev": st.st_dev,
+                    "ino": st.st_ino,
+                    "size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns,
+                    "md5": result.md5,
+                    "result": result.result.name,
+                    "score": result.score,
+                    "virus_type": result.virus_type,
+                    "check_time": int(time.time() * 1000)
+                }
+        with self.__lock:
+            if entry is not None:
+                stats["succeeded"] += 1
+                self.__files[file_path] = entry
+            elif changed:
+                stats["changed"] += 1
+                self.__files.pop(file_path, None)
+            else:
+                # 检测失败的文件不记录，下次扫描时重新检测
+                stats["failed"] += 1
+                self.__files.pop(file_path, None)
+            self.__pending -= 1
+            self.__lock.notify_all()
+
+
+    def __isSameFile(self, file_path, st):
+        try:
+            st_now = os.stat(file_path)
+        except OSError as e:
+            return False
+        return (st_now.st_dev, st_now.st_ino, st_now.st_size, st_now.st_mtime_ns) == \
+            (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+    def __isChanged(self, entry, st):
+        if (entry.get("dev"), entry.get("ino"), entry.get("size"), entry.get("mtime_ns")) != \
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns):
+            return True
+        if self.__verdict_ttl > 0 and int(time.time() * 1000) - entry.get("check_time", 0) >= self.__verdict_ttl:
+            return True
+        return False
+
+
+    def __isUnder(self, file_path, root):
+        return file_path == root or file_path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+    def __loadManifest(self):
+        try:
+            with open(self.__manifest_path, "r") as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            return {}
+        if not isinstance(manifest, dict) or manifest.get("version") != self.MANIFEST_VERSION:
+            return {}
+        return manifest.get("files", {})
+
+
+    # 先写临时文件再替换，进程中途退出时不会留下不完整的清单
+    def __saveManifest(self):
+        tmp_path = "{}.tmp".format(self.__manifest_path)
+        with open(tmp_path, "w") as f:
+            json.dump({"version": self.MANIFEST_VERSION, "files": self.__files}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.__manifest_path)
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+import time
+import bisect
+import logging
+import threading
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, 300000) # 单位为毫秒
+SIZE_BUCKETS = (1024, 16384, 262144, 1048576, 4194304, 16777216, 67108864, 268435456, 1073741824) # 单位为字节
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+# 直方图：按固定分桶计数，分位数按桶内线性插值估算
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets)) # 各桶的上限（含）
+        self.counts = [0] * (len(self.buckets) + 1) # 最后一个桶为超过所有上限的值
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        cumulative = 0
+        for i, cnt in enumerate(self.counts):
+            if cnt > 0 and cumulative + cnt >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / float(cnt)
+            cumulative += cnt
+        return self.max
+
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / float(self.count) if self.count > 0 else 0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99)
+        }
+
+
+# 检测器运行指标：直方图、计数器和仪表盘，支持快照和Prometheus文本格式
+# 指标名称中的_ms表示单位为毫秒，_bytes表示单位为字节
+class Metrics(object):
+    def __init__(self, prefix="filedetect"):
+        self.__prefix = prefix
+        self.__histograms = {} # (名称, 标签) -> Histogram
+        self.__counters = {} # (名称, 标签) -> 计数
+        self.__gauges = [] # 采集时调用的函数，返回[(名称, 标签dict, 值)]
+        self.__lock = threading.Lock()
+
+
+    """
+    记录一次观测值
+    @param name 指标名称
+    @param value 观测值
+    @param labels 标签dict，可选
+    @param buckets 直方图分桶，首次记录时生效，可选
+    """
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS):
+        key = (name, self.__labelKey(labels))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = Histogram(buckets)
+                self.__histograms[key] = histogram
+            histogram.observe(value)
+
+
+    # 计时上下文，退出时记录耗时，单位为毫秒
+    def timer(self, name, labels=None):
+        return _Timer(self, name, labels)
+
+
+    # 计数器增加value
+    def inc(self, name, labels=None, value=1):
+        key = (name, self.__labelKey(labels))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+
+    # 添加仪表盘采集函数，函数返回[(名称, 标签dict, 值)]
+    def addGauge(self, func):
+        with self.__lock:
+            self.__gauges.append(func)
+
+
+    """
+    获取指标快照
+    @return dict，包括histograms counters gauges，各项为 指标名{标签} -> 值
+            直方图的值为dict，包括count sum avg max p50 p90 p99
+    """
+    def snapshot(self):
+        with self.__lock:
+            histograms = dict((self.__seriesName(name, labels), histogram.snapshot())
+                              for (name, labels), histogram in self.__histograms.items())
+            counters = dict((self.__seriesName(name, labels), value)
+                            for (name, labels), value in self.__counters.items())
+        gauges = dict((self.__seriesName(name, self.__labelKey(labels)), value)
+                      for name, labels, value in self.__collectGauges())
+        return {"histograms": histograms, "counters": counters, "gauges": gauges}
+
+
+    # 输出Prometheus文本格式
+    def toPrometheus(self):
+        lines = []
+        with self.__lock:
+            histograms = sorted(self.__histograms.items())
+            counters = sorted(self.__counters.items())
+            last_name = None
+            for (name, labels), histogram in histograms:
+                full_name = self.__fullName(name)
+                if full_name != last_name:
+                    lines.append("# TYPE {} histogram".format(full_name))
+                    last_name = full_name
+                cumulative = 0
+                for bound, cnt in zip(histogram.buckets, histogram.counts):
+                    cumulative += cnt
+                    lines.append("{} {}".format(self.__seriesName(full_name + "_bucket", labels + (("le", str(bound)),)), cumulative))
+                lines.append("{} {}".format(self.__seriesName(full_name + "_bucket", labels + (("le", "+Inf"),)), histogram.count))
+                lines.append("{} {}".format(self.__seriesName(full_name + "_sum", labels), histogram.sum))
+                lines.append("{} {}".format(self.__seriesName(full_name + "_count", labels), histogram.count))
+        self.__appendSeries(lines, "counter", [(name, labels, value) for (name, labels), value in counters])
+        self.__appendSeries(lines, "gauge", sorted((name, self.__labelKey(labels), value)
+                                                   for name, labels, value in self.__collectGauges()))
+        return "\n".join(lines) + "\n"
+
+
+    def __appendSeries(self, lines, metric_type, series):
+        last_name = None
+        for name, labels, value in series:
+            full_name = self.__fullName(name)
+            if full_name != last_name:
+                lines.append("# TYPE {} {}".format(full_name, metric_type))
+                last_name = full_name
+            lines.append("{} {}".format(self.__seriesName(full_name, labels), value))
+
+
+    def __collectGauges(self):
+        with self.__lock:
+            gauges = list(self.__gauges)
+        series = []
+        for func in gauges:
+            try:
+                series.extend(func())
+            except Exception as e:
+                logging.exception(e)
+        return series
+
+
+    def __fullName(self, name):
+        return "{}_{}".format(self.__prefix, name)
+
+
+    def __labelKey(self, labels):
+        if not labels:
+            return ()
+        return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+    def __seriesName(self, name, labels):
+        if not labels:
+            return name
+        return "{}{{{}}}".format(name, ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"'))
+                                               for k, v in labels))
+
+
+class _Timer(object):
+    def __init__(self, metrics, name, labels):
+        self.__metrics = metrics
+        self.__name = name
+        self.__labels = labels
+        self.__start = 0
+
+
+    def __enter__(self):
+        self.__start = time.monotonic()
+        return self
+
+
+    def __exit__(self, *args):
+        self.__metrics.observe(self.__name, (time.monotonic() - self.__start) * 1000, self.__labels)
+        return False
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+# 指标HTTP服务，GET /metrics返回Prometheus文本格式
+class MetricsServer(object):
+    def __init__(self, metrics, host, port):
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.toPrometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = _ThreadingHTTPServer((host, port), MetricsHandler)
+        self.__thread = threading.Thread(name="MetricsServer", target=self.__server.serve_forever)
+        self.__thread.daemon = True
+
+
+    def start(self):
+        self.__thread.start()
+
+
+    # 实际监听的端口，port为0时由系统分配
+    def getPort(self):
+        return self.__server.server_address[1]
+
+
+    def shutdown(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
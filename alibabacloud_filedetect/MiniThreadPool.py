@@ -2,9 +2,11 @@
 
 from collections import deque
 import atexit
+import heapq
 import itertools
 import queue
 import threading
+import time
 import weakref
 import os
 import logging
@@ -79,6 +81,83 @@ class BlockingDeque(queue.Queue, SyncObject):
         return self.queue.popleft()
 
 
+# 延时队列：任务到期前保存在最小堆中，由定时线程在到期后交给dispatch函数分发
+# 工作线程不会反复取到未到期的任务，大量等待中的任务只占用堆空间
+class DelayQueue(SyncObject):
+    # Used to assign unique thread names when thread_name_prefix is not supplied.
+    _counter = itertools.count().__next__
+
+    def __init__(self, dispatch, thread_name_prefix=''):
+        SyncObject.__init__(self)
+        self._dispatch = dispatch
+        self._heap = []
+        self._sequence = itertools.count() # 到期时间相同时按加入顺序出队
+        self._shutdown = False
+        self._rej_handler = None
+        self._thread = threading.Thread(name=(thread_name_prefix or
+                                              ("DelayQueue-%d" % self._counter())),
+                                        target=self._run)
+        self._thread.daemon = True
+
+    # 启动定时线程
+    def start(self):
+        self._thread.start()
+
+    # 添加拒绝执行任务接口对象
+    def setRejectedExecutionHandler(self, handler):
+        self._rej_handler = handler
+
+    # 延时delay毫秒后分发任务，队列已停止时返回False
+    def addDelayed(self, item, delay):
+        deadline = time.monotonic() + max(0, delay) / 1000.0
+        with self:
+            if self._shutdown:
+                return False
+            heapq.heappush(self._heap, (deadline, next(self._sequence), item))
+            if self._heap[0][2] is item:
+                self.notify()
+        return True
+
+    # 等待到期的任务个数
+    def qsize(self):
+        with self:
+            return len(self._heap)
+
+    # 停止定时线程，未到期的任务交由拒绝执行任务接口处理
+    def shutdown(self, wait=True):
+        with self:
+            self._shutdown = True
+            self.notifyAll()
+        if wait:
+            self._thread.join()
+        with self:
+            items = [entry[2] for entry in self._heap]
+            self._heap = []
+        if self._rej_handler:
+            for item in items:
+                self._rej_handler.rejectedExecution(item, self)
+
+    def _run(self):
+        while True:
+            with self:
+                while not self._shutdown:
+                    if not self._heap:
+                        self.wait()
+                        continue
+                    remaining = self._heap[0][0] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.wait(remaining)
+                if self._shutdown:
+                    return
+                now = time.monotonic()
+                due_items = []
+                while self._heap and self._heap[0][0] <= now:
+                    due_items.append(heapq.heappop(self._heap)[2])
+            for item in due_items:
+                self._dispatch(item)
+
+
 # 拒绝执行任务回调接口
 class RejectedExecutionHandler(object):
 
@@ -113,6 +192,10 @@ class MiniThreadPoolExecutor(object):
         self._thread_name_prefix = (thread_name_prefix or
                                     ("MiniThreadPoolExecutor-%d" % self._counter()))
         self._rej_handler = None
+        self._stats_lock = threading.Lock()
+        self._active_count = 0
+        self._completed_count = 0
+        self._busy_time = 0.0
 
     # 对线程池初始化
     def prestartAllThreads(self):
@@ -139,6 +222,32 @@ class MiniThreadPoolExecutor(object):
     def setRejectedExecutionHandler(self, handler):
         self._rej_handler = handler
 
+    # 线程数
+    def getPoolSize(self):
+        return self._max_workers
+
+    # 正在执行任务的线程数
+    def getActiveCount(self):
+        return self._active_count
+
+    # 已执行完成的任务数
+    def getCompletedTaskCount(self):
+        return self._completed_count
+
+    # 执行任务的累计耗时，单位为秒
+    def getBusyTime(self):
+        return self._busy_time
+
+    def _beforeExecute(self):
+        with self._stats_lock:
+            self._active_count += 1
+
+    def _afterExecute(self, used_time):
+        with self._stats_lock:
+            self._active_count -= 1
+            self._completed_count += 1
+            self._busy_time += used_time
+
     # 停止线程池
     def shutdown(self, wait=True):
         with self._shutdown_lock:
@@ -181,7 +290,12 @@ def _worker(executor_reference, work_queue):
                     if executor._rej_handler:
                         executor._rej_handler.rejectedExecution(work_item, executor)
                 else:
-                    work_item.run()
+                    executor._beforeExecute()
+                    start_time = time.monotonic()
+                    try:
+                        work_item.run()
+                    finally:
+                        executor._afterExecute(time.monotonic() - start_time)
                 # Delete references to object. See issue16284
                 del work_item
                 del executor
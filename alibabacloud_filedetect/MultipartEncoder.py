@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import os
+import uuid
+
+
+# multipart/form-data流式编码器：按需分块读取文件，不在内存中拼接完整请求体
+# 实现了read/__len__，可直接作为requests的data参数，由urllib3分块写入socket
+class MultipartEncoder(object):
+    def __init__(self, fields, file_field, file_path):
+        self.__boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary={}".format(self.__boundary)
+
+        head = b""
+        for name, value in fields:
+            head += self.__partHeader('name="{}"'.format(name))
+            head += str(value).encode("utf-8") + b"\r\n"
+        head += self.__partHeader('name="{}"; filename="{}"'.format(file_field, os.path.basename(file_path)),
+                                  "application/octet-stream")
+        self.__head = head
+        self.__tail = "\r\n--{}--\r\n".format(self.__boundary).encode("utf-8")
+
+        self.__file = open(file_path, "rb")
+        self.__file_size = os.fstat(self.__file.fileno()).st_size
+        self.__file_left = self.__file_size
+        self.len = len(self.__head) + self.__file_size + len(self.__tail) # 请求体总长度
+
+
+    def __partHeader(self, disposition, content_type=None):
+        header = "--{}\r\nContent-Disposition: form-data; {}\r\n".format(self.__boundary, disposition)
+        if content_type is not None:
+            header += "Content-Type: {}\r\n".format(content_type)
+        return (header + "\r\n").encode("utf-8")
+
+
+    def __len__(self):
+        return self.len
+
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(64 * 1024)
+            if not chunk:
+                return
+            yield chunk
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def getFileSize(self):
+        return self.__file_size
+
+
+    # 读取请求体的下一段数据，size < 0 时读取全部剩余数据
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        out = b""
+        if self.__head:
+            out = self.__head[:size]
+            self.__head = self.__head[len(out):]
+        if len(out) < size and self.__file_left > 0:
+            data = self.__file.read(min(size - len(out), self.__file_left))
+            if not data:
+                raise IOError("File {} was truncated during upload".format(self.__file.name))
+            self.__file_left -= len(data)
+            out += data
+        if len(out) < size and self.__file_left == 0 and self.__tail:
+            tail = self.__tail[:size - len(out)]
+            self.__tail = self.__tail[len(tail):]
+            out += tail
+        return out
+
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
@@ -4,8 +4,15 @@ import re
 import sys
 import math
 import time
+import logging
+import sqlite3
+import multiprocessing
+import queue
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, ALL_COMPLETED
+from concurrent.futures import as_completed as futures_as_completed, wait as futures_wait
 from collections import deque
 from alibabacloud_sas20181203.client import Client as Sas20181203Client
 from alibabacloud_tea_util import models as util_models
@@ -13,11 +20,42 @@ from alibabacloud_tea_openapi import models as open_api_models
 
 from .ERR_CODE import ERR_CODE
 from .Config import Config
-from .MiniThreadPool import BlockingDeque, SyncObject, RejectedExecutionHandler, MiniThreadPoolExecutor
+from .MiniThreadPool import DelayQueue, SyncObject, RejectedExecutionHandler
+from .Pipeline import Pipeline
 from .IDetectResultCallback import IDetectResultCallback
+from .IDetectResultBatchCallback import IDetectResultBatchCallback
+from .CallbackDispatcher import CallbackDispatcher, BatchCallbackAdapter
 from .DetectResult import DetectResult
 from .ScanTask import ScanTask, TaskCallback
 from .Decompress import Decompress
+from .Batcher import LookupBatcher, UploadUrlBatcher, HashBatcher
+from .PollScheduler import PollScheduler
+from .RateLimiter import RateLimiter
+from .VerdictCache import VerdictCache
+from .VerdictStore import VerdictStore
+from .HashCache import HashCache
+from .Metrics import Metrics, MetricsServer
+
+
+# 将检测结果回调转为Future的结果
+class _FutureCallback(IDetectResultCallback):
+    def __init__(self, future):
+        self.__future = future
+
+
+    def onScanResult(self, seq, file_path, res):
+        self.__future.set_result(res)
+
+
+# 将检测结果连同检测对象放入队列
+class _QueueCallback(IDetectResultCallback):
+    def __init__(self, done, item):
+        self.__done = done
+        self.__item = item
+
+
+    def onScanResult(self, seq, file_path, res):
+        self.__done.put((self.__item, res))
 
 
 class OpenAPIDetector(TaskCallback):
@@ -48,14 +86,28 @@ class OpenAPIDetector(TaskCallback):
         self.is_inited = False
         self.client = None
         self.client_opt = None
-        self.queue = None
+        self.pipeline = None
+        self.delay_queue = None
+        self.poll_scheduler = None
+        self.rate_limiter = None
+        self.verdict_cache = None
+        self.verdict_store = None
+        self.hash_cache = None
+        self.lookup_batcher = None
+        self.upload_url_batcher = None
+        self.hash_batcher = None
+        self.callback_dispatcher = None
+        self.http_session = None
+        self.metrics = Metrics() # 反初始化后仍保留，可获取最终的指标
 
-        self.__threadpool = None
+        self.__hash_executor = None
+        self.__metrics_server = None
         self.__counter = 0
         self.__rej_handler = None
         self.__decompress = None
         self.__config = Config()
         self.__alive_task_num = 0
+        self.__inflight = {} # md5 -> 进行中的任务
 
         self.sync_obj = SyncObject()
 
@@ -71,65 +123,195 @@ class OpenAPIDetector(TaskCallback):
     def init(self, accessKeyId, accessKeySecret, securityToken=None, regionId="cn-shanghai"):
         if self.is_inited:
             return ERR_CODE.ERR_INIT
-        
-        if securityToken is None:
-            openapi_config = open_api_models.Config(accessKeyId, accessKeySecret)
-        else:
-            openapi_config = open_api_models.Config(accessKeyId, accessKeySecret, securityToken)
-        
-        openapi_config.endpoint = "tds.aliyuncs.com"
-        if "-" in regionId:
-            if regionId.startswith("cn-"):
-                openapi_config.endpoint = "tds.aliyuncs.com"
-            else:
-                openapi_config.endpoint = "tds.ap-southeast-1.aliyuncs.com"
 
+        verdict_store = None
+        hash_cache = None
+        try:
+            if self.__config.VERDICT_STORE_PATH is not None:
+                verdict_store = VerdictStore(self.__config.VERDICT_STORE_PATH, self.__config.VERDICT_CACHE_BLACK_TTL,
+                                             self.__config.VERDICT_CACHE_WHITE_TTL, self.__config.VERDICT_CACHE_ERROR_TTL)
+                verdict_store.compact()
+            hash_cache = HashCache(self.__config.HASH_CACHE_PATH, self.__config.HASH_CACHE_XATTR)
+        except sqlite3.Error as e:
+            logging.exception(e)
+            if verdict_store is not None:
+                verdict_store.close()
+            return ERR_CODE.ERR_INIT
+
+        self.metrics = Metrics()
+        self.metrics.addGauge(self.__collectGauges)
+        if self.__config.METRICS_PORT > 0:
+            try:
+                self.__metrics_server = MetricsServer(self.metrics, self.__config.METRICS_HOST, self.__config.METRICS_PORT)
+            except OSError as e:
+                logging.exception(e)
+                if verdict_store is not None:
+                    verdict_store.close()
+                hash_cache.close()
+                return ERR_CODE.ERR_INIT
+            self.__metrics_server.start()
+        
+        openapi_config = OpenAPIDetector.createOpenApiConfig(accessKeyId, accessKeySecret, securityToken, regionId,
+                                                             self.__config.ENDPOINT, self.__config.PROTOCOL)
         self.client = Sas20181203Client(openapi_config)
         self.client_opt = util_models.RuntimeOptions()
         self.client_opt.connectTimeout = self.__config.HTTP_CONNECT_TIMEOUT
         
         self.client_opt.readTimeout = self.__config.HTTP_READ_TIMEOUT
 
+        self.http_session = self.__create_http_session()
+        self.rate_limiter = RateLimiter(self.__config.API_QPS, self.__config.REQUEST_TOO_FREQUENTLY_SLEEP_TIME / 1000.0)
+        self.verdict_cache = VerdictCache(self.__config.VERDICT_CACHE_SIZE, self.__config.VERDICT_CACHE_BLACK_TTL,
+                                          self.__config.VERDICT_CACHE_WHITE_TTL, self.__config.VERDICT_CACHE_ERROR_TTL)
+        self.verdict_store = verdict_store
+        self.hash_cache = hash_cache if hash_cache.isEnabled() else None
+
         class TaskRejectedExecutionHandler(RejectedExecutionHandler):
             def rejectedExecution(self, r, executor):
                 if isinstance(r, ScanTask):
                     r.errorCallback(ERR_CODE.ERR_ABORT, None)
         self.__rej_handler = TaskRejectedExecutionHandler()
         
-        self.queue = BlockingDeque()
-        self.__threadpool = MiniThreadPoolExecutor(self.queue, self.__config.THREAD_POOL_SIZE)
-        self.__threadpool.prestartAllThreads()
-        self.__threadpool.setRejectedExecutionHandler(self.__rej_handler)
+        # 计算md5、上传文件、处理检测结果分别在独立的阶段执行，查询检测结果由批量查询线程执行
+        self.pipeline = Pipeline(self.__rej_handler)
+        self.pipeline.addStage(ScanTask.STAGE_HASH, self.__getHashThreadNum())
+        self.pipeline.addStage(ScanTask.STAGE_UPLOAD, self.__getUploadThreadNum())
+        self.pipeline.addStage(ScanTask.STAGE_POLL, self.__getPollThreadNum())
+
+        self.delay_queue = DelayQueue(self.dispatch)
+        self.delay_queue.setRejectedExecutionHandler(self.__rej_handler)
+        self.delay_queue.start()
+        self.poll_scheduler = PollScheduler(self.__config.QUERY_RESULT_INTERVAL, self.__config.QUERY_RESULT_INTERVAL_MAX)
+
+        self.lookup_batcher = LookupBatcher(self, self.__config)
+        self.lookup_batcher.start()
+        self.upload_url_batcher = UploadUrlBatcher(self, self.__config)
+        self.upload_url_batcher.start()
+        if self.__config.HASH_BACKEND == "process":
+            process_num = self.__config.HASH_PROCESS_NUM if self.__config.HASH_PROCESS_NUM > 0 else (os.cpu_count() or 1)
+            self.__hash_executor = self.__create_process_pool(process_num)
+            self.hash_batcher = HashBatcher(self, self.__config, self.__hash_executor, process_num)
+            self.hash_batcher.start()
+        if self.__config.CALLBACK_THREAD_NUM > 0:
+            self.callback_dispatcher = CallbackDispatcher(self.__config)
+            self.callback_dispatcher.start()
         
         self.__counter = 0
         self.__alive_task_num = 0
+        self.__inflight = {}
         self.is_inited = True
         return ERR_CODE.ERR_SUCC
     
 
+    # 根据可用区创建API客户端配置，指定endpoint时使用指定的服务地址
+    @staticmethod
+    def createOpenApiConfig(accessKeyId, accessKeySecret, securityToken=None, regionId="cn-shanghai", endpoint=None, protocol=None):
+        if securityToken is None:
+            openapi_config = open_api_models.Config(accessKeyId, accessKeySecret)
+        else:
+            openapi_config = open_api_models.Config(accessKeyId, accessKeySecret, securityToken)
+        
+        openapi_config.endpoint = "tds.aliyuncs.com"
+        if "-" in regionId:
+            if regionId.startswith("cn-"):
+                openapi_config.endpoint = "tds.aliyuncs.com"
+            else:
+                openapi_config.endpoint = "tds.ap-southeast-1.aliyuncs.com"
+        if endpoint is not None:
+            openapi_config.endpoint = endpoint
+        if protocol is not None:
+            openapi_config.protocol = protocol
+        return openapi_config
+
+
     # 检测器反初始化
     def uninit(self):
         if self.is_inited is False:
             return
         
         self.is_inited = False
-        self.__threadpool.shutdown()
+        with self.sync_obj:
+            self.sync_obj.notifyAll() # 唤醒等待队列的调用方
+        self.delay_queue.shutdown()
+        self.lookup_batcher.shutdown()
+        self.upload_url_batcher.shutdown()
+        if self.hash_batcher is not None:
+            self.hash_batcher.shutdown()
+            self.__hash_executor.shutdown()
+        self.pipeline.shutdown()
+        # 最后停止回调分发器，检测线程停止时中止的任务也能得到回调
+        if self.callback_dispatcher is not None:
+            self.callback_dispatcher.shutdown()
+        if self.__metrics_server is not None:
+            self.__metrics_server.shutdown()
+            self.__metrics_server = None
 
         with self.sync_obj:
-            self.__threadpool = None
+            self.lookup_batcher = None
+            self.upload_url_batcher = None
+            self.hash_batcher = None
+            self.callback_dispatcher = None
+            self.__hash_executor = None
+            self.pipeline = None
             self.__rej_handler = None
-            self.queue = None
+            self.delay_queue = None
+            self.poll_scheduler = None
+            self.rate_limiter = None
+            self.verdict_cache = None
+            if self.verdict_store is not None:
+                self.verdict_store.close()
+                self.verdict_store = None
+            if self.hash_cache is not None:
+                self.hash_cache.close()
+                self.hash_cache = None
             self.client = None
             self.client_opt = None
+            if self.http_session is not None:
+                self.http_session.close()
+                self.http_session = None
     
     """
     初始化全局配置参数
     @param thread_pool_size 线程池大小，可选
     @param queue_size_max 查询检测结果间隔时间，单位为毫秒，可选
-    @param request_too_frequently_sleep_time 单样本请求太过频繁时，需要休眠时间，单位为毫秒，可选
+    @param request_too_frequently_sleep_time 请求太过频繁被限流后，暂停调用该API的时间，单位为毫秒，可选
     @param http_connect_timeout 建立连接后，等待服务器响应的超时时间，单位为毫秒，可选
     @param http_read_timeout 建立连接后，等待服务器响应的超时时间，单位为毫秒，可选
     @param http_upload_timeout 上传文件超时时间，单位为毫秒，可选
+    @param lookup_batch_size 批量查询检测结果时单次请求的最大md5个数，可选
+    @param lookup_batch_linger 批量查询凑批等待时间，单位为毫秒，可选
+    @param lookup_thread_num 批量查询线程数，可选
+    @param upload_url_batch_size 批量获取上传地址时单次请求的最大文件个数，可选
+    @param upload_url_batch_linger 批量获取上传地址凑批等待时间，单位为毫秒，可选
+    @param upload_url_thread_num 批量获取上传地址线程数，可选
+    @param md5_buffer_size 计算文件md5时的读缓冲区大小，单位为字节，可选
+    @param http_pool_size 上传文件连接池大小，<= 0 时与线程池大小一致，可选
+    @param http_keep_alive 上传文件是否复用连接，可选
+    @param adaptive_poll 是否根据同类样本的检测耗时自适应调整查询检测结果间隔，可选
+    @param query_result_interval_max 自适应查询检测结果的最大间隔，单位为毫秒，可选
+    @param api_qps API调用频率上限，单位为次/秒，数字表示每个API相同，dict按API名称分别设置，None使用默认上限，<= 0 不限速，可选
+    @param verdict_cache_size 检测结果缓存最大个数，0表示不缓存，可选
+    @param verdict_cache_black_ttl 黑样本检测结果缓存有效期，单位为毫秒，可选
+    @param verdict_cache_white_ttl 白样本检测结果缓存有效期，单位为毫秒，可选
+    @param verdict_cache_error_ttl 调用API错误结果缓存有效期，单位为毫秒，0表示不缓存，可选
+    @param verdict_store_path 持久化检测结果库文件路径，进程重启后仍可使用，多个进程可共用，None表示不启用，可选
+    @param hash_cache_path 文件md5缓存的SQLite文件路径，文件未变化时不再计算md5，None表示不使用，可选
+    @param hash_cache_xattr 是否将文件md5保存在文件扩展属性(user.*)中，仅Linux支持，可选
+    @param hash_thread_num 计算md5阶段线程数，<= 0 时与CPU核数一致，可选
+    @param upload_thread_num 上传文件并发起检测阶段线程数，<= 0 时与线程池大小一致，可选
+    @param poll_thread_num 处理检测结果阶段线程数，<= 0 时为线程池大小的1/4，可选
+    @param hash_backend 计算md5的方式，"thread"使用线程，"process"使用进程池，适合大量小文件，需Python 3.7及以上，可选
+    @param hash_process_num 计算md5的进程数，<= 0 时与CPU核数一致，hash_backend为"process"时生效，可选
+    @param hash_batch_size 每次提交到进程池的最大文件个数，可选
+    @param hash_process_min_batch 批量小于该值时不提交到进程池，在线程中计算，可选
+    @param callback_thread_num 回调分发线程数，> 0 时由独立的线程回调检测结果，<= 0 时在检测线程中直接回调，可选
+    @param callback_queue_size 等待回调的最大结果数，队列满时检测线程等待，可选
+    @param callback_batch_size 批量回调接口单次返回的最大结果数，可选
+    @param callback_batch_linger 批量回调凑批等待时间，单位为毫秒，可选
+    @param metrics_port 指标HTTP服务端口，> 0 时通过 GET /metrics 提供Prometheus文本格式的指标，可选
+    @param metrics_host 指标HTTP服务监听地址，可选
+    @param endpoint API服务地址，如"127.0.0.1:8080"，默认按regionId选择，可选
+    @param protocol API请求协议，"https"或"http"，可选
     """
     def initConfig(
             self, 
@@ -139,10 +321,48 @@ class OpenAPIDetector(TaskCallback):
             request_too_frequently_sleep_time = 100,
             http_connect_timeout = 6000,
             http_read_timeout = 6000, 
-            http_upload_timeout = 60000
+            http_upload_timeout = 60000,
+            lookup_batch_size = 50,
+            lookup_batch_linger = 10,
+            lookup_thread_num = 4,
+            upload_url_batch_size = 50,
+            upload_url_batch_linger = 10,
+            upload_url_thread_num = 2,
+            md5_buffer_size = 1048576,
+            http_pool_size = 0,
+            http_keep_alive = True,
+            adaptive_poll = True,
+            query_result_interval_max = 5000,
+            api_qps = None,
+            verdict_cache_size = 0,
+            verdict_cache_black_ttl = 86400000,
+            verdict_cache_white_ttl = 3600000,
+            verdict_cache_error_ttl = 0,
+            verdict_store_path = None,
+            hash_cache_path = None,
+            hash_cache_xattr = False,
+            hash_thread_num = 0,
+            upload_thread_num = 0,
+            poll_thread_num = 0,
+            hash_backend = "thread",
+            hash_process_num = 0,
+            hash_batch_size = 32,
+            hash_process_min_batch = 8,
+            callback_thread_num = 0,
+            callback_queue_size = 10000,
+            callback_batch_size = 100,
+            callback_batch_linger = 10,
+            metrics_port = 0,
+            metrics_host = "127.0.0.1",
+            endpoint = None,
+            protocol = None
         ):
         if self.is_inited is True:
             return ERR_CODE.ERR_INIT
+        if hash_backend not in ("thread", "process"):
+            return ERR_CODE.ERR_INIT
+        if hash_backend == "process" and sys.version_info < (3, 7):
+            return ERR_CODE.ERR_INIT # 进程池需指定spawn启动方式，mp_context参数要求Python 3.7及以上
         self.__config = Config(
             thread_pool_size = thread_pool_size,
             queue_size_max = queue_size_max,
@@ -150,7 +370,41 @@ class OpenAPIDetector(TaskCallback):
             request_too_frequently_sleep_time = request_too_frequently_sleep_time,
             http_connect_timeout = http_connect_timeout,
             http_read_timeout = http_read_timeout,
-            http_upload_timeout = http_upload_timeout
+            http_upload_timeout = http_upload_timeout,
+            lookup_batch_size = lookup_batch_size,
+            lookup_batch_linger = lookup_batch_linger,
+            lookup_thread_num = lookup_thread_num,
+            upload_url_batch_size = upload_url_batch_size,
+            upload_url_batch_linger = upload_url_batch_linger,
+            upload_url_thread_num = upload_url_thread_num,
+            md5_buffer_size = md5_buffer_size,
+            http_pool_size = http_pool_size,
+            http_keep_alive = http_keep_alive,
+            adaptive_poll = adaptive_poll,
+            query_result_interval_max = query_result_interval_max,
+            api_qps = api_qps,
+            verdict_cache_size = verdict_cache_size,
+            verdict_cache_black_ttl = verdict_cache_black_ttl,
+            verdict_cache_white_ttl = verdict_cache_white_ttl,
+            verdict_cache_error_ttl = verdict_cache_error_ttl,
+            verdict_store_path = verdict_store_path,
+            hash_cache_path = hash_cache_path,
+            hash_cache_xattr = hash_cache_xattr,
+            hash_thread_num = hash_thread_num,
+            upload_thread_num = upload_thread_num,
+            poll_thread_num = poll_thread_num,
+            hash_backend = hash_backend,
+            hash_process_num = hash_process_num,
+            hash_batch_size = hash_batch_size,
+            hash_process_min_batch = hash_process_min_batch,
+            callback_thread_num = callback_thread_num,
+            callback_queue_size = callback_queue_size,
+            callback_batch_size = callback_batch_size,
+            callback_batch_linger = callback_batch_linger,
+            metrics_port = metrics_port,
+            metrics_host = metrics_host,
+            endpoint = endpoint,
+            protocol = protocol
         )
         return ERR_CODE.ERR_SUCC
 
@@ -188,46 +442,143 @@ class OpenAPIDetector(TaskCallback):
 
 
     def __internalDetectSync(self, file_path, md5, timeout):
-        res = []
-        res.append(DetectResult())
-        detect_sync_obj = SyncObject()
-        class SyncTaskCallback(IDetectResultCallback):
-            def onScanResult(self, seq, file_path, callback_res):
-                res[0] = callback_res
-                with detect_sync_obj:
-                    detect_sync_obj.notify()
-        
-        seq = 0
         if md5 is None:
             # 本地文件检测
-            seq = self.detect(file_path, timeout, SyncTaskCallback())
+            return self.submit(file_path, timeout).result()
+        # URL文件检测
+        return self.submitUrl(file_path, md5, timeout).result()
+
+
+    """
+    提交文件检测，通过Future获取检测结果
+    发起检测失败时（如队列满、文件不存在）Future同样会完成，检测结果中的error_code为对应的错误码
+    @param file_path 待检测文件路径
+    @param timeout 超时时长，单位毫秒， < 0 无限等待
+    @param block 检测队列满时是否等待队列可用，参见detect，可选
+    @param block_timeout 等待队列可用的超时时长，单位毫秒， < 0 无限等待，可选
+    @return concurrent.futures.Future，结果为DetectResult。检测已开始，不支持取消
+    """
+    def submit(self, file_path, timeout=-1, block=False, block_timeout=-1):
+        future = self.__createFuture()
+        self.__detectFile(file_path, timeout, _FutureCallback(future), block, block_timeout)
+        return future
+
+
+    """
+    提交URL文件检测，通过Future获取检测结果
+    @param url 待检测文件下载链接URL
+    @param md5 文件md5
+    @param timeout 超时时长，单位毫秒， < 0 无限等待
+    @param block 检测队列满时是否等待队列可用，参见detect，可选
+    @param block_timeout 等待队列可用的超时时长，单位毫秒， < 0 无限等待，可选
+    @return concurrent.futures.Future，结果为DetectResult。检测已开始，不支持取消
+    """
+    def submitUrl(self, url, md5, timeout=-1, block=False, block_timeout=-1):
+        future = self.__createFuture()
+        self.__detectUrl(url, md5, timeout, _FutureCallback(future), block, block_timeout)
+        return future
+
+
+    """
+    按完成顺序返回submit、submitUrl提交的Future，同concurrent.futures.as_completed
+    @param futures Future列表
+    @param timeout 等待时长，单位为秒，None表示无限等待，超时抛出concurrent.futures.TimeoutError
+    """
+    @staticmethod
+    def asCompleted(futures, timeout=None):
+        return futures_as_completed(futures, timeout)
+
+
+    """
+    等待submit、submitUrl提交的Future完成，同concurrent.futures.wait
+    @param futures Future列表
+    @param timeout 等待时长，单位为秒，None表示无限等待
+    @param return_when FIRST_COMPLETED 任一完成时返回 ALL_COMPLETED 全部完成时返回
+    @return (已完成的Future集合, 未完成的Future集合)
+    """
+    @staticmethod
+    def wait(futures, timeout=None, return_when=ALL_COMPLETED):
+        return futures_wait(futures, timeout, return_when)
+
+
+    """
+    批量检测，按完成顺序逐个返回检测结果
+    items按需读取，进行中的检测数不超过max_pending，内存占用与items的长度无关
+    检测队列被其他调用方占满时，等待队列可用后再发起检测
+    提前结束迭代时，已发起的检测仍会完成，结果被丢弃
+    @param items 可迭代对象，元素为本地文件路径，或(URL, md5)表示URL文件
+    @param timeout 单个样本的超时时长，单位毫秒， < 0 无限等待
+    @param max_pending 进行中的最大检测数，<= 0 时与队列最大个数一致
+    @return 生成器，逐个返回(文件路径或URL, DetectResult)
+    """
+    def detectMany(self, items, timeout=-1, max_pending=0):
+        if max_pending <= 0:
+            max_pending = self.__config.QUEUE_SIZE_MAX
+        done = queue.Queue()
+        items = iter(items)
+        pending = 0
+        exhausted = False
+        while True:
+            while not exhausted and pending < max_pending:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self.__detectItem(item, timeout, done)
+                pending += 1
+            if pending == 0:
+                return
+            item, result = done.get()
+            pending -= 1
+            yield (item[0] if isinstance(item, tuple) else item, result)
+
+
+    def __detectItem(self, item, timeout, done):
+        callback = _QueueCallback(done, item)
+        if isinstance(item, tuple):
+            self.__detectUrl(item[0], item[1], timeout, callback, True, -1)
         else:
-            # URL文件检测
-            seq = self.detectUrl(file_path, md5, timeout, SyncTaskCallback())
-        if seq > 0:
-            try:
-                with detect_sync_obj:
-                    detect_sync_obj.wait()
-            except Exception as e:
-                pass
-        return res[0]
+            self.__detectFile(item, timeout, callback, True, -1)
+
+
+    # 检测在提交时即开始，Future直接置为运行状态
+    def __createFuture(self):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        return future
     
 
     """
     异步文件检测
     @param file_path 待检测文件路径
     @param timeout 超时时长，单位毫秒， < 0 无限等待
-    @param callback 检测结果
+    @param callback 检测结果，IDetectResultCallback或IDetectResultBatchCallback
+    @param block 检测队列满时是否等待队列可用，False表示直接返回ERR_DETECT_QUEUE_FULL，可选
+    @param block_timeout 等待队列可用的超时时长，单位毫秒， < 0 无限等待，block为True时生效，可选
+           等待时间计入检测的超时时长
     @return >0 发起检测成功，检测请求序列号 < 0 错误码，参见ERR_CODE
     """
-    def detect(self, file_path, timeout, callback):
+    def detect(self, file_path, timeout, callback, block=False, block_timeout=-1):
+        return self.__detectFile(file_path, timeout, self.__wrapCallback(callback), block, block_timeout)
+
+
+    def __detectFile(self, file_path, timeout, callback, block, block_timeout):
         file_size = self.__get_filesize(file_path)
         task = ScanTask()
         task.initScanFile(file_path, file_size, timeout, callback, self.__decompress, self.__config)
         if file_size < 0:
             task.errorCallback(ERR_CODE.ERR_FILE_NOT_FOUND, file_path)
             return ERR_CODE.ERR_FILE_NOT_FOUND.value
-        return self.__internalDetect(task)
+        # 文件未变化时直接使用缓存的md5，检测结果也已缓存时不再加入检测队列
+        hash_cache = self.hash_cache
+        md5 = hash_cache.get(file_path) if hash_cache is not None else None
+        if md5 is not None:
+            task.setMd5(md5)
+            cached = self.getCachedVerdict(md5)
+            if cached is not None:
+                return self.__detectFromCache(task, cached)
+        return self.__internalDetect(task, block, block_timeout)
 
     
     """
@@ -235,10 +586,28 @@ class OpenAPIDetector(TaskCallback):
     @param url 待检测文件下载链接URL
 	@param md5 文件md5
 	@param timeout 超时时长，单位毫秒， < 0 无限等待
-	@param callback 检测结果
+	@param callback 检测结果，IDetectResultCallback或IDetectResultBatchCallback
+	@param block 检测队列满时是否等待队列可用，False表示直接返回ERR_DETECT_QUEUE_FULL，可选
+	@param block_timeout 等待队列可用的超时时长，单位毫秒， < 0 无限等待，block为True时生效，可选
 	@return >0 发起检测成功，检测请求序列号 < 0 错误码，参见ERR_CODE
     """
-    def detectUrl(self, url, md5, timeout, callback):
+    def detectUrl(self, url, md5, timeout, callback, block=False, block_timeout=-1):
+        return self.__detectUrl(url, md5, timeout, self.__wrapCallback(callback), block, block_timeout)
+
+
+    # 启用回调分发线程时，调用方的回调交由分发线程执行
+    def __wrapCallback(self, callback):
+        if callback is None:
+            return None
+        callback_dispatcher = self.callback_dispatcher
+        if callback_dispatcher is not None:
+            return callback_dispatcher.wrap(callback)
+        if isinstance(callback, IDetectResultBatchCallback):
+            return BatchCallbackAdapter(callback)
+        return callback
+
+
+    def __detectUrl(self, url, md5, timeout, callback, block, block_timeout):
         if md5 is not None:
             # 转小写
             md5 = md5.lower()
@@ -254,10 +623,29 @@ class OpenAPIDetector(TaskCallback):
         if self.__is_valid_url(url) is False:
             task.errorCallback(ERR_CODE.ERR_URL, "Malformed URL: {}".format(url))
             return ERR_CODE.ERR_URL.value
-        return self.__internalDetect(task)
+        cached = self.getCachedVerdict(md5) if self.is_inited else None
+        if cached is not None:
+            return self.__detectFromCache(task, cached)
+        return self.__internalDetect(task, block, block_timeout)
+
+
+    # 检测结果缓存命中，不再加入检测队列，直接返回结果
+    def __detectFromCache(self, task, cached):
+        seq = 0
+        with self.sync_obj:
+            if self.is_inited:
+                self.__counter += 1
+                self.__check_counter()
+                task.setSeq(self.__counter)
+                seq = task.getSeq()
+        if seq <= 0:
+            task.errorCallback(ERR_CODE.ERR_INIT, None)
+            return ERR_CODE.ERR_INIT.value
+        task.sharedResultCallback(cached)
+        return seq
     
 
-    def __internalDetect(self, task):
+    def __internalDetect(self, task, block, block_timeout):
         seq = 0
         try:
             if self.is_inited:
@@ -266,13 +654,13 @@ class OpenAPIDetector(TaskCallback):
                         self.__counter += 1
                         self.__check_counter()
                         task.setSeq(self.__counter)
-                        if self.getQueueSize() >= self.__config.QUEUE_SIZE_MAX:
+                        if not self.__waitQueue(self.__isQueueAvailable, block_timeout if block else 0):
                             raise RuntimeError("Deque full")
-                        task.setTaskCallback(self)
-                        self.queue.addLast(task)
-                        with self.queue:
-                            self.queue.notify()
-                        seq = task.getSeq()
+                        # 等待期间检测器可能已反初始化
+                        if self.is_inited:
+                            task.setTaskCallback(self)
+                            self.dispatch(task)
+                            seq = task.getSeq()
         except RuntimeError as e:
             task.errorCallback(ERR_CODE.ERR_DETECT_QUEUE_FULL, None)
             return ERR_CODE.ERR_DETECT_QUEUE_FULL.value
@@ -283,6 +671,137 @@ class OpenAPIDetector(TaskCallback):
         return seq
 
 
+    """
+    @brief 获取检测结果缓存统计信息
+    @return dict，包括size(缓存个数) hits(命中次数) misses(未命中次数) evictions(淘汰次数)，未初始化时返回None
+    """
+    def getVerdictCacheStats(self):
+        verdict_cache = self.verdict_cache
+        if verdict_cache is None:
+            return None
+        return verdict_cache.getStats()
+
+
+    """
+    @brief 获取持久化检测结果库统计信息
+    @return dict，包括hits(命中次数) misses(未命中次数)，未启用时返回None
+    """
+    def getVerdictStoreStats(self):
+        verdict_store = self.verdict_store
+        if verdict_store is None:
+            return None
+        return verdict_store.getStats()
+
+
+    """
+    @brief 获取运行指标快照
+    @return dict，包括histograms(直方图) counters(计数器) gauges(仪表盘)，各项为 指标名{标签} -> 值
+            直方图的值为dict，包括count sum avg max p50 p90 p99。耗时单位为毫秒
+            主要指标：queue_wait_ms(排队时间) hash_time_ms(计算md5耗时) api_latency_ms{action}(API调用耗时)
+            upload_time_ms(上传耗时) upload_bytes(上传大小) poll_count(发起检测后的查询次数)
+            service_latency_ms(服务端检测耗时) detect_latency_ms{result}(端到端检测耗时)
+            throttles_total{action}(被限流次数) retries_total{reason}(重试次数) results_total{result}(检测结果数)
+            errors_total{code}(错误数) queue_size(检测队列长度) stage_*{stage}(流水线各阶段状态) api_rate{action}(API调用速率)
+    """
+    def getMetrics(self):
+        return self.metrics.snapshot()
+
+
+    """
+    @brief 获取Prometheus文本格式的运行指标
+    @return 字符串
+    """
+    def getMetricsText(self):
+        return self.metrics.toPrometheus()
+
+
+    def __collectGauges(self):
+        series = [("queue_size", None, self.getQueueSize())]
+        stats = self.getStageStats()
+        if stats is not None:
+            for stage, stage_stats in stats.items():
+                for key in ("queue_size", "active", "threads"):
+                    if key in stage_stats:
+                        series.append(("stage_" + key, {"stage": stage}, stage_stats[key]))
+        rate_limiter = self.rate_limiter
+        if rate_limiter is not None:
+            for action, rate in rate_limiter.getRates().items():
+                series.append(("api_rate", {"action": action}, rate))
+        return series
+
+
+    """
+    @brief 获取文件md5缓存统计信息
+    @return dict，包括hits(命中次数) misses(未命中次数)，未启用时返回None
+    """
+    def getHashCacheStats(self):
+        hash_cache = self.hash_cache
+        if hash_cache is None:
+            return None
+        return hash_cache.getStats()
+
+
+    """
+    @brief 清理持久化检测结果库中过期的结果
+    @return 参见ERR_CODE
+    """
+    def compactVerdictStore(self):
+        return self.__callVerdictStore(lambda store: store.compact())
+
+
+    """
+    @brief 导出持久化检测结果库快照，可在其他节点导入用于预热
+    @param path 快照文件路径，已存在时覆盖
+    @return 参见ERR_CODE
+    """
+    def exportVerdictStore(self, path):
+        return self.__callVerdictStore(lambda store: store.exportSnapshot(path))
+
+
+    """
+    @brief 导入持久化检测结果库快照，本地已有且有效期更长的结果保留不变
+    @param path 快照文件路径
+    @return 参见ERR_CODE
+    """
+    def importVerdictStore(self, path):
+        return self.__callVerdictStore(lambda store: store.importSnapshot(path))
+
+
+    def __callVerdictStore(self, func):
+        verdict_store = self.verdict_store
+        if verdict_store is None:
+            return ERR_CODE.ERR_INIT
+        try:
+            func(verdict_store)
+        except sqlite3.Error as e:
+            logging.exception(e)
+            return ERR_CODE.ERR_CALL_API
+        return ERR_CODE.ERR_SUCC
+
+
+    """
+    @brief 获取检测流水线各阶段的统计信息
+    @return dict，阶段名称 -> dict，包括threads(线程数) active(正在执行的任务数) queue_size(排队的任务数)
+            completed(已执行的任务数) busy_time(执行任务的累计耗时，单位为毫秒)
+            其中lookup(批量查询)、upload_url(批量获取上传地址)、delay(等待下一次查询)、hash_process(等待提交到进程池)、
+            callback(等待回调)只包括queue_size
+            未初始化时返回None
+    """
+    def getStageStats(self):
+        with self.sync_obj:
+            if not self.is_inited:
+                return None
+            stats = self.pipeline.getStats()
+            stats["lookup"] = {"queue_size": self.lookup_batcher.qsize()}
+            stats["upload_url"] = {"queue_size": self.upload_url_batcher.qsize()}
+            stats["delay"] = {"queue_size": self.delay_queue.qsize()}
+            if self.hash_batcher is not None:
+                stats["hash_process"] = {"queue_size": self.hash_batcher.qsize()}
+            if self.callback_dispatcher is not None:
+                stats["callback"] = {"queue_size": self.callback_dispatcher.qsize()}
+            return stats
+
+
     """
     @brief 获取检测队列长度
     @return 检测队列长度
@@ -301,24 +820,9 @@ class OpenAPIDetector(TaskCallback):
     @return ERR_SUCC 成功，队列已有可用空间 ERR_TIMEOUT 失败，队列仍然满
     """
     def waitQueueAvailable(self, timeout):
-        code = ERR_CODE.ERR_TIMEOUT
-        all_time = 0
-        while True:
-            if self.getQueueSize() < self.__config.QUEUE_SIZE_MAX:
-                code = ERR_CODE.ERR_SUCC
-                break
-            
-            if timeout >= 0 and all_time >= timeout:
-                break
-            
-            sleep_unit = 200
-            if timeout >= 0 and timeout > all_time and (timeout-all_time<sleep_unit):
-                sleep_unit = timeout - all_time
-            start_time = self.__current_time_millis()
-            time.sleep(sleep_unit/1000.0)
-            all_time += self.__current_time_millis() - start_time
-        
-        return code
+        if self.__waitQueue(self.__isQueueAvailable, timeout):
+            return ERR_CODE.ERR_SUCC
+        return ERR_CODE.ERR_TIMEOUT
     
 
     """
@@ -327,30 +831,151 @@ class OpenAPIDetector(TaskCallback):
     @return ERR_SUCC 成功，队列已空，所有检测工作完成 ERR_TIMEOUT 失败，队列中仍然有检测任务
     """
     def waitQueueEmpty(self, timeout):
-        code = ERR_CODE.ERR_TIMEOUT
-        all_time = 0
-        while True:
-            if self.getQueueSize() == 0:
-                code = ERR_CODE.ERR_SUCC
-                break
-
-            if timeout >=0 and all_time >= timeout:
-                break
-
-            sleep_unit = 200
-            if timeout >= 0 and timeout > all_time and (timeout-all_time<sleep_unit):
-                sleep_unit = timeout - all_time
-            start_time = self.__current_time_millis()
-            time.sleep(sleep_unit/1000.0)
-            all_time += self.__current_time_millis() - start_time
-        return code
+        start_time = time.monotonic()
+        if not self.__waitQueue(lambda: self.__alive_task_num == 0, timeout):
+            return ERR_CODE.ERR_TIMEOUT
+        # 启用回调分发线程时，还需等待检测结果全部回调完成
+        callback_dispatcher = self.callback_dispatcher
+        if callback_dispatcher is not None:
+            remaining = None
+            if timeout >= 0:
+                remaining = max(0, timeout / 1000.0 - (time.monotonic() - start_time))
+            if not callback_dispatcher.waitIdle(remaining):
+                return ERR_CODE.ERR_TIMEOUT
+        return ERR_CODE.ERR_SUCC
+
+
+    def __isQueueAvailable(self):
+        return self.__alive_task_num < self.__config.QUEUE_SIZE_MAX
+
+
+    """
+    等待队列满足条件，任务结束、反初始化时唤醒，不再定时轮询
+    @param predicate 持有sync_obj时调用的条件函数
+    @param timeout 超时时长，单位毫秒， < 0 无限等待
+    @return True 条件已满足或检测器未初始化 False 超时
+    """
+    def __waitQueue(self, predicate, timeout):
+        deadline = time.monotonic() + timeout / 1000.0 if timeout >= 0 else None
+        with self.sync_obj:
+            while self.is_inited and not predicate():
+                if deadline is None:
+                    self.sync_obj.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.sync_obj.wait(remaining)
+        return True
     
 
+    # 按任务当前的状态分发到流水线的对应阶段，检测器已停止时返回ERR_ABORT
+    def dispatch(self, task):
+        pipeline = self.pipeline
+        if pipeline is None:
+            if isinstance(task, ScanTask):
+                task.errorCallback(ERR_CODE.ERR_ABORT, None)
+            return
+        stage = task.getStage() if isinstance(task, ScanTask) else ScanTask.STAGE_POLL
+        pipeline.submit(stage, task)
+
+
+    def __getHashThreadNum(self):
+        if self.__config.HASH_THREAD_NUM > 0:
+            return self.__config.HASH_THREAD_NUM
+        return os.cpu_count() or 1
+
+
+    def __getUploadThreadNum(self):
+        if self.__config.UPLOAD_THREAD_NUM > 0:
+            return self.__config.UPLOAD_THREAD_NUM
+        return self.__config.THREAD_POOL_SIZE
+
+
+    def __getPollThreadNum(self):
+        if self.__config.POLL_THREAD_NUM > 0:
+            return self.__config.POLL_THREAD_NUM
+        return max(1, self.__config.THREAD_POOL_SIZE // 4)
+
+
+    """
+    相同md5的任务只检测一次：没有进行中的任务时，本任务登记为进行中；否则合并到进行中的任务，等待其结果
+    @return True 已合并到进行中的任务 False 本任务需要继续检测
+    """
+    def joinInflight(self, task):
+        with self.sync_obj:
+            leader = self.__inflight.get(task.getMd5())
+            if leader is None:
+                self.__inflight[task.getMd5()] = task
+                return False
+            leader.addWaiter(task)
+        task.scheduleWaiterTimeout(self.delay_queue)
+        return True
+
+
     def onTaskEnd(self, task):
-        if self.is_inited:
-            with self.sync_obj:
-                if self.is_inited:
-                    self.__alive_task_num -= 1
+        waiters = []
+        with self.sync_obj:
+            if self.is_inited:
+                self.__alive_task_num -= 1
+                self.sync_obj.notifyAll()
+            leader = self.__inflight.get(task.getMd5())
+            if leader is task:
+                del self.__inflight[task.getMd5()]
+                waiters = task.takeWaiters()
+            elif leader is not None:
+                leader.removeWaiter(task)
+        self.__recordResult(task.getResult())
+        if not task.isSharedResult():
+            self.__saveVerdict(task.getMd5(), task.getResult())
+        if len(waiters) > 0:
+            self.__notifyWaiters(task, waiters)
+
+
+    # 查询已有的检测结果，先查内存缓存，再查持久化结果库，结果库命中时同时放入内存缓存
+    def getCachedVerdict(self, md5):
+        verdict_cache = self.verdict_cache
+        verdict_store = self.verdict_store
+        cached = verdict_cache.get(md5) if verdict_cache is not None else None
+        if cached is None and verdict_store is not None:
+            cached = verdict_store.get(md5)
+            if cached is not None and verdict_cache is not None:
+                verdict_cache.put(md5, cached)
+        return cached
+
+
+    def __saveVerdict(self, md5, result):
+        verdict_cache = self.verdict_cache
+        if verdict_cache is not None:
+            verdict_cache.put(md5, result)
+        verdict_store = self.verdict_store
+        if verdict_store is not None:
+            verdict_store.put(md5, result)
+
+
+    def __recordResult(self, result):
+        if result.isSucc():
+            label = result.result.name
+            self.metrics.inc("results_total", {"result": label})
+        else:
+            label = result.error_code.name
+            self.metrics.inc("errors_total", {"code": label})
+        self.metrics.observe("detect_latency_ms", result.time, {"result": label})
+
+
+    # 将进行中任务的检测结果分发给合并到该任务的其他任务
+    # 只分发检测成功的结果和服务端针对样本内容返回的错误
+    # 超时、文件未找到、上传失败、URL无法下载等错误只与进行中的任务自身有关，等待的任务重新检测
+    def __notifyWaiters(self, leader, waiters):
+        result = leader.getResult()
+        retry = not result.isSucc() and not leader.isContentError()
+        for waiter in waiters:
+            if retry:
+                self.metrics.inc("retries_total", {"reason": "leader_error"})
+                waiter.resetCoalesced()
+                self.dispatch(waiter)
+            else:
+                waiter.sharedResultCallback(result.copy())
     
 
     def onTaskBegin(self, task):
@@ -360,6 +985,27 @@ class OpenAPIDetector(TaskCallback):
                     self.__alive_task_num += 1
 
 
+    # 创建计算md5的进程池，使用spawn方式启动子进程，避免fork时复制其他线程持有的锁
+    def __create_process_pool(self, process_num):
+        if sys.version_info >= (3, 7):
+            return ProcessPoolExecutor(process_num, mp_context=multiprocessing.get_context("spawn"))
+        return ProcessPoolExecutor(process_num)
+
+
+    # 创建上传文件使用的HTTP会话，各任务共享连接池，避免每次上传重新建立TCP/TLS连接
+    def __create_http_session(self):
+        pool_size = self.__config.HTTP_POOL_SIZE
+        if pool_size <= 0:
+            pool_size = self.__getUploadThreadNum()
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.__config.HTTP_KEEP_ALIVE:
+            session.headers["Connection"] = "close"
+        return session
+
+
     def __current_time_millis(self):
         return int(round(time.time() * 1000))
 
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+from .MiniThreadPool import BlockingDeque, MiniThreadPoolExecutor
+
+
+# 流水线阶段：独立的任务队列和线程池，各阶段的并发数分别设置，互不抢占线程
+class PipelineStage(object):
+    def __init__(self, name, thread_num, rej_handler):
+        self.name = name
+        self.queue = BlockingDeque()
+        self.__rej_handler = rej_handler
+        self.__threadpool = MiniThreadPoolExecutor(self.queue, max(1, thread_num),
+                                                   thread_name_prefix="FileDetect-{}".format(name))
+        self.__threadpool.setRejectedExecutionHandler(rej_handler)
+        self.__threadpool.prestartAllThreads()
+
+
+    def submit(self, item):
+        self.queue.addLast(item)
+
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+    def shutdown(self):
+        self.__threadpool.shutdown()
+
+
+    # 线程池停止后仍留在队列中的任务交由拒绝执行任务接口处理
+    def drain(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Exception as e:
+                return
+            if item is not None and self.__rej_handler is not None:
+                self.__rej_handler.rejectedExecution(item, self)
+
+
+    def getStats(self):
+        threadpool = self.__threadpool
+        return {
+            "threads": threadpool.getPoolSize(),
+            "active": threadpool.getActiveCount(),
+            "queue_size": self.qsize(),
+            "completed": threadpool.getCompletedTaskCount(),
+            "busy_time": int(threadpool.getBusyTime() * 1000)
+        }
+
+
+# 检测流水线：由多个阶段组成，任务按当前状态分发到对应阶段
+class Pipeline(object):
+    def __init__(self, rej_handler):
+        self.__rej_handler = rej_handler
+        self.__stages = {}
+
+
+    def addStage(self, name, thread_num):
+        self.__stages[name] = PipelineStage(name, thread_num, self.__rej_handler)
+
+
+    def submit(self, name, item):
+        self.__stages[name].submit(item)
+
+
+    def qsize(self):
+        return sum(stage.qsize() for stage in self.__stages.values())
+
+
+    # 先停止所有阶段的线程池，再清理各队列，避免任务在阶段之间流转时丢失
+    def shutdown(self):
+        for stage in self.__stages.values():
+            stage.shutdown()
+        for stage in self.__stages.values():
+            stage.drain()
+
+
+    """
+    获取各阶段的统计信息
+    @return dict，阶段名称 -> dict，包括threads(线程数) active(正在执行的任务数) queue_size(排队的任务数)
+            completed(已执行的任务数) busy_time(执行任务的累计耗时，单位为毫秒)
+    """
+    def getStats(self):
+        return dict((name, stage.getStats()) for name, stage in self.__stages.items())
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import threading
+from collections import deque
+
+
+# 自适应查询间隔：根据近期同类样本的实际检测耗时，计算下一次查询检测结果的时间
+# 预计快出结果时尽快查询，预计还需较长时间时减少查询，降低API调用量
+class PollScheduler(object):
+    QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.99) # 作为查询时间点的检测耗时分位点
+    MIN_SAMPLES = 8 # 同类样本至少有多少个检测耗时记录时才按分位点计算
+    BACKOFF_FACTOR = 1.5 # 退避倍数
+
+
+    def __init__(self, min_interval, max_interval, window_size=256):
+        self.__min_interval = max(1, min_interval) # 最小查询间隔，单位为毫秒
+        self.__max_interval = max(self.__min_interval, max_interval) # 最大查询间隔，单位为毫秒
+        self.__window_size = window_size # 每类样本保留的最近检测耗时记录数
+        self.__latencies = {}
+        self.__lock = threading.Lock()
+
+
+    """
+    获取样本分类，按文件大小的数量级（4的幂）和扩展名区分
+    @param path 文件路径或URL
+    @param size 文件大小，未知时为0
+    """
+    @staticmethod
+    def getCategory(path, size):
+        ext = ""
+        if path is not None:
+            ext = os.path.splitext(path.split("?", 1)[0])[1].lower()[:16]
+        return (max(0, size).bit_length() // 2, ext)
+
+
+    """
+    记录样本从发起检测到获得检测结果的耗时
+    @param category 样本分类
+    @param latency 检测耗时，单位为毫秒
+    """
+    def record(self, category, latency):
+        with self.__lock:
+            latencies = self.__latencies.get(category)
+            if latencies is None:
+                latencies = deque(maxlen=self.__window_size)
+                self.__latencies[category] = latencies
+            latencies.append(latency)
+
+
+    """
+    计算距下一次查询的等待时间
+    @param category 样本分类
+    @param elapsed 距发起检测已过去的时间，单位为毫秒
+    @param poll_count 发起检测后已查询的次数
+    @return 等待时间，单位为毫秒
+    """
+    def nextDelay(self, category, elapsed, poll_count):
+        # 指数退避，并加入随机抖动，避免大量任务同时查询
+        backoff = min(self.__max_interval, self.__min_interval * (self.BACKOFF_FACTOR ** min(poll_count, 30)))
+        delay = random.uniform(backoff * 0.8, backoff)
+
+        with self.__lock:
+            latencies = self.__latencies.get(category)
+            samples = sorted(latencies) if latencies is not None else []
+        if len(samples) >= self.MIN_SAMPLES:
+            # 等到下一个尚未经过的耗时分位点再查询；已超过所有分位点时继续退避
+            for quantile in self.QUANTILES:
+                point = samples[min(len(samples) - 1, int(quantile * len(samples)))]
+                if point > elapsed:
+                    delay = (point - elapsed) * random.uniform(1.0, 1.1)
+                    break
+
+        return int(min(self.__max_interval, max(self.__min_interval, delay)))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from collections import deque
+
+
+# 令牌桶：按rate匀速发放令牌，令牌不足时调用方排队等待
+# 遇到限流时速率减半，且不超过最近1秒内的成功次数，无限流时逐步回升（AIMD），使调用频率稳定在配额之下
+class TokenBucket(object):
+    DECREASE_FACTOR = 0.5 # 限流时的速率衰减系数
+    DECREASE_COOLDOWN = 1.0 # 两次降速的最小间隔，单位为秒，避免同一波限流重复降速
+    SUCCESS_WINDOW = 1.0 # 统计成功次数的时间窗口，单位为秒，限流时据此估算配额
+
+
+    def __init__(self, max_rate, min_rate=0.5, throttle_pause=0):
+        self.__max_rate = float(max_rate) # 最大速率，单位为次/秒
+        self.__min_rate = min(float(min_rate), self.__max_rate) # 最小速率，单位为次/秒
+        self.__throttle_pause = throttle_pause # 被限流后暂停发放令牌的时间，单位为秒
+        self.__rate = self.__max_rate
+        self.__tokens = 1.0
+        self.__last_time = time.monotonic()
+        self.__last_decrease_time = 0
+        self.__successes = deque() # 时间窗口内各次调用成功的时间
+        self.__lock = threading.Lock()
+
+
+    def getRate(self):
+        return self.__rate
+
+
+    # 获取一个令牌，令牌不足时阻塞等待
+    def acquire(self):
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+    # 预约一个令牌，返回需要等待的时间，单位为秒，由调用方自行等待
+    def reserve(self):
+        with self.__lock:
+            now = time.monotonic()
+            capacity = max(1.0, self.__rate) # 最多积攒1秒的令牌
+            self.__tokens = min(capacity, self.__tokens + (now - self.__last_time) * self.__rate)
+            self.__last_time = now
+            self.__tokens -= 1
+            return -self.__tokens / self.__rate if self.__tokens < 0 else 0
+
+
+    # 调用成功，速率每秒约回升1次/秒
+    def onSuccess(self):
+        with self.__lock:
+            now = time.monotonic()
+            self.__successes.append(now)
+            self.__expireSuccesses(now)
+            if self.__rate < self.__max_rate:
+                self.__rate = min(self.__max_rate, self.__rate + 1.0 / self.__rate)
+
+
+    # 调用被限流，速率减半，并清空积攒的令牌，暂停throttle_pause后再按新速率发放
+    # 初始速率远高于配额时，减半需要多次才能降到配额之下，因此同时以最近1秒内的成功次数作为速率上限
+    def onThrottled(self):
+        with self.__lock:
+            now = time.monotonic()
+            if now - self.__last_decrease_time >= self.DECREASE_COOLDOWN:
+                self.__last_decrease_time = now
+                rate = self.__rate * self.DECREASE_FACTOR
+                self.__expireSuccesses(now)
+                if len(self.__successes) > 0:
+                    rate = min(rate, len(self.__successes) / self.SUCCESS_WINDOW)
+                self.__rate = max(self.__min_rate, rate)
+            self.__tokens = min(self.__tokens + (now - self.__last_time) * self.__rate,
+                                1 - self.__throttle_pause * self.__rate)
+            self.__last_time = now
+
+
+    def __expireSuccesses(self, now):
+        while len(self.__successes) > 0 and now - self.__successes[0] > self.SUCCESS_WINDOW:
+            self.__successes.popleft()
+
+
+# API调用限速器，每个API各自一个令牌桶
+class RateLimiter(object):
+    DEFAULT_QPS = 1000 # 未设置上限时的初始速率，单位为次/秒，遇到限流后自动降低到配额之下
+
+
+    """
+    @param api_qps 调用频率上限，单位为次/秒
+                   数字表示每个API使用相同的上限，dict按API名称分别设置，未设置的API使用DEFAULT_QPS，<= 0 表示不限速
+                   不限速的API被限流后同样暂停throttle_pause
+    @param throttle_pause 被限流后暂停调用该API的时间，单位为秒
+    """
+    def __init__(self, api_qps=None, throttle_pause=0):
+        self.__default_qps = self.DEFAULT_QPS
+        self.__api_qps = {}
+        if isinstance(api_qps, dict):
+            self.__api_qps = dict(api_qps)
+        elif api_qps is not None:
+            self.__default_qps = api_qps
+        self.__throttle_pause = throttle_pause
+        self.__buckets = {}
+        self.__pause_until = {} # 不限速的API被限流后，暂停调用直到该时间
+        self.__lock = threading.Lock()
+
+
+    def __getBucket(self, action):
+        bucket = self.__buckets.get(action)
+        if bucket is not None:
+            return bucket
+        qps = self.__api_qps.get(action, self.__default_qps)
+        if qps is None or qps <= 0:
+            return None
+        with self.__lock:
+            if action not in self.__buckets:
+                self.__buckets[action] = TokenBucket(qps, throttle_pause=self.__throttle_pause)
+            return self.__buckets[action]
+
+
+    # 调用API前获取令牌，不限速的API只在被限流后的暂停期间等待
+    def acquire(self, action):
+        wait_time = self.reserve(action)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+    # 预约令牌，返回需要等待的时间，单位为秒，供异步调用方使用
+    def reserve(self, action):
+        bucket = self.__getBucket(action)
+        if bucket is not None:
+            return bucket.reserve()
+        pause_until = self.__pause_until.get(action)
+        if pause_until is None:
+            return 0
+        return max(0, pause_until - time.monotonic())
+
+
+    # 根据调用结果调整速率
+    def feedback(self, action, throttled):
+        bucket = self.__getBucket(action)
+        if bucket is None:
+            if throttled:
+                with self.__lock:
+                    self.__pause_until[action] = time.monotonic() + self.__throttle_pause
+            return
+        if throttled:
+            bucket.onThrottled()
+        else:
+            bucket.onSuccess()
+
+
+    # 获取各API当前的调用速率
+    def getRates(self):
+        with self.__lock:
+            return dict((action, bucket.getRate()) for action, bucket in self.__buckets.items())
@@ -3,8 +3,7 @@
 import os
 import time
 import json
-import hashlib
-import requests
+import threading
 import traceback
 from abc import ABCMeta, abstractmethod
 from alibabacloud_sas20181203 import models as sas_20181203_models
@@ -12,6 +11,10 @@ from alibabacloud_sas20181203 import models as sas_20181203_models
 from .DetectResult import DetectResult
 from .ERR_CODE import ERR_CODE
 from .MiniThreadPool import Runnable
+from .FileHash import calcFileMd5
+from .PollScheduler import PollScheduler
+from .Metrics import SIZE_BUCKETS, COUNT_BUCKETS
+from .MultipartEncoder import MultipartEncoder
 
 
 class TaskCallback(metaclass=ABCMeta):
@@ -31,6 +34,11 @@ class ScanTask(Runnable):
     IS_OK = 0
     IS_BLACK = 1 # 可疑文件
     IS_DETECTING = 3 # 检测中，请等待
+
+    # 检测流水线的阶段
+    STAGE_HASH = "hash" # 计算md5，查询缓存
+    STAGE_UPLOAD = "upload" # 上传文件并发起检测
+    STAGE_POLL = "poll" # 处理检测结果，等待下一次查询
     
 
     def __init__(self):
@@ -43,11 +51,31 @@ class ScanTask(Runnable):
         
         self.__start_time = 0
         self.__last_time = 0
+        self.__next_poll_time = 0 # 下一次查询检测结果的时间
+        self.__detect_begin_time = 0 # 发起检测的时间
+        self.__poll_count = 0 # 发起检测后查询检测结果的次数
+        self.__detecting_time = 0 # 最近一次查询到检测中的时间
+        self.__hash_begin_time = 0 # 提交到进程池计算md5的时间
+        self.__lookup_begin_time = 0 # 加入批量查询的时间
+        self.__upload_begin_time = 0 # 加入批量获取上传地址的时间
 
         self.__taskCallback = None
         self.__decompress = None
         self.__islocal = True # 是否为本地文件
 
+        self.__lookup_result = None # 批量查询返回的检测结果，等待处理
+        self.__lookup_org_result = None
+        self.__upload_url = None # 批量获取的上传地址，等待上传
+        self.__shared_result = False # 检测结果是否来自缓存或相同md5的其他任务
+        self.__content_error = False # 是否为服务端针对样本内容返回的错误，可分发给相同md5的其他任务
+        self.__coalesced = False # 是否已与相同md5的进行中任务合并
+        self.__waiters = [] # 合并到本任务、等待本任务检测结果的相同md5任务
+        self.__is_waiter = False # 是否正在等待相同md5的其他任务的检测结果
+        self.__hash_local = False # 是否在本进程的线程中计算md5，不提交到进程池
+        self.__dequeued = False # 是否已开始处理，用于统计排队时间
+        self.__finished = False # 是否已返回检测结果，保证只回调一次
+        self.__finish_lock = threading.Lock()
+
     
     def __currentTimeMillis(self):
         return int(round(time.time() * 1000))
@@ -83,6 +111,130 @@ class ScanTask(Runnable):
         return self.__seq
 
 
+    def getPath(self):
+        return self.__path
+
+
+    def getMd5(self):
+        return self.__result.md5
+
+
+    # 预先设置文件md5，文件md5缓存命中或由进程池计算完成时调用
+    def setMd5(self, md5):
+        self.__result.md5 = md5
+        self.__endHashWait()
+
+
+    # 批量较小时不提交到进程池，在计算md5阶段的线程中计算
+    def setHashLocal(self):
+        self.__hash_local = True
+        self.__endHashWait()
+
+
+    def __endHashWait(self):
+        if self.__hash_begin_time > 0:
+            self.__result.timing.hash_time += self.__currentTimeMillis() - self.__hash_begin_time
+            self.__hash_begin_time = 0
+
+
+    def __endLookup(self):
+        if self.__lookup_begin_time > 0:
+            self.__result.timing.lookup_time += self.__currentTimeMillis() - self.__lookup_begin_time
+            self.__lookup_begin_time = 0
+
+
+    def __endUpload(self):
+        if self.__upload_begin_time > 0:
+            self.__result.timing.upload_time += self.__currentTimeMillis() - self.__upload_begin_time
+            self.__upload_begin_time = 0
+
+
+    # 批量请求因请求太过频繁被限流时调用
+    def onThrottled(self):
+        self.__result.timing.throttle_count += 1
+
+
+    def getSize(self):
+        return self.__size
+
+
+    def getResult(self):
+        return self.__result
+
+
+    def isSharedResult(self):
+        return self.__shared_result
+
+
+    # 添加等待本任务检测结果的任务，由检测器加锁调用
+    def addWaiter(self, task):
+        task.__is_waiter = True
+        self.__waiters.append(task)
+
+
+    def isWaiter(self):
+        return self.__is_waiter
+
+
+    # 移除等待本任务检测结果的任务，由检测器加锁调用
+    def removeWaiter(self, task):
+        if task in self.__waiters:
+            self.__waiters.remove(task)
+
+
+    # 取出等待本任务检测结果的任务，由检测器加锁调用
+    def takeWaiters(self):
+        waiters = self.__waiters
+        self.__waiters = []
+        return waiters
+
+
+    # 重新参与相同md5任务的合并，进行中的任务未得到结果时调用
+    def resetCoalesced(self):
+        self.__is_waiter = False
+        self.__coalesced = False
+
+
+    # 等待相同md5任务的检测结果期间，仍按本任务的超时时间结束
+    def scheduleWaiterTimeout(self, delay_queue):
+        if self.__timeout < 0:
+            return
+        remaining = self.__timeout - (self.__currentTimeMillis() - self.__start_time)
+        delay_queue.addDelayed(self.WaiterTimeoutCheck(self, delay_queue), max(0, remaining) + 1)
+
+
+    class WaiterTimeoutCheck(Runnable):
+        def __init__(self, task, delay_queue):
+            self.__task = task
+            self.__delay_queue = delay_queue
+
+        def run(self):
+            if not self.__task.isWaiter() or self.__task.checkTimeout():
+                return
+            self.__task.scheduleWaiterTimeout(self.__delay_queue)
+
+
+    # 由批量查询回填检测结果，任务重新入队后处理
+    def setLookupResult(self, result_info, org_result):
+        self.__endLookup()
+        self.__lookup_result = result_info
+        self.__lookup_org_result = org_result
+
+
+    # 由批量获取上传地址回填，任务重新入队后上传文件并发起检测
+    def setUploadUrl(self, upload_url):
+        self.__upload_url = upload_url
+
+
+    # 任务下一步所处的流水线阶段
+    def getStage(self):
+        if self.__upload_url is not None:
+            return self.STAGE_UPLOAD
+        if self.__lookup_result is not None or self.__coalesced:
+            return self.STAGE_POLL
+        return self.STAGE_HASH
+
+
     def setTaskCallback(self, callback):
         self.__taskCallback = callback
         if self.__taskCallback is not None:
@@ -97,74 +249,169 @@ class ScanTask(Runnable):
         client = detector.client
         client_opt = detector.client_opt
 
-        queue = detector.queue
-        if detector.is_inited is False or client is None or queue is None:
+        if detector.is_inited is False or client is None:
              self.errorCallback(ERR_CODE.ERR_INIT, self.__path)
              return
         
 
+        # 统计从发起检测到开始处理的排队时间
+        if not self.__dequeued:
+            self.__dequeued = True
+            self.__result.timing.queue_time = self.__currentTimeMillis() - self.__start_time
+            detector.metrics.observe("queue_wait_ms", self.__result.timing.queue_time)
+
         # 判断是否已超时
-        if self.__checkTimeout():
+        if self.checkTimeout():
+            return
+
+        # 上传文件并发起检测
+        if self.__upload_url is not None:
+            upload_url = self.__upload_url
+            self.__upload_url = None
+            self.__detectByAPI(detector, client, client_opt, upload_url)
+            return
+
+        # 处理批量查询返回的结果
+        if self.__lookup_result is not None:
+            result_info = self.__lookup_result
+            org_result = self.__lookup_org_result
+            self.__lookup_result = None
+            self.__lookup_org_result = None
+            self.__processResult(detector, client, client_opt, result_info, org_result)
             return
         
-        
-        # 计算文件md5
+        # 计算文件md5，启用进程池时与其他任务合并后提交到进程池计算
+        if self.__result.md5 is None and not self.__hash_local and detector.hash_batcher is not None:
+            self.__hash_begin_time = self.__currentTimeMillis()
+            if not detector.hash_batcher.add(self):
+                self.errorCallback(ERR_CODE.ERR_ABORT, None)
+            return
         if self.__result.md5 is None:
-            self.__result.md5 = self.__calcMd5(self.__path)
+            self.__result.md5 = self.__calcMd5(detector, self.__path)
             if self.__result.md5 is None:
                 self.errorCallback(ERR_CODE.ERR_FILE_NOT_FOUND, self.__path)
                 return
-        
 
-        # 如果距离上次查询过短，则需要等待一会
-        if self.__currentTimeMillis() - self.__last_time < self.__config.QUERY_RESULT_INTERVAL:
-            with queue:
-                queue.wait(self.__config.QUERY_RESULT_INTERVAL/1000.0)
-            if self.__currentTimeMillis() - self.__last_time < self.__config.QUERY_RESULT_INTERVAL:
-                # 时间不够就放到队列里去
-                queue.addLast(self)
+        # 首次得到md5时查询缓存，并与相同md5的进行中任务合并，只检测一次
+        if not self.__coalesced:
+            self.__coalesced = True
+            cached = detector.getCachedVerdict(self.__result.md5)
+            if cached is not None:
+                self.sharedResultCallback(cached)
                 return
+            if detector.joinInflight(self):
+                return
+        
+
+        # 未到下一次查询时间，则放入延时队列，到期后再查询
+        curr_time = self.__currentTimeMillis()
+        if curr_time < self.__next_poll_time:
+            self.__delayPoll(detector, self.__next_poll_time - curr_time)
+            return
 
         # 更新时间戳
         self.__last_time = self.__currentTimeMillis()
 
-        # 获取扫描结果
-        result_info = None
+        # 获取扫描结果，与其他任务合并为批量查询
+        self.__lookup_begin_time = self.__last_time
+        self.__result.timing.poll_count += 1
+        if not detector.lookup_batcher.add(self):
+            self.errorCallback(ERR_CODE.ERR_ABORT, None)
+
+
+    # 计算下一次查询检测结果的时间，等待期间不占用工作线程
+    def __schedulePoll(self, detector):
+        curr_time = self.__currentTimeMillis()
+        delay = self.__config.QUERY_RESULT_INTERVAL - (curr_time - self.__last_time)
+        if self.__config.ADAPTIVE_POLL:
+            category = PollScheduler.getCategory(self.__path, self.__size)
+            delay = max(delay, detector.poll_scheduler.nextDelay(category,
+                curr_time - self.__detect_begin_time, self.__poll_count))
+        self.__next_poll_time = curr_time + delay
+        self.__delayPoll(detector, delay)
+
+
+    def __delayPoll(self, detector, delay):
+        if not detector.delay_queue.addDelayed(self, delay):
+            self.errorCallback(ERR_CODE.ERR_ABORT, None)
+
+
+    # 记录样本的检测耗时，用于计算同类样本的查询间隔
+    # 检测结果在最近两次查询之间产生，取中间时刻作为检测完成时间
+    def __recordDetectLatency(self, detector):
+        if self.__detect_begin_time <= 0:
+            return
+        finish_time = self.__last_time
+        if self.__detecting_time > self.__detect_begin_time:
+            finish_time = (self.__detecting_time + self.__last_time) // 2
+        category = PollScheduler.getCategory(self.__path, self.__size)
+        detector.poll_scheduler.record(category, max(0, finish_time - self.__detect_begin_time))
+        detector.metrics.observe("service_latency_ms", max(0, finish_time - self.__detect_begin_time))
+
+
+    def __detectByAPI(self, detector, client, client_opt, upload_url):
+        if self.__upload_begin_time <= 0:
+            self.__upload_begin_time = self.__currentTimeMillis()
+        detect_ret = 0
         while True:
-            result_info = self.__getResultByAPI(client, client_opt, self.__result.md5)
-            if result_info.result != self.REQUEST_TOO_FREQUENTLY:
+            detect_ret = self.__uploadAndDetectByAPI(client, client_opt, detector.http_session,
+                detector.rate_limiter, detector.metrics, self.__path, self.__result.md5, upload_url)
+            if detect_ret != self.REQUEST_TOO_FREQUENTLY:
                 break
-            self.__needSleep(self.__config.REQUEST_TOO_FREQUENTLY_SLEEP_TIME) # 请求太过频繁，需要休眠
-            # 判断是否已超时
-            if self.__checkTimeout():
+            
+            self.__result.timing.throttle_count += 1 # 请求太过频繁，由限速器暂停后重新请求
+            if self.checkTimeout():
                 return
-        
-        if result_info.result == self.HAS_EXCEPTION:
-            return # 出错，退出
-        elif result_info.result == self.GET_RESULT_FAIL:
-            # 没有结果，则尝试上传文件
-            detect_ret = 0
-            while True:
-                detect_ret = self.__uploadAndDetectByAPI(client, client_opt, self.__path, self.__result.md5)
-                if detect_ret != self.REQUEST_TOO_FREQUENTLY:
-                    break
-                
-                self.__needSleep(self.__config.REQUEST_TOO_FREQUENTLY_SLEEP_TIME) # 请求太过频繁，需要休眠
-                if self.__checkTimeout():
-                    return
-
-            if detect_ret == self.HAS_EXCEPTION: # 出错，退出
+
+        self.__endUpload()
+        if detect_ret == self.HAS_EXCEPTION: # 出错，退出
+            return
+        self.__detect_begin_time = self.__currentTimeMillis()
+        self.__poll_count = 0
+        self.__schedulePoll(detector) # 等待再次查询扫描结果
+
+
+    def __processResult(self, detector, client, client_opt, result_info, org_result):
+        if result_info.result == self.GET_RESULT_FAIL:
+            # 没有结果，则尝试上传文件。本地文件先与其他任务合并获取上传地址
+            if self.__islocal is True:
+                self.__upload_begin_time = self.__currentTimeMillis()
+                if not detector.upload_url_batcher.add(self):
+                    self.errorCallback(ERR_CODE.ERR_ABORT, None)
                 return
-            queue.addLast(self) # 重新添加到队列，等待再次查询扫描结果
-        elif result_info.result == self.IS_BLACK:
-            self.okCallback(True, result_info) # 报黑
+            self.__detectByAPI(detector, client, client_opt, None)
         elif result_info.result == self.IS_DETECTING: # 检测中，请等待
-            queue.addLast(self)
+            if self.__detect_begin_time <= 0:
+                self.__detect_begin_time = self.__last_time # 样本已由其他请求发起检测，从首次查询开始计时
+            self.__detecting_time = self.__last_time
+            self.__poll_count += 1
+            self.__schedulePoll(detector)
         else:
-            self.okCallback(False, result_info) # 其他结果均为白
+            self.__recordDetectLatency(detector)
+            detector.metrics.observe("poll_count", self.__poll_count, buckets=COUNT_BUCKETS)
+            self.__getListCompressFileResult(client, client_opt, detector.rate_limiter, detector.metrics,
+                                             self.__result.md5, org_result)
+            if result_info.result == self.IS_BLACK:
+                self.okCallback(True, result_info) # 报黑
+            else:
+                self.okCallback(False, result_info) # 其他结果均为白
+
+
+    def __markFinished(self):
+        with self.__finish_lock:
+            if self.__finished:
+                return False
+            self.__finished = True
+            return True
 
 
     def errorCallback(self, errCode, errString):
+        if not self.__markFinished():
+            return
+        # 在某一阶段中出错或超时，计入该阶段的耗时
+        self.__endHashWait()
+        self.__endLookup()
+        self.__endUpload()
         self.__result.error_code = errCode
         self.__result.error_string = errString
         self.__result.time =  self.__currentTimeMillis() - self.__start_time
@@ -174,7 +421,33 @@ class ScanTask(Runnable):
             self.__callback.onScanResult(self.__seq, self.__path, self.__result)
         
 
+    # 服务端针对样本内容返回的错误，与文件路径、上传、网络无关
+    def contentErrorCallback(self, errCode, errString):
+        self.__content_error = True
+        self.errorCallback(errCode, errString)
+
+
+    def isContentError(self):
+        return self.__content_error
+
+
+    # 使用缓存或相同md5的其他任务的检测结果
+    def sharedResultCallback(self, result):
+        if not self.__markFinished():
+            return
+        self.__shared_result = True
+        result.timing = self.__result.timing # 保留本任务自身的耗时明细
+        self.__result = result
+        self.__result.time = self.__currentTimeMillis() - self.__start_time
+        if self.__taskCallback is not None:
+            self.__taskCallback.onTaskEnd(self)
+        if self.__callback is not None:
+            self.__callback.onScanResult(self.__seq, self.__path, self.__result)
+
+
     def okCallback(self, is_black, result_info):
+        if not self.__markFinished():
+            return
         self.__result.error_code = ERR_CODE.ERR_SUCC
         self.__result.result = DetectResult.RESULT.RES_BLACK if is_black else DetectResult.RESULT.RES_WHITE
         self.__result.time = self.__currentTimeMillis() - self.__start_time
@@ -187,7 +460,7 @@ class ScanTask(Runnable):
             self.__callback.onScanResult(self.__seq, self.__path, self.__result)
         
     
-    def __checkTimeout(self):
+    def checkTimeout(self):
         curr_time = self.__currentTimeMillis()
         if self.__timeout >= 0:
             if curr_time - self.__start_time > self.__timeout:
@@ -200,20 +473,16 @@ class ScanTask(Runnable):
         return False
 
 
-    def __needSleep(self, ms):
-        try:
-            time.sleep(ms/1000.0)
-        except Exception as e:
-            pass
-
-
-    def __calcMd5(self, path):
-        if not os.path.isfile(path):
-            return None
-        with open(path, "rb") as f:
-            data = f.read()
-        file_md5 = hashlib.md5(data).hexdigest()
-        return file_md5
+    def __calcMd5(self, detector, path):
+        hash_cache = detector.hash_cache
+        begin_time = self.__currentTimeMillis()
+        with detector.metrics.timer("hash_time_ms"):
+            if hash_cache is not None:
+                md5 = hash_cache.calcMd5(path, self.__config.MD5_BUFFER_SIZE)
+            else:
+                md5 = calcFileMd5(path, self.__config.MD5_BUFFER_SIZE)
+        self.__result.timing.hash_time += self.__currentTimeMillis() - begin_time
+        return md5
 
 
     class ResultInfo(object):
@@ -233,7 +502,8 @@ class ScanTask(Runnable):
             return self
 
 
-    def __getErrorMessage(self, name, code, msg):
+    @staticmethod
+    def getErrorMessage(name, code, msg):
         if hasattr(msg, "status_code"):
             if 400 <= msg.status_code < 500:
                 msg = "{} Client Error: {} for url: {}".format(msg.status_code, msg.reason, msg.url)
@@ -249,36 +519,7 @@ class ScanTask(Runnable):
         return json.dumps(res, sort_keys=True, separators=(',', ':'))
 
 
-    def __getResultByAPI(self, client, client_opt, md5):
-        api_name = "GetFileDetectResult"
-        try:
-            hashKeyList = [md5]
-            get_file_detect_result_request = sas_20181203_models.GetFileDetectResultRequest(hashKeyList, type=0)
-            response = client.get_file_detect_result_with_options(get_file_detect_result_request, client_opt)
-            org_result = response.body.result_list[0]
-            score = org_result.score if org_result.score is not None else 0
-            result = org_result.result if org_result.result is not None else 0
-            result_info = self.ResultInfo().init_result(result, score, org_result.virus_type, org_result.ext)
-            self.__getListCompressFileResult(client, client_opt, md5, org_result)
-            return result_info
-
-        except Exception as error:
-            if hasattr(error, "code"):
-                if error.code == "GetResultFail":
-                    return self.ResultInfo().init_result(self.GET_RESULT_FAIL)
-                elif error.code == "RequestTooFrequently":
-                    return self.ResultInfo().init_result(self.REQUEST_TOO_FREQUENTLY)
-                elif error.code == "Throttling.User":
-                    return self.ResultInfo().init_result(self.REQUEST_TOO_FREQUENTLY)
-                else:
-                    self.errorCallback(ERR_CODE.ERR_CALL_API, self.__getErrorMessage(api_name, error.code, error.message))
-                    return self.ResultInfo().init_result(self.HAS_EXCEPTION)
-            else:
-                self.errorCallback(ERR_CODE.ERR_CALL_API, self.__getErrorMessage(api_name, "ERR_NETWORK", traceback.format_exc()))
-                return self.ResultInfo().init_result(self.HAS_EXCEPTION)
-
-
-    def __getListCompressFileResult(self, client, client_opt, md5, org_result):
+    def __getListCompressFileResult(self, client, client_opt, limiter, metrics, md5, org_result):
         if org_result is None or org_result.result is None or org_result.compress is None:
             return False # 结果值不合法
         if org_result.result == self.IS_DETECTING:
@@ -290,9 +531,9 @@ class ScanTask(Runnable):
         page_size = 50
         self.__result.compresslist = []
         while True:
-            ret_code = self.__getListCompressFileResultByAPI(client, client_opt, md5, cur_page, page_size)
+            ret_code = self.__getListCompressFileResultByAPI(client, client_opt, limiter, metrics, md5, cur_page, page_size)
             if ret_code == self.REQUEST_TOO_FREQUENTLY:
-                self.__needSleep(self.__config.REQUEST_TOO_FREQUENTLY_SLEEP_TIME) # 请求太过频繁，需要休眠
+                self.__result.timing.throttle_count += 1 # 请求太过频繁，由限速器暂停后重新请求
                 continue
             elif ret_code == self.HAS_EXCEPTION:
                 break # 报错退出
@@ -302,11 +543,14 @@ class ScanTask(Runnable):
         return True
 
 
-    def __getListCompressFileResultByAPI(self, client, client_opt, md5, cur_page, page_size):
+    def __getListCompressFileResultByAPI(self, client, client_opt, limiter, metrics, md5, cur_page, page_size):
         api_name = "ListCompressFileDetectResult"
         try:
             request = sas_20181203_models.ListCompressFileDetectResultRequest(cur_page, md5, page_size)
-            response = client.list_compress_file_detect_result_with_options(request, client_opt)
+            limiter.acquire(api_name)
+            with metrics.timer("api_latency_ms", {"action": api_name}):
+                response = client.list_compress_file_detect_result_with_options(request, client_opt)
+            limiter.feedback(api_name, False)
             cnt = 0
             for org_result in response.body.result_list:
                 cnt += 1
@@ -326,41 +570,33 @@ class ScanTask(Runnable):
             return cnt
         except Exception as error:
             if hasattr(error, "code"):
-                if error.code == "RequestTooFrequently":
-                    return self.REQUEST_TOO_FREQUENTLY
-                elif error.code == "Throttling.User":
+                if error.code == "RequestTooFrequently" or error.code == "Throttling.User":
+                    limiter.feedback(api_name, True)
+                    metrics.inc("throttles_total", {"action": api_name})
                     return self.REQUEST_TOO_FREQUENTLY
                 else:
-                    comp_res = DetectResult.CompressFileDetectResultInfo(self.__getErrorMessage(api_name, error.code, error.message))
+                    comp_res = DetectResult.CompressFileDetectResultInfo(self.getErrorMessage(api_name, error.code, error.message))
                     self.__result.compresslist.append(comp_res)
                     return self.HAS_EXCEPTION
             else:
-                comp_res = DetectResult.CompressFileDetectResultInfo(self.__getErrorMessage(api_name, "ERR_NETWORK", traceback.format_exc()))
+                comp_res = DetectResult.CompressFileDetectResultInfo(self.getErrorMessage(api_name, "ERR_NETWORK", traceback.format_exc()))
                 self.__result.compresslist.append(comp_res)
                 return self.HAS_EXCEPTION
 
 
-    def __uploadAndDetectByAPI(self, client, client_opt, path, md5):
+    def __uploadAndDetectByAPI(self, client, client_opt, session, limiter, metrics, path, md5, upload_url_response):
         api_name = ""
         api_callerr = ERR_CODE.ERR_CALL_API
         try:
-            if self.__islocal is True:
-                # 获取上传参数
-                api_name = "CreateFileDetectUploadUrl"
-                api_callerr = ERR_CODE.ERR_CALL_API
-                hash_key_context_list_0 = sas_20181203_models.CreateFileDetectUploadUrlRequestHashKeyContextList(
-                    hash_key = md5,
-                    file_size = self.__size
-                )
-                create_file_detect_upload_url_request = sas_20181203_models.CreateFileDetectUploadUrlRequest(type=0, hash_key_context_list=[hash_key_context_list_0])
-                response = client.create_file_detect_upload_url_with_options(create_file_detect_upload_url_request, client_opt)
-                upload_url_response = response.body.upload_url_list[0]
-            
             if self.__islocal is True and upload_url_response.file_exist is False:
                 # 上传文件
                 api_name = "UploadFile"
                 api_callerr = ERR_CODE.ERR_UPLOAD
-                upload_file_res = self.__uploadFile(path, upload_url_response.public_url, upload_url_response.context)
+                with metrics.timer("upload_time_ms"):
+                    upload_file_res = self.__uploadFile(session, path, upload_url_response.public_url, upload_url_response.context)
+                metrics.observe("upload_bytes", self.__size, buckets=SIZE_BUCKETS)
+                self.__result.timing.upload_bytes += self.__size
+                upload_url_response.file_exist = True # 已上传，发起检测重试时无需再次上传
                     
             # 发起检测
             api_name = "CreateFileDetect"
@@ -386,40 +622,44 @@ class ScanTask(Runnable):
                         "DecompressMaxFileCount": self.__decompress.getMaxFileCount()
                     }
                 )
-            client.create_file_detect_with_options(create_file_detect_request, client_opt)
+            limiter.acquire(api_name)
+            with metrics.timer("api_latency_ms", {"action": api_name}):
+                client.create_file_detect_with_options(create_file_detect_request, client_opt)
+            limiter.feedback(api_name, False)
 
         except Exception as error:
             if hasattr(error, "code"):
-                if error.code == "RequestTooFrequently":
-                    return self.REQUEST_TOO_FREQUENTLY
-                elif error.code == "Throttling.User":
+                if error.code == "RequestTooFrequently" or error.code == "Throttling.User":
+                    limiter.feedback(api_name, True)
+                    metrics.inc("throttles_total", {"action": api_name})
                     return self.REQUEST_TOO_FREQUENTLY
                 else:
-                    self.errorCallback(api_callerr, self.__getErrorMessage(api_name, error.code, error.message))
+                    self.errorCallback(api_callerr, self.getErrorMessage(api_name, error.code, error.message))
                     return self.HAS_EXCEPTION
             elif hasattr(error, "response"):
-                self.errorCallback(api_callerr, self.__getErrorMessage(api_name, "ERR_NETWORK", error.response))
+                self.errorCallback(api_callerr, self.getErrorMessage(api_name, "ERR_NETWORK", error.response))
                 return self.HAS_EXCEPTION
             else:
-                self.errorCallback(api_callerr, self.__getErrorMessage(api_name, "ERR_NETWORK", traceback.format_exc()))
+                self.errorCallback(api_callerr, self.getErrorMessage(api_name, "ERR_NETWORK", traceback.format_exc()))
                 return self.HAS_EXCEPTION
 
         return self.IS_OK
 
 
-    def __uploadFile(self, path, url, context):
+    def __uploadFile(self, session, path, url, context):
         if not os.path.isfile(path):
             raise Exception("File {} not found".format(path))
             return False
-        files = {"file": open(path, "rb")}
-        data = {
-            'key': context.oss_key,
-            'policy': context.policy,
-            'OSSAccessKeyId': context.access_id,
-            'success_action_status': '200',
-            'Signature': context.signature
-        }
-        response = requests.post(url, files=files, data=data)
+        fields = [
+            ('key', context.oss_key),
+            ('policy', context.policy),
+            ('OSSAccessKeyId', context.access_id),
+            ('success_action_status', '200'),
+            ('Signature', context.signature)
+        ]
+        timeout = (self.__config.HTTP_CONNECT_TIMEOUT/1000.0, self.__config.HTTP_UPLOAD_TIMEOUT/1000.0)
+        with MultipartEncoder(fields, "file", path) as body:
+            response = session.post(url, data=body, headers={"Content-Type": body.content_type}, timeout=timeout)
         if response.status_code == 200:
             return True
         else:
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from .ERR_CODE import ERR_CODE
+from .DetectResult import DetectResult
+
+
+# 只缓存成功的检测结果，以及服务端返回的API错误；网络错误、超时、队列满等与样本无关，不缓存
+# @return 结果的有效期，单位为毫秒，<= 0 表示不缓存
+def getVerdictTtl(result, black_ttl, white_ttl, error_ttl):
+    if result.isSucc():
+        if result.result == DetectResult.RESULT.RES_BLACK:
+            return black_ttl
+        return white_ttl
+    if result.error_code == ERR_CODE.ERR_CALL_API and not _isNetworkError(result.error_string):
+        return error_ttl
+    return 0
+
+
+def _isNetworkError(error_string):
+    try:
+        return json.loads(error_string).get("error_code") == "ERR_NETWORK"
+    except Exception as e:
+        return True
+
+
+# 检测结果缓存：按md5缓存已完成的检测结果，LRU淘汰，黑、白、错误结果分别设置有效期
+class VerdictCache(object):
+    def __init__(self, max_size, black_ttl, white_ttl, error_ttl):
+        self.__max_size = max_size # 最大缓存个数，<= 0 时不缓存
+        self.__black_ttl = black_ttl # 黑样本结果有效期，单位为毫秒，<= 0 时不缓存
+        self.__white_ttl = white_ttl # 白样本结果有效期，单位为毫秒，<= 0 时不缓存
+        self.__error_ttl = error_ttl # 调用API错误结果有效期，单位为毫秒，<= 0 时不缓存
+        self.__items = OrderedDict() # md5 -> (过期时间, 检测结果)
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+
+    def isEnabled(self):
+        return self.__max_size > 0
+
+
+    # 查询缓存，命中时返回检测结果的副本，否则返回None
+    def get(self, md5):
+        if not self.isEnabled() or md5 is None:
+            return None
+        with self.__lock:
+            item = self.__items.get(md5)
+            if item is not None and item[0] < time.time():
+                del self.__items[md5]
+                item = None
+            if item is None:
+                self.__misses += 1
+                return None
+            self.__items.move_to_end(md5)
+            self.__hits += 1
+            result = item[1]
+        return result.copy()
+
+
+    # 缓存检测结果，不需要缓存的结果直接忽略
+    def put(self, md5, result):
+        ttl = getVerdictTtl(result, self.__black_ttl, self.__white_ttl, self.__error_ttl)
+        if not self.isEnabled() or md5 is None or ttl <= 0:
+            return
+        result = result.copy()
+        with self.__lock:
+            self.__items[md5] = (time.time() + ttl / 1000.0, result)
+            self.__items.move_to_end(md5)
+            while len(self.__items) > self.__max_size:
+                self.__items.popitem(last=False)
+                self.__evictions += 1
+
+
+    # 获取缓存统计信息
+    def getStats(self):
+        with self.__lock:
+            return {
+                "size": len(self.__items),
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "evictions": self.__evictions
+            }
+
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+
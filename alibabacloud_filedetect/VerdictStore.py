@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+import sqlite3
+import threading
+
+from .ERR_CODE import ERR_CODE
+from .DetectResult import DetectResult
+from .VerdictCache import getVerdictTtl
+
+
+# 持久化检测结果库：基于SQLite（WAL模式），进程重启后仍可使用，同一主机的多个进程可同时读写
+# 支持导出、导入快照，新节点可从其他节点的结果库预热
+class VerdictStore(object):
+    BUSY_TIMEOUT = 10 # 数据库被其他进程锁定时的最长等待时间，单位为秒
+    CREATE_TABLE = (
+        "CREATE TABLE IF NOT EXISTS {}verdict ("
+        "md5 TEXT PRIMARY KEY, error_code INTEGER, error_string TEXT, result INTEGER, score INTEGER, "
+        "virus_type TEXT, ext_info TEXT, compresslist TEXT, expire_time REAL, update_time REAL)")
+
+
+    def __init__(self, path, black_ttl, white_ttl, error_ttl):
+        self.__path = path
+        self.__black_ttl = black_ttl
+        self.__white_ttl = white_ttl
+        self.__error_ttl = error_ttl
+        self.__local = threading.local() # 每个线程使用各自的数据库连接
+        self.__conns = []
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+        conn = self.__getConn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(self.CREATE_TABLE.format(""))
+
+
+    def __getConn(self):
+        conn = getattr(self.__local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.__path, timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.__local.conn = conn
+            with self.__lock:
+                self.__conns.append(conn)
+        return conn
+
+
+    # 查询检测结果，不存在或已过期时返回None
+    def get(self, md5):
+        if md5 is None:
+            return None
+        try:
+            row = self.__getConn().execute(
+                "SELECT error_code, error_string, result, score, virus_type, ext_info, compresslist "
+                "FROM verdict WHERE md5 = ? AND expire_time > ?", (md5, time.time())).fetchone()
+        except sqlite3.Error as e:
+            logging.exception(e)
+            row = None
+        with self.__lock:
+            if row is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+        if row is None:
+            return None
+        return self.__toResult(md5, row)
+
+
+    # 保存检测结果，不需要保存的结果直接忽略
+    def put(self, md5, result):
+        ttl = getVerdictTtl(result, self.__black_ttl, self.__white_ttl, self.__error_ttl)
+        if md5 is None or ttl <= 0:
+            return
+        now = time.time()
+        try:
+            conn = self.__getConn()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO verdict VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (md5, result.error_code.value, result.error_string, result.result.value, result.score,
+                     result.virus_type, result.ext_info, self.__dumpCompressList(result.compresslist),
+                     now + ttl / 1000.0, now))
+        except sqlite3.Error as e:
+            logging.exception(e)
+
+
+    # 清理过期的检测结果，并回收WAL日志空间
+    def compact(self):
+        conn = self.__getConn()
+        with conn:
+            conn.execute("DELETE FROM verdict WHERE expire_time <= ?", (time.time(),))
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+    # 导出快照到path，快照本身也是一个结果库文件
+    def exportSnapshot(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        conn = self.__getConn()
+        if hasattr(conn, "backup"):
+            target = sqlite3.connect(path)
+            try:
+                conn.backup(target)
+            finally:
+                target.close()
+            return
+        # Python 3.6 不支持Connection.backup，附加快照文件后复制表内容
+        conn.execute("ATTACH DATABASE ? AS snapshot", (path,))
+        try:
+            with conn:
+                conn.execute(self.CREATE_TABLE.format("snapshot."))
+                conn.execute("INSERT INTO snapshot.verdict SELECT * FROM main.verdict")
+        finally:
+            conn.execute("DETACH DATABASE snapshot")
+
+
+    """
+    从快照导入检测结果，本地已有且有效期更长的结果保留不变
+    @return 导入的结果个数
+    """
+    def importSnapshot(self, path):
+        conn = self.__getConn()
+        conn.execute("ATTACH DATABASE ? AS snapshot", (path,))
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT OR REPLACE INTO verdict SELECT s.* FROM snapshot.verdict s "
+                    "WHERE s.expire_time > ? AND NOT EXISTS "
+                    "(SELECT 1 FROM verdict v WHERE v.md5 = s.md5 AND v.expire_time >= s.expire_time)",
+                    (time.time(),))
+                return cursor.rowcount
+        finally:
+            conn.execute("DETACH DATABASE snapshot")
+
+
+    # 获取统计信息
+    def getStats(self):
+        with self.__lock:
+            return {"hits": self.__hits, "misses": self.__misses}
+
+
+    def close(self):
+        with self.__lock:
+            conns = self.__conns
+            self.__conns = []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                pass
+
+
+    def __toResult(self, md5, row):
+        error_code, error_string, result, score, virus_type, ext_info, compresslist = row
+        res = DetectResult()
+        res.md5 = md5
+        res.error_code = ERR_CODE(error_code)
+        res.error_string = error_string
+        res.result = DetectResult.RESULT(result)
+        res.score = score
+        res.virus_type = virus_type
+        res.ext_info = ext_info
+        res.compresslist = self.__loadCompressList(compresslist)
+        return res
+
+
+    def __dumpCompressList(self, compresslist):
+        if compresslist is None:
+            return None
+        items = []
+        for comp_res in compresslist:
+            vinfo = comp_res.getVirusInfo()
+            items.append({
+                "path": comp_res.path,
+                "result": comp_res.result.value,
+                "score": comp_res.score,
+                "virus_type": vinfo.virus_type if vinfo is not None else None,
+                "ext_info": vinfo.ext_info if vinfo is not None else None
+            })
+        return json.dumps(items)
+
+
+    def __loadCompressList(self, data):
+        if data is None:
+            return None
+        compresslist = []
+        for item in json.loads(data):
+            comp_res = DetectResult.CompressFileDetectResultInfo(item["path"])
+            comp_res.result = DetectResult.RESULT(item["result"])
+            comp_res.score = item["score"]
+            if comp_res.result == DetectResult.RESULT.RES_BLACK:
+                vinfo = DetectResult.VirusInfo()
+                vinfo.virus_type = item["virus_type"]
+                vinfo.ext_info = item["ext_info"]
+                comp_res.setVirusInfo(vinfo)
+            compresslist.append(comp_res)
+        return compresslist
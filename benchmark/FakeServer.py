@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import collections
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+
+
+# 本地模拟的SAS文件检测服务和OSS上传服务，用于离线压测和回归测试
+# 实现GetFileDetectResult、CreateFileDetectUploadUrl、CreateFileDetect、ListCompressFileDetectResult和OSS表单上传
+# SDK通过initConfig(endpoint="127.0.0.1:<port>", protocol="http")接入，不校验签名
+class FakeServer(object):
+    OSS_PATH = "/oss"
+    STATS_PATH = "/stats"
+
+
+    """
+    @param host 监听地址
+    @param port 监听端口，0表示由系统分配
+    @param api_latency API应答耗时，单位为毫秒
+    @param api_jitter API应答耗时的随机抖动上限，单位为毫秒
+    @param upload_latency 上传应答耗时，单位为毫秒
+    @param detect_delay 发起检测到产生结果的耗时，单位为毫秒，期间查询返回检测中
+    @param throttle_rate API请求被随机限流的比例，取值范围0-1
+    @param api_qps 每个API每秒最多处理的请求数，超过时返回限流错误，0表示不限制
+    @param known_ratio 服务端已有检测结果的样本比例，无需上传，取值范围0-1
+    @param black_ratio 黑样本比例，取值范围0-1
+    @param compress_ratio 压缩包样本比例，结果需通过ListCompressFileDetectResult分页查询，取值范围0-1
+    @param compress_files 每个压缩包内的文件数
+    """
+    def __init__(self, host="127.0.0.1", port=0, api_latency=0, api_jitter=0, upload_latency=0, detect_delay=1000,
+                 throttle_rate=0.0, api_qps=0, known_ratio=0.0, black_ratio=0.0, compress_ratio=0.0, compress_files=3):
+        self.api_latency = api_latency
+        self.api_jitter = api_jitter
+        self.upload_latency = upload_latency
+        self.detect_delay = detect_delay
+        self.throttle_rate = throttle_rate
+        self.api_qps = api_qps
+        self.known_ratio = known_ratio
+        self.black_ratio = black_ratio
+        self.compress_ratio = compress_ratio
+        self.compress_files = compress_files
+
+        self.__lock = threading.Lock()
+        self.__detect_time = {} # md5 -> 发起检测的时间
+        self.__uploaded = set() # 已上传的oss_key
+        self.__windows = {} # API名称 -> 最近1秒内的请求时间
+        self.__stats = collections.Counter()
+
+        self.__server = _ThreadingHTTPServer((host, port), _Handler)
+        self.__server.fake = self
+        self.__thread = threading.Thread(name="FakeServer", target=self.__server.serve_forever)
+        self.__thread.daemon = True
+
+
+    def start(self):
+        self.__thread.start()
+
+
+    # SDK使用的API服务地址
+    def getEndpoint(self):
+        host, port = self.__server.server_address[:2]
+        return "{}:{}".format(host, port)
+
+
+    def getOssUrl(self):
+        return "http://{}{}".format(self.getEndpoint(), self.OSS_PATH)
+
+
+    """
+    获取统计信息
+    @return dict，包括 calls.<API名称>(调用次数) throttled(限流次数) uploads(上传次数) upload_bytes(上传字节数)
+            hashes_polled(查询的md5个数)
+    """
+    def getStats(self):
+        with self.__lock:
+            return dict(self.__stats)
+
+
+    def shutdown(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+
+    def serveForever(self):
+        self.__server.serve_forever()
+
+
+    # 处理API请求，返回(HTTP状态码, 应答dict)
+    def handleApi(self, action, params):
+        self.__sleep(self.api_latency + random.uniform(0, self.api_jitter))
+        with self.__lock:
+            self.__stats["calls." + action] += 1
+        if self.__isThrottled(action):
+            with self.__lock:
+                self.__stats["throttled"] += 1
+            return 400, {"Code": "Throttling.User", "Message": "Request was denied due to user flow control."}
+
+        handler = {
+            "GetFileDetectResult": self.__getFileDetectResult,
+            "CreateFileDetectUploadUrl": self.__createFileDetectUploadUrl,
+            "CreateFileDetect": self.__createFileDetect,
+            "ListCompressFileDetectResult": self.__listCompressFileDetectResult
+        }.get(action)
+        if handler is None:
+            return 404, {"Code": "InvalidAction.NotFound", "Message": "Specified api is not found: {}".format(action)}
+        return handler(params)
+
+
+    # 处理OSS表单上传
+    def handleUpload(self, oss_key, size):
+        self.__sleep(self.upload_latency)
+        with self.__lock:
+            self.__stats["uploads"] += 1
+            self.__stats["upload_bytes"] += size
+            if oss_key is not None:
+                self.__uploaded.add(oss_key)
+
+
+    def __getFileDetectResult(self, params):
+        md5_list = self.__getList(params, "HashKeyList")
+        with self.__lock:
+            self.__stats["hashes_polled"] += len(md5_list)
+        result_list = [self.__getResult(md5) for md5 in md5_list]
+        # 单个样本没有结果时，与服务端一致返回错误码
+        if len(result_list) == 1 and result_list[0]["Code"] == "GetResultFail":
+            return 400, {"Code": "GetResultFail", "Message": "get result fail"}
+        return 200, {"ResultList": result_list}
+
+
+    def __getResult(self, md5):
+        with self.__lock:
+            detect_time = self.__detect_time.get(md5)
+        if detect_time is None and self.__ratio(md5, "known") < self.known_ratio:
+            detect_time = 0
+        if detect_time is None:
+            return {"HashKey": md5, "Code": "GetResultFail", "Message": "get result fail"}
+        if (time.time() - detect_time) * 1000 < self.detect_delay:
+            return {"HashKey": md5, "Code": "200", "Result": 3}
+        result = {"HashKey": md5, "Code": "200", "Result": 0, "Score": 0,
+                  "Compress": self.__ratio(md5, "compress") < self.compress_ratio}
+        if self.__ratio(md5, "black") < self.black_ratio:
+            result.update({"Result": 1, "Score": 100, "VirusType": "Trojan", "Ext": "{}"})
+        return result
+
+
+    def __createFileDetectUploadUrl(self, params):
+        upload_url_list = []
+        for context in self.__getList(params, "HashKeyContextList"):
+            md5 = context.get("HashKey")
+            oss_key = "filedetect/{}".format(md5)
+            with self.__lock:
+                file_exist = oss_key in self.__uploaded
+            upload_url_list.append({
+                "HashKey": md5,
+                "Code": "200",
+                "FileExist": file_exist,
+                "PublicUrl": self.getOssUrl(),
+                "InternalUrl": self.getOssUrl(),
+                "Expire": int(time.time()) + 3600,
+                "Context": {"OssKey": oss_key, "Policy": "policy", "AccessId": "access_id", "Signature": "signature"}
+            })
+        return 200, {"UploadUrlList": upload_url_list}
+
+
+    def __createFileDetect(self, params):
+        md5 = params.get("HashKey")
+        oss_key = params.get("OssKey")
+        if md5 is None:
+            return 400, {"Code": "MissingHashKey", "Message": "HashKey is mandatory for this action."}
+        with self.__lock:
+            if oss_key is not None and oss_key not in self.__uploaded:
+                return 400, {"Code": "FileNotUploaded", "Message": "oss key {} not found".format(oss_key)}
+            self.__detect_time.setdefault(md5, time.time())
+        return 200, {"HashKey": md5}
+
+
+    def __listCompressFileDetectResult(self, params):
+        md5 = params.get("HashKey")
+        current_page = int(params.get("CurrentPage", 1))
+        page_size = int(params.get("PageSize", 20))
+        begin = (current_page - 1) * page_size
+        result_list = []
+        for i in range(begin, min(begin + page_size, self.compress_files)):
+            result_list.append({"HashKey": md5, "Path": "compress/file{}".format(i), "Result": 0, "Score": 0})
+        return 200, {
+            "ResultList": result_list,
+            "PageInfo": {"CurrentPage": current_page, "PageSize": page_size, "TotalCount": self.compress_files}
+        }
+
+
+    def __isThrottled(self, action):
+        if self.throttle_rate > 0 and random.random() < self.throttle_rate:
+            return True
+        if self.api_qps <= 0:
+            return False
+        now = time.time()
+        with self.__lock:
+            window = self.__windows.setdefault(action, collections.deque())
+            while len(window) > 0 and now - window[0] >= 1.0:
+                window.popleft()
+            if len(window) >= self.api_qps:
+                return True
+            window.append(now)
+        return False
+
+
+    # 由md5确定的0-1之间的值，同一样本在多次运行中结果一致
+    def __ratio(self, md5, salt):
+        digest = hashlib.md5("{}:{}".format(salt, md5).encode("utf-8")).hexdigest()
+        return int(digest[:8], 16) / float(0x100000000)
+
+
+    # 将 List.1.Key=value 形式的参数还原为列表
+    def __getList(self, params, name):
+        items = {}
+        prefix = name + "."
+        for key, value in params.items():
+            if not key.startswith(prefix):
+                continue
+            parts = key[len(prefix):].split(".", 1)
+            if len(parts) == 1:
+                items[int(parts[0])] = value
+            else:
+                items.setdefault(int(parts[0]), {})[parts[1]] = value
+        return [items[i] for i in sorted(items)]
+
+
+    def __sleep(self, ms):
+        if ms > 0:
+            time.sleep(ms / 1000.0)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # 支持长连接，与真实服务一致
+
+    def do_GET(self):
+        if urlparse(self.path).path == FakeServer.STATS_PATH:
+            self.__reply(200, self.server.fake.getStats())
+            return
+        self.__reply(404, {"Code": "NotFound", "Message": self.path})
+
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == FakeServer.OSS_PATH:
+            oss_key, size = self.__readUpload()
+            self.server.fake.handleUpload(oss_key, size)
+            self.__reply(200, None)
+            return
+        body = self.__readBody()
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        if body and "x-www-form-urlencoded" in self.headers.get("Content-Type", ""):
+            params.update(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+        action = self.headers.get("x-acs-action") or params.get("Action")
+        status, response = self.server.fake.handleApi(action, params)
+        response["RequestId"] = "{:032X}".format(random.getrandbits(128))
+        self.__reply(status, response)
+
+
+    def __readBody(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            return b"".join(self.__readChunks())
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+
+    def __readChunks(self):
+        while True:
+            size = int(self.rfile.readline().split(b";", 1)[0], 16)
+            if size == 0:
+                self.rfile.readline()
+                return
+            yield self.rfile.read(size)
+            self.rfile.readline()
+
+
+    # 只解析表单开头的key字段，文件内容读取后丢弃，避免大文件占用内存
+    def __readUpload(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = self.__readChunks()
+        else:
+            chunks = self.__readLength(int(self.headers.get("Content-Length", 0)))
+        head = b""
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if len(head) < 4096:
+                head += chunk[:4096]
+        oss_key = None
+        marker = b'name="key"\r\n\r\n'
+        pos = head.find(marker)
+        if pos >= 0:
+            end = head.find(b"\r\n", pos + len(marker))
+            oss_key = head[pos + len(marker):end].decode("utf-8")
+        return oss_key, size
+
+
+    def __readLength(self, length):
+        while length > 0:
+            chunk = self.rfile.read(min(length, 64 * 1024))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+    def __reply(self, status, response):
+        body = json.dumps(response).encode("utf-8") if response is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="本地模拟的SAS文件检测服务和OSS上传服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    addServerArgs(parser)
+    return parser.parse_args(argv)
+
+
+# 添加模拟服务的可调参数，压测脚本共用
+def addServerArgs(parser):
+    parser.add_argument("--api-latency", type=float, default=20, help="API应答耗时，单位为毫秒")
+    parser.add_argument("--api-jitter", type=float, default=10, help="API应答耗时的随机抖动上限，单位为毫秒")
+    parser.add_argument("--upload-latency", type=float, default=20, help="上传应答耗时，单位为毫秒")
+    parser.add_argument("--detect-delay", type=float, default=1000, help="发起检测到产生结果的耗时，单位为毫秒")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="API请求被随机限流的比例")
+    parser.add_argument("--api-qps", type=int, default=0, help="每个API每秒最多处理的请求数，0表示不限制")
+    parser.add_argument("--known-ratio", type=float, default=0.0, help="服务端已有检测结果的样本比例")
+    parser.add_argument("--black-ratio", type=float, default=0.01, help="黑样本比例")
+    parser.add_argument("--compress-ratio", type=float, default=0.0, help="压缩包样本比例")
+    parser.add_argument("--compress-files", type=int, default=3, help="每个压缩包内的文件数")
+
+
+def createServer(args, host="127.0.0.1", port=0):
+    return FakeServer(host, port, args.api_latency, args.api_jitter, args.upload_latency, args.detect_delay,
+                      args.throttle_rate, args.api_qps, args.known_ratio, args.black_ratio,
+                      args.compress_ratio, args.compress_files)
+
+
+if __name__ == "__main__":
+    args = parseArgs(sys.argv[1:])
+    server = createServer(args, args.host, args.port)
+    print("FakeServer listening on {}, stats: http://{}{}".format(server.getEndpoint(), server.getEndpoint(),
+                                                                  FakeServer.STATS_PATH))
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
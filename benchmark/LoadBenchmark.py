@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import resource
+import urllib.request
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # 压测当前源码，而非已安装的版本
+
+from FakeServer import FakeServer, addServerArgs, createServer
+
+
+# 端到端压测：在本地模拟服务上检测不同规模的样本集，输出吞吐、每个样本的API调用次数、延迟分位数和内存峰值
+# 模拟服务和每次压测分别运行在独立的进程中，内存峰值只包括SDK所在的进程
+# 用法：python benchmark/LoadBenchmark.py --files 100,1000,10000 --file-size 4096
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="文件检测SDK端到端压测")
+    parser.add_argument("--files", default="100,1000,5000", help="样本集大小，多个以逗号分隔")
+    parser.add_argument("--file-size", type=int, default=4096, help="样本文件大小，单位为字节")
+    parser.add_argument("--dup-ratio", type=float, default=0.0, help="内容重复的样本比例")
+    parser.add_argument("--timeout", type=int, default=600000, help="单个样本的超时时长，单位为毫秒")
+    parser.add_argument("--api", choices=("sync", "async"), default="sync",
+                        help="sync使用OpenAPIDetector，async使用AsyncOpenAPIDetector")
+    parser.add_argument("--concurrency", type=int, default=1000, help="async模式下同时进行的检测数")
+    parser.add_argument("--config", default="{}", help="initConfig参数，JSON格式，如 '{\"thread_pool_size\": 100}'")
+    parser.add_argument("--endpoint", default=None, help="使用已启动的模拟服务，如127.0.0.1:8080，默认启动新的模拟服务")
+    parser.add_argument("--workdir", default=None, help="样本文件目录，默认使用临时目录")
+    parser.add_argument("--json", default=None, help="将结果以JSON格式写入文件")
+    addServerArgs(parser)
+    return parser.parse_args(argv)
+
+
+def runServer(args, endpoint_queue):
+    server = createServer(args)
+    endpoint_queue.put(server.getEndpoint())
+    server.serveForever()
+
+
+def getServerStats(endpoint):
+    with urllib.request.urlopen("http://{}{}".format(endpoint, FakeServer.STATS_PATH)) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+# 生成样本集，内容重复的样本复用之前样本的内容
+def makeCorpus(directory, file_num, file_size, dup_ratio):
+    os.makedirs(directory)
+    paths = []
+    unique_num = max(1, int(round(file_num * (1 - dup_ratio))))
+    for i in range(file_num):
+        path = os.path.join(directory, "sample{}".format(i))
+        if i < unique_num:
+            with open(path, "wb") as f:
+                f.write(os.urandom(file_size))
+        else:
+            shutil.copyfile(paths[i % unique_num], path)
+        paths.append(path)
+    return paths
+
+
+def peakRss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024 # macOS单位为字节，Linux为KB
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def detectSync(endpoint, config, paths, timeout):
+    from alibabacloud_filedetect.OpenAPIDetector import OpenAPIDetector
+    detector = OpenAPIDetector.get_instance()
+    detector.initConfig(endpoint=endpoint, protocol="http", **config)
+    detector.init("<AccessKey ID>", "<AccessKey Secret>")
+    try:
+        return [result for path, result in detector.detectMany(paths, timeout)]
+    finally:
+        detector.uninit()
+
+
+def detectAsync(endpoint, config, paths, timeout, concurrency):
+    from alibabacloud_filedetect.AsyncOpenAPIDetector import AsyncOpenAPIDetector
+
+    async def run():
+        detector = AsyncOpenAPIDetector()
+        detector.initConfig(endpoint=endpoint, protocol="http", **config)
+        await detector.init("<AccessKey ID>", "<AccessKey Secret>")
+        semaphore = asyncio.Semaphore(concurrency)
+        async def detectOne(path):
+            async with semaphore:
+                return await detector.detect(path, timeout)
+        try:
+            return await asyncio.gather(*[detectOne(path) for path in paths])
+        finally:
+            await detector.uninit()
+
+    return asyncio.get_event_loop().run_until_complete(run())
+
+
+# 在独立进程中执行一次压测，通过result_queue返回结果
+def runCorpus(args, endpoint, paths, result_queue):
+    config = json.loads(args.config)
+    begin_time = time.monotonic()
+    if args.api == "async":
+        results = detectAsync(endpoint, config, paths, args.timeout, args.concurrency)
+    else:
+        results = detectSync(endpoint, config, paths, args.timeout)
+    elapsed = time.monotonic() - begin_time
+
+    errors = {}
+    for result in results:
+        if not result.isSucc():
+            errors[result.error_code.name] = errors.get(result.error_code.name, 0) + 1
+    latencies = [result.time for result in results]
+    result_queue.put({
+        "elapsed": elapsed,
+        "results": len(results),
+        "errors": errors,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies) if len(latencies) > 0 else 0,
+        "peak_rss": peakRss()
+    })
+
+
+def runBenchmark(args, endpoint, context, file_num, workdir):
+    paths = makeCorpus(os.path.join(workdir, "corpus{}".format(file_num)), file_num, args.file_size, args.dup_ratio)
+    stats_before = getServerStats(endpoint)
+    result_queue = context.Queue()
+    process = context.Process(target=runCorpus, args=(args, endpoint, paths, result_queue))
+    process.start()
+    report = result_queue.get()
+    process.join()
+    stats_after = getServerStats(endpoint)
+
+    calls = {}
+    for key, value in stats_after.items():
+        delta = value - stats_before.get(key, 0)
+        if key.startswith("calls.") and delta > 0:
+            calls[key[len("calls."):]] = delta
+    report.update({
+        "files": file_num,
+        "files_per_sec": file_num / report["elapsed"] if report["elapsed"] > 0 else 0,
+        "api_calls_per_file": sum(calls.values()) / float(file_num),
+        "calls": calls,
+        "throttled": stats_after.get("throttled", 0) - stats_before.get("throttled", 0),
+        "uploads": stats_after.get("uploads", 0) - stats_before.get("uploads", 0)
+    })
+    return report
+
+
+def printReport(reports):
+    print("{:>8} {:>10} {:>11} {:>9} {:>9} {:>9} {:>13} {:>8} {:>10} {:>8}".format(
+        "files", "files/s", "calls/file", "p50(ms)", "p99(ms)", "max(ms)", "peak_rss(MB)", "uploads", "throttled",
+        "errors"))
+    for report in reports:
+        print("{:>8} {:>10.1f} {:>11.2f} {:>9} {:>9} {:>9} {:>13.1f} {:>8} {:>10} {:>8}".format(
+            report["files"], report["files_per_sec"], report["api_calls_per_file"], report["p50"], report["p99"],
+            report["max"], report["peak_rss"] / 1048576.0, report["uploads"], report["throttled"],
+            sum(report["errors"].values())))
+    for report in reports:
+        print("files={} calls={} errors={}".format(report["files"], report["calls"], report["errors"]))
+
+
+def main(argv):
+    args = parseArgs(argv)
+    context = multiprocessing.get_context("spawn")
+    server_process = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        endpoint_queue = context.Queue()
+        server_process = context.Process(target=runServer, args=(args, endpoint_queue))
+        server_process.daemon = True
+        server_process.start()
+        endpoint = endpoint_queue.get()
+
+    workdir = tempfile.mkdtemp(prefix="filedetect-bench-", dir=args.workdir)
+    reports = []
+    try:
+        for file_num in [int(n) for n in args.files.split(",")]:
+            reports.append(runBenchmark(args, endpoint, context, file_num, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if server_process is not None:
+            server_process.terminate()
+            server_process.join()
+
+    printReport(reports)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "reports": reports}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import platform
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # 压测当前源码，而非已安装的版本
+
+from alibabacloud_filedetect.MiniThreadPool import Runnable, BlockingDeque, MiniThreadPoolExecutor
+from alibabacloud_filedetect.ScanTask import ScanTask
+from alibabacloud_filedetect.Config import Config
+
+
+# 微基准：检测流水线热点原语的开销
+# queue_ops     单线程入队/出队吞吐
+# queue_mt      多个生产者、1-256个消费者线程并发入队/出队的吞吐，反映锁竞争
+# pool_overhead 线程池执行空任务的单任务调度开销
+# scan_task     ScanTask创建开销，以及1-256个线程并发调用getQueueSize的吞吐
+# 用法：python benchmark/MicroBenchmark.py [--json result.json] [--compare benchmark/baseline.json]
+
+
+# 候选实现：直接在queue.Queue的锁内入队，省去额外的_add_lock和标志位切换
+class DirectDeque(queue.Queue):
+    def _init(self, maxsize):
+        self.queue = deque()
+
+    def addFirst(self, item):
+        with self.mutex:
+            self.queue.appendleft(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def addLast(self, item):
+        with self.mutex:
+            self.queue.append(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+# 候选实现：deque加单个Condition，不维护unfinished_tasks
+class ConditionDeque(object):
+    def __init__(self):
+        self.queue = deque()
+        self.cond = threading.Condition(threading.Lock())
+
+    def addFirst(self, item):
+        with self.cond:
+            self.queue.appendleft(item)
+            self.cond.notify()
+
+    def addLast(self, item):
+        with self.cond:
+            self.queue.append(item)
+            self.cond.notify()
+
+    def get(self, block=True):
+        with self.cond:
+            while len(self.queue) == 0:
+                self.cond.wait()
+            return self.queue.popleft()
+
+
+# 各队列实现的(入队, 出队)函数，SimpleQueue不支持向前端添加，只作为上限参考
+QUEUES = {
+    "BlockingDeque": lambda: BlockingDeque(),
+    "DirectDeque": lambda: DirectDeque(),
+    "ConditionDeque": lambda: ConditionDeque(),
+    "queue.Queue": lambda: queue.Queue(),
+    "queue.SimpleQueue": lambda: queue.SimpleQueue()
+}
+
+
+def queueOps(q):
+    put = getattr(q, "addLast", None) or q.put
+    return put, q.get
+
+
+def timeIt(func):
+    begin_time = time.perf_counter()
+    func()
+    return time.perf_counter() - begin_time
+
+
+def row(bench, variant, workers, ops, elapsed):
+    return {
+        "bench": bench,
+        "variant": variant,
+        "workers": workers,
+        "ops_per_sec": ops / elapsed if elapsed > 0 else 0,
+        "us_per_op": elapsed * 1000000 / ops if ops > 0 else 0
+    }
+
+
+# 单线程交替入队、出队，另以不加锁的deque作为下限参考
+def benchQueueOps(items):
+    rows = []
+    for name, factory in QUEUES.items():
+        put, get = queueOps(factory())
+        def run():
+            for i in range(items):
+                put(i)
+            for i in range(items):
+                get()
+        rows.append(row("queue_ops", name, 1, items * 2, timeIt(run)))
+
+    plain = deque()
+    def runPlain():
+        for i in range(items):
+            plain.append(i)
+        for i in range(items):
+            plain.popleft()
+    rows.append(row("queue_ops", "collections.deque", 1, items * 2, timeIt(runPlain)))
+    return rows
+
+
+# producers个线程入队，workers个线程阻塞出队，统计全部处理完的吞吐
+def benchQueueContention(items, producers, workers_list):
+    rows = []
+    for workers in workers_list:
+        for name, factory in QUEUES.items():
+            put, get = queueOps(factory())
+            barrier = threading.Barrier(producers + workers + 1)
+            per_producer = items // producers
+
+            def produce():
+                barrier.wait()
+                for i in range(per_producer):
+                    put(i)
+
+            def consume():
+                barrier.wait()
+                while get() is not None:
+                    pass
+
+            threads = [threading.Thread(target=produce) for i in range(producers)]
+            threads += [threading.Thread(target=consume) for i in range(workers)]
+            for t in threads:
+                t.start()
+            barrier.wait()
+            begin_time = time.perf_counter()
+            for t in threads[:producers]:
+                t.join()
+            for i in range(workers):
+                put(None)
+            for t in threads[producers:]:
+                t.join()
+            elapsed = time.perf_counter() - begin_time
+            rows.append(row("queue_mt", name, workers, per_producer * producers * 2, elapsed))
+    return rows
+
+
+class _NoopTask(Runnable):
+    def run(self):
+        pass
+
+
+def _noop():
+    pass
+
+
+# 线程池执行空任务，单任务耗时即调度开销
+def benchPoolOverhead(items, workers_list):
+    rows = []
+    tasks = [_NoopTask() for i in range(items)]
+    for workers in workers_list:
+        work_queue = BlockingDeque()
+        pool = MiniThreadPoolExecutor(work_queue, workers)
+        pool.prestartAllThreads()
+        def runMini():
+            for task in tasks:
+                work_queue.addLast(task)
+            while pool.getCompletedTaskCount() < items:
+                time.sleep(0.001)
+        rows.append(row("pool_overhead", "MiniThreadPoolExecutor", workers, items, timeIt(runMini)))
+        pool.shutdown()
+
+        executor = ThreadPoolExecutor(workers)
+        for future in [executor.submit(_noop) for i in range(workers)]:
+            future.result() # 预先启动线程
+        def runStd():
+            futures_wait([executor.submit(_noop) for i in range(items)])
+        rows.append(row("pool_overhead", "ThreadPoolExecutor", workers, items, timeIt(runStd)))
+        executor.shutdown()
+    return rows
+
+
+# ScanTask创建开销和getQueueSize的锁竞争，不加锁直接读取计数作为下限参考
+def benchScanTask(items, workers_list):
+    from alibabacloud_filedetect.OpenAPIDetector import OpenAPIDetector
+    rows = []
+    config = Config()
+    def create():
+        for i in range(items):
+            task = ScanTask()
+            task.initScanFile("/tmp/sample", 4096, -1, None, None, config)
+    rows.append(row("scan_task", "ScanTask.initScanFile", 1, items, timeIt(create)))
+
+    detector = OpenAPIDetector.get_instance()
+    detector.initConfig(endpoint="127.0.0.1:1", protocol="http") # 不发起请求，只用于初始化
+    detector.init("<AccessKey ID>", "<AccessKey Secret>")
+    try:
+        variants = {
+            "getQueueSize": detector.getQueueSize,
+            "unlocked_read": lambda: detector._OpenAPIDetector__alive_task_num
+        }
+        for workers in workers_list:
+            per_worker = max(1, items // workers)
+            for name, func in variants.items():
+                barrier = threading.Barrier(workers + 1)
+                def call():
+                    barrier.wait()
+                    for i in range(per_worker):
+                        func()
+                threads = [threading.Thread(target=call) for i in range(workers)]
+                for t in threads:
+                    t.start()
+                barrier.wait()
+                begin_time = time.perf_counter()
+                for t in threads:
+                    t.join()
+                rows.append(row("scan_task", name, workers, per_worker * workers, time.perf_counter() - begin_time))
+    finally:
+        detector.uninit()
+    return rows
+
+
+def printRows(rows, baseline):
+    print("{:<14} {:<24} {:>7} {:>14} {:>10} {:>10}".format("bench", "variant", "workers", "ops/s", "us/op",
+                                                             "vs_base"))
+    for r in rows:
+        base = baseline.get((r["bench"], r["variant"], r["workers"]))
+        ratio = "{:.2f}x".format(r["ops_per_sec"] / base["ops_per_sec"]) if base and base["ops_per_sec"] > 0 else "-"
+        print("{:<14} {:<24} {:>7} {:>14.0f} {:>10.2f} {:>10}".format(r["bench"], r["variant"], r["workers"],
+                                                                       r["ops_per_sec"], r["us_per_op"], ratio))
+
+
+def loadBaseline(path):
+    if path is None:
+        return {}
+    with open(path) as f:
+        return dict(((r["bench"], r["variant"], r["workers"]), r) for r in json.load(f)["rows"])
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description="检测流水线热点原语的微基准")
+    parser.add_argument("--items", type=int, default=200000, help="单线程测试的操作次数")
+    parser.add_argument("--mt-items", type=int, default=100000, help="多线程测试的操作次数")
+    parser.add_argument("--producers", type=int, default=4, help="queue_mt的生产者线程数")
+    parser.add_argument("--workers", default="1,4,16,64,256", help="工作线程数，多个以逗号分隔")
+    parser.add_argument("--bench", default="queue_ops,queue_mt,pool_overhead,scan_task", help="执行的测试，多个以逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3, help="重复执行次数，每项取吞吐最高的一次，减少抖动")
+    parser.add_argument("--json", default=None, help="将结果以JSON格式写入文件")
+    parser.add_argument("--compare", default=None, help="与之前保存的JSON结果对比，输出吞吐比值")
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parseArgs(argv)
+    workers_list = [int(n) for n in args.workers.split(",")]
+    benches = args.bench.split(",")
+    best = {}
+    for i in range(max(1, args.repeat)):
+        rows = []
+        if "queue_ops" in benches:
+            rows += benchQueueOps(args.items)
+        if "queue_mt" in benches:
+            rows += benchQueueContention(args.mt_items, args.producers, workers_list)
+        if "pool_overhead" in benches:
+            rows += benchPoolOverhead(args.mt_items, workers_list)
+        if "scan_task" in benches:
+            rows += benchScanTask(args.mt_items, workers_list)
+        for r in rows:
+            key = (r["bench"], r["variant"], r["workers"])
+            if key not in best or r["ops_per_sec"] > best[key]["ops_per_sec"]:
+                best[key] = r
+    rows = sorted(best.values(), key=lambda r: (benches.index(r["bench"]), r["workers"]))
+
+    printRows(rows, loadBaseline(args.compare))
+    if args.json is not None:
+        env = {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        }
+        with open(args.json, "w") as f:
+            json.dump({"env": env, "args": vars(args), "rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
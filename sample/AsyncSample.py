@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from alibabacloud_filedetect.AsyncOpenAPIDetector import AsyncOpenAPIDetector
+from alibabacloud_filedetect.DirectoryWalker import DirectoryWalker
+from alibabacloud_filedetect.ERR_CODE import ERR_CODE
+from Sample import Sample
+
+
+class AsyncSample(object):
+
+    """
+    并发检测目录或文件，同时进行的检测数不超过concurrency
+    每个待检测文件只是一个协程，不占用线程
+    """
+    async def scan(self, detector, path, timeout_ms, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        async def detectOne(file_path):
+            async with semaphore:
+                result = await detector.detect(file_path, timeout_ms)
+            print("[detect] [ END ] path: {}, {}".format(file_path, Sample.formatDetectResult(result)))
+
+        futures = set()
+        for file_path, st in DirectoryWalker(path):
+            futures.add(asyncio.ensure_future(detectOne(file_path)))
+            # 控制待处理协程的个数，避免遍历大目录时占用过多内存
+            if len(futures) >= concurrency * 2:
+                done, futures = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+        if futures:
+            await asyncio.wait(futures)
+
+
+    async def main(self):
+        detector = AsyncOpenAPIDetector()
+
+        # 设置全局配置，参数与OpenAPIDetector.initConfig相同（该操作可选）
+        initcon_ret = detector.initConfig(upload_thread_num=64, verdict_cache_size=10000)
+        print("INIT_CONFIG RET: {}".format(initcon_ret.name))
+
+        init_ret = await detector.init("<AccessKey ID>", "<AccessKey Secret>", regionId="<your regionId>")
+        print("INIT RET: {}".format(init_ret.name))
+        if init_ret != ERR_CODE.ERR_SUCC:
+            return
+
+        try:
+            # 示例用法1：并发扫描本地目录或文件
+            timeout_ms = 500000
+            path = "test.bin" # 待扫描的文件或目录
+            await self.scan(detector, path, timeout_ms, 1000)
+
+            # 示例用法2：扫描URL文件，超时或取消时结束等待
+            url = "https://xxxxxxxx.oss-cn-hangzhou-1.aliyuncs.com/xxxxx/xxxxxxxxxxxxxx?Expires=1671448125&OSSAccessKeyId=xxx"
+            md5 = "a767ffc59d93125c7505b6e21d000000"
+            result = await detector.detectUrl(url, md5, timeout_ms)
+            print("[detectUrl] [ END ] {}".format(Sample.formatDetectResult(result)))
+        finally:
+            # 反初始化，进行中的检测以ERR_ABORT结束
+            print("Over.")
+            await detector.uninit()
+
+
+if __name__ == "__main__":
+    sample = AsyncSample()
+    asyncio.get_event_loop().run_until_complete(sample.main())
@@ -10,6 +10,8 @@ from alibabacloud_filedetect.OpenAPIDetector import OpenAPIDetector
 from alibabacloud_filedetect.IDetectResultCallback import IDetectResultCallback
 from alibabacloud_filedetect.ERR_CODE import ERR_CODE
 from alibabacloud_filedetect.DetectResult import DetectResult
+from alibabacloud_filedetect.IncrementalScanner import IncrementalScanner
+from alibabacloud_filedetect.DirectoryWalker import DirectoryWalker
 
 class Sample(object):
     
@@ -51,23 +53,8 @@ class Sample(object):
     def detectFile(self, detector, path, timeout_ms, wait_if_queuefull, callback):
         if detector is None or path is None or callback is None:
             return ERR_CODE.ERR_INIT.value
-        result = ERR_CODE.ERR_INIT.value
-        if wait_if_queuefull:
-            real_callback = callback
-            class AsyncTaskCallback(IDetectResultCallback):
-                def onScanResult(self, seq, file_path, callback_res):
-                    if callback_res.error_code == ERR_CODE.ERR_DETECT_QUEUE_FULL:
-                        return
-                    real_callback.onScanResult(seq, file_path, callback_res)
-            callback = AsyncTaskCallback()
-        while True:
-            result = detector.detect(path, timeout_ms, callback)
-            if result != ERR_CODE.ERR_DETECT_QUEUE_FULL.value:
-                break
-            if wait_if_queuefull is False:
-                break
-            detector.waitQueueAvailable(-1)
-        return result
+        # block为True时，检测队列满则等待队列可用后再发起检测
+        return detector.detect(path, timeout_ms, callback, block=wait_if_queuefull)
     
 
     """
@@ -106,23 +93,8 @@ class Sample(object):
     def detectUrl(self, detector, url, md5, timeout_ms, wait_if_queuefull, callback):
         if detector is None or url is None or md5 is None or callback is None:
             return ERR_CODE.ERR_INIT.value
-        result = ERR_CODE.ERR_INIT.value
-        if wait_if_queuefull:
-            real_callback = callback
-            class AsyncTaskCallback(IDetectResultCallback):
-                def onScanResult(self, seq, file_path, callback_res):
-                    if callback_res.error_code == ERR_CODE.ERR_DETECT_QUEUE_FULL:
-                        return
-                    real_callback.onScanResult(seq, file_path, callback_res)
-            callback = AsyncTaskCallback()
-        while True:
-            result = detector.detectUrl(url, md5, timeout_ms, callback)
-            if result != ERR_CODE.ERR_DETECT_QUEUE_FULL.value:
-                break
-            if wait_if_queuefull is False:
-                break
-            detector.waitQueueAvailable(-1)
-        return result
+        # block为True时，检测队列满则等待队列可用后再发起检测
+        return detector.detectUrl(url, md5, timeout_ms, callback, block=wait_if_queuefull)
 
 
     """
@@ -143,8 +115,8 @@ class Sample(object):
                     idx += 1
         else:
             info = result.getErrorInfo()
-            msg = "[DETECT RESULT] [FAIL] md5: {}, time: {}, error_code: {}, error_message: {}".format(info.md5,
-                info.time, info.error_code.name, info.error_string)
+            msg = "[DETECT RESULT] [FAIL] md5: {}, time: {}, error_code: {}, error_message: {}, {}".format(info.md5,
+                info.time, info.error_code.name, info.error_string, Sample.formatTimingInfo(info.timing))
         return msg
 
 
@@ -156,9 +128,19 @@ class Sample(object):
         vinfo = info.getVirusInfo()
         if vinfo is not None:
             msg += ", VIRUS_TYPE: {}, EXT_INFO: {}".format(vinfo.virus_type, vinfo.ext_info)
+        msg += ", {}".format(Sample.formatTimingInfo(info.timing))
         return msg
 
 
+    @staticmethod
+    def formatTimingInfo(timing):
+        if timing is None:
+            return "TIMING: None"
+        return "TIMING: [queue: {}, hash: {}, lookup: {}, upload: {}, upload_bytes: {}, polls: {}, throttles: {}]".format(
+            timing.queue_time, timing.hash_time, timing.lookup_time, timing.upload_time,
+            timing.upload_bytes, timing.poll_count, timing.throttle_count)
+
+
     @staticmethod
     def formatCompressFileDetectResultInfo(info):
         msg = "PATH: {}, \t\t RESULT: {}, SCORE: {}".format(info.path, info.result.name, info.score)
@@ -174,22 +156,12 @@ class Sample(object):
     @param is_sync 是否使用同步接口，推荐使用异步。 True是同步，False是异步
     """
     def detectDirOrFileSync(self, detector, path, timeout_ms, result_map):
-        abs_path = os.path.abspath(path)
-        if os.path.isdir(abs_path):
-            sub_files = os.listdir(abs_path)
-            if len(sub_files) == 0:
-                return
-            for sub_file in sub_files:
-                sub_path = os.path.join(abs_path, sub_file)
-                self.detectDirOrFileSync(detector, sub_path, timeout_ms, result_map)
-            return
-        
-        print("[detectFileSync] [BEGIN] queueSize: {}, path: {}, timeout: {}".format(
-            detector.getQueueSize(), abs_path, timeout_ms))
-        res = self.detectFileSync(detector, abs_path, timeout_ms, True)
-        print("                 [ END ] {}".format(Sample.formatDetectResult(res)))
-        result_map[abs_path] = res
-        return
+        for abs_path, st in DirectoryWalker(path):
+            print("[detectFileSync] [BEGIN] queueSize: {}, path: {}, timeout: {}".format(
+                detector.getQueueSize(), abs_path, timeout_ms))
+            res = self.detectFileSync(detector, abs_path, timeout_ms, True)
+            print("                 [ END ] {}".format(Sample.formatDetectResult(res)))
+            result_map[abs_path] = res
 
 
     """
@@ -198,20 +170,11 @@ class Sample(object):
     @param is_sync 是否使用同步接口，推荐使用异步。True是同步， False是异步
     """
     def detectDirOrFile(self, detector, path, timeout_ms, callback):
-        abs_path = os.path.abspath(path)
-        if os.path.isdir(abs_path):
-            sub_files = os.listdir(abs_path)
-            if len(sub_files) == 0:
-                return
-            for sub_file in sub_files:
-                sub_path = os.path.join(abs_path, sub_file)
-                self.detectDirOrFile(detector, sub_path, timeout_ms, callback)
-            return
-        
-        seq = self.detectFile(detector, abs_path, timeout_ms, True, callback)
-        print("[detectFile] [BEGIN] seq: {}, queueSize: {}, path: {}, timeout: {}".format(
-            seq, detector.getQueueSize(), abs_path, timeout_ms))   
-        return
+        # 遍历结果逐个返回，检测队列满时暂停遍历
+        for abs_path, st in DirectoryWalker(path):
+            seq = self.detectFile(detector, abs_path, timeout_ms, True, callback)
+            print("[detectFile] [BEGIN] seq: {}, queueSize: {}, path: {}, timeout: {}".format(
+                seq, detector.getQueueSize(), abs_path, timeout_ms))
 
     
     """
@@ -258,6 +221,23 @@ class Sample(object):
             print(traceback.format_exc(), file=sys.stderr)
 
 
+    """
+    增量扫描目录或文件，只检测新增、修改过以及检测结果已过期的文件
+    @param manifest_path 清单文件路径，记录上次扫描的文件信息和检测结果
+    """
+    def incrementalScan(self, detector, path, manifest_path, detect_timeout_ms):
+        print("[INCREMENTAL SCAN] [START] path: {}, manifest: {}".format(path, manifest_path))
+        class ScanCallback(IDetectResultCallback):
+            def onScanResult(self, seq, file_path, callback_res):
+                print("[detectFile] [ END ] seq: {}, path: {}, {}".format(seq, file_path,
+                    Sample.formatDetectResult(callback_res)))
+        scanner = IncrementalScanner(detector, manifest_path)
+        stats = scanner.scan(path, detect_timeout_ms, ScanCallback())
+        print("[INCREMENTAL SCAN] [ END ] files: {}, submitted: {}, skipped: {}, succeeded: {}, failed: {}, changed: {}, removed: {}".format(
+            stats["files"], stats["submitted"], stats["skipped"], stats["succeeded"], stats["failed"], stats["changed"],
+            stats["removed"]))
+
+
     def main(self):
 
         # 获取检测器实例
@@ -267,10 +247,46 @@ class Sample(object):
         thread_pool_size = 64 # 线程池大小，默认为64
         queue_size_max = 200 # 队列最大个数，默认为200
         query_result_interval = 100 # 查询检测结果间隔时间，单位为毫秒，默认为100，避免qps过高
-        request_too_frequently_sleep_time = 100 # 单样本请求太过频繁时，需要休眠时间，单位为毫秒，默认为100
+        request_too_frequently_sleep_time = 100 # 请求太过频繁被限流后，暂停调用该API的时间，单位为毫秒，默认为100
         http_connect_timeout = 6000 # 与服务器的网络连接超时时间，单位为毫秒，默认为6000
         http_read_timeout = 6000 # 建立连接后，等待服务器响应的超时时间，单位为毫秒，默认为6000
         http_upload_timeout = 60000 # 上传文件超时时间，单位为毫秒，默认为60000
+        lookup_batch_size = 50 # 批量查询检测结果时单次请求的最大md5个数，默认为50
+        lookup_batch_linger = 10 # 批量查询凑批等待时间，单位为毫秒，默认为10
+        lookup_thread_num = 4 # 批量查询线程数，默认为4
+        upload_url_batch_size = 50 # 批量获取上传地址时单次请求的最大文件个数，默认为50
+        upload_url_batch_linger = 10 # 批量获取上传地址凑批等待时间，单位为毫秒，默认为10
+        upload_url_thread_num = 2 # 批量获取上传地址线程数，默认为2
+        md5_buffer_size = 1048576 # 计算文件md5时的读缓冲区大小，单位为字节，默认为1MB
+        http_pool_size = 0 # 上传文件连接池大小，默认为0，表示与线程池大小一致
+        http_keep_alive = True # 上传文件是否复用连接，默认为True
+        adaptive_poll = True # 是否根据同类样本的检测耗时自适应调整查询检测结果间隔，默认为True
+        query_result_interval_max = 5000 # 自适应查询检测结果的最大间隔，单位为毫秒，默认为5000
+        # API调用频率上限，单位为次/秒，默认为None，从每秒1000次起步，遇到限流时自动降低。<= 0 不限速
+        # 也可按API名称分别设置，如{"GetFileDetectResult": 20}
+        api_qps = None
+        verdict_cache_size = 0 # 检测结果缓存最大个数，默认为0不缓存。重复样本较多时建议开启
+        verdict_cache_black_ttl = 86400000 # 黑样本检测结果缓存有效期，单位为毫秒，默认为1天
+        verdict_cache_white_ttl = 3600000 # 白样本检测结果缓存有效期，单位为毫秒，默认为1小时
+        verdict_cache_error_ttl = 0 # 调用API错误结果缓存有效期，单位为毫秒，默认为0不缓存
+        verdict_store_path = None # 持久化检测结果库文件路径，默认为None不启用。进程重启后仍可使用，多个进程可共用一个文件
+        hash_cache_path = None # 文件md5缓存的SQLite文件路径，默认为None不使用。反复扫描变化较少的目录时建议开启
+        hash_cache_xattr = False # 是否将文件md5保存在文件扩展属性(user.*)中，仅Linux支持，默认为False
+        hash_thread_num = 0 # 计算md5阶段线程数，默认为0，表示与CPU核数一致
+        upload_thread_num = 0 # 上传文件并发起检测阶段线程数，默认为0，表示与线程池大小一致
+        poll_thread_num = 0 # 处理检测结果阶段线程数，默认为0，表示线程池大小的1/4
+        hash_backend = "thread" # 计算md5的方式，默认为"thread"。大量小文件时可设置为"process"，使用多进程计算(需Python 3.7及以上)
+        hash_process_num = 0 # 计算md5的进程数，默认为0，表示与CPU核数一致
+        hash_batch_size = 32 # 每次提交到进程池的最大文件个数，默认为32
+        hash_process_min_batch = 8 # 批量小于该值时不提交到进程池，在线程中计算，默认为8
+        callback_thread_num = 0 # 回调分发线程数，默认为0，表示在检测线程中直接回调。回调较慢（如写数据库）时建议开启
+        callback_queue_size = 10000 # 等待回调的最大结果数，默认为10000
+        callback_batch_size = 100 # 批量回调接口(IDetectResultBatchCallback)单次返回的最大结果数，默认为100
+        callback_batch_linger = 10 # 批量回调凑批等待时间，单位为毫秒，默认为10
+        metrics_port = 0 # 指标HTTP服务端口，默认为0不启用。> 0 时可通过 http://<metrics_host>:<metrics_port>/metrics 采集Prometheus指标
+        metrics_host = "127.0.0.1" # 指标HTTP服务监听地址，默认为"127.0.0.1"
+        endpoint = None # API服务地址，默认为None，表示按regionId选择
+        protocol = None # API请求协议，默认为None，表示使用https
         # 该函数的所有参数均为可选参数，可通过key=value的形式设置部分参数，以下示例为设置全部参数
         initcon_ret = detector.initConfig(
             thread_pool_size=thread_pool_size, 
@@ -279,7 +295,41 @@ class Sample(object):
             request_too_frequently_sleep_time=request_too_frequently_sleep_time,
             http_connect_timeout=http_connect_timeout,
             http_read_timeout=http_read_timeout,
-            http_upload_timeout=http_upload_timeout)
+            http_upload_timeout=http_upload_timeout,
+            lookup_batch_size=lookup_batch_size,
+            lookup_batch_linger=lookup_batch_linger,
+            lookup_thread_num=lookup_thread_num,
+            upload_url_batch_size=upload_url_batch_size,
+            upload_url_batch_linger=upload_url_batch_linger,
+            upload_url_thread_num=upload_url_thread_num,
+            md5_buffer_size=md5_buffer_size,
+            http_pool_size=http_pool_size,
+            http_keep_alive=http_keep_alive,
+            adaptive_poll=adaptive_poll,
+            query_result_interval_max=query_result_interval_max,
+            api_qps=api_qps,
+            verdict_cache_size=verdict_cache_size,
+            verdict_cache_black_ttl=verdict_cache_black_ttl,
+            verdict_cache_white_ttl=verdict_cache_white_ttl,
+            verdict_cache_error_ttl=verdict_cache_error_ttl,
+            verdict_store_path=verdict_store_path,
+            hash_cache_path=hash_cache_path,
+            hash_cache_xattr=hash_cache_xattr,
+            hash_thread_num=hash_thread_num,
+            upload_thread_num=upload_thread_num,
+            poll_thread_num=poll_thread_num,
+            hash_backend=hash_backend,
+            hash_process_num=hash_process_num,
+            hash_batch_size=hash_batch_size,
+            hash_process_min_batch=hash_process_min_batch,
+            callback_thread_num=callback_thread_num,
+            callback_queue_size=callback_queue_size,
+            callback_batch_size=callback_batch_size,
+            callback_batch_linger=callback_batch_linger,
+            metrics_port=metrics_port,
+            metrics_host=metrics_host,
+            endpoint=endpoint,
+            protocol=protocol)
         print("INIT_CONFIG RET: {}".format(initcon_ret.name))
 
         # 初始化，初始化给出两种示例，使用时根据实际情况按需选择其中一种方式初始化
@@ -317,6 +367,13 @@ class Sample(object):
             result = self.detectUrlSync(detector, url, md5, timeout_ms, True)
             print("[detectUrlSync] [ END ] {}".format(Sample.formatDetectResult(result)))
 
+        if False:
+            # 示例用法3：增量扫描本地目录，再次扫描时只检测新增或修改过的文件
+            timeout_ms = 500000
+            path = "test_dir" # 待扫描的目录
+            manifest_path = "test_dir.manifest" # 清单文件路径
+            self.incrementalScan(detector, path, manifest_path, timeout_ms)
+
         # 反初始化
         print("Over.")
         detector.uninit()
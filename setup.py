@@ -41,8 +41,10 @@ REQUIRES = [
     "alibabacloud_tea_util>=0.3.5, <1.0.0",
     "alibabacloud_tea_openapi>=0.3.3, <1.0.0",
     "requests"
-
 ]
+EXTRAS_REQUIRE = {
+    "async": ["aiohttp"] # AsyncOpenAPIDetector
+}
 
 LONG_DESCRIPTION = ''
 if os.path.exists('./README.md'):
@@ -64,6 +66,7 @@ setup(
     include_package_data=True,
     platforms="any",
     install_requires=REQUIRES,
+    extras_require=EXTRAS_REQUIRE,
     python_requires=">=3.6",
     classifiers=(
         "Development Status :: 4 - Beta",
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT) # 测试当前源码，而非已安装的版本
+sys.path.insert(0, os.path.join(ROOT, "benchmark"))
+
+from FakeServer import FakeServer
+from alibabacloud_filedetect.ERR_CODE import ERR_CODE
+from alibabacloud_filedetect.OpenAPIDetector import OpenAPIDetector
+
+
+# 每个用例使用独立的模拟服务，统计和已检测样本互不影响
+@pytest.fixture
+def server():
+    fake = FakeServer(detect_delay=200)
+    fake.start()
+    yield fake
+    fake.shutdown()
+
+
+# 检测器为单例，每个用例初始化一次，结束时反初始化
+@pytest.fixture
+def detector(server, tmp_path):
+    detector = OpenAPIDetector.get_instance()
+    assert detector.initConfig(
+        query_result_interval=50,
+        verdict_cache_size=1000,
+        hash_cache_path=str(tmp_path / "hash_cache.db"),
+        endpoint=server.getEndpoint(),
+        protocol="http") == ERR_CODE.ERR_SUCC
+    detector.init("<AccessKey ID>", "<AccessKey Secret>")
+    yield detector
+    detector.uninit()
+
+
+@pytest.fixture
+def makeFile(tmp_path):
+    def make(name, content):
+        path = tmp_path / "samples" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        return str(path)
+    return make
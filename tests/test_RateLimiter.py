@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from FakeServer import FakeServer
+from alibabacloud_filedetect.ERR_CODE import ERR_CODE
+from alibabacloud_filedetect.RateLimiter import RateLimiter
+from alibabacloud_filedetect.OpenAPIDetector import OpenAPIDetector
+
+
+# 不限速的API被限流后同样暂停
+def testPauseWithoutBucket():
+    limiter = RateLimiter(0, 0.5)
+    assert limiter.reserve("CreateFileDetect") == 0
+    limiter.feedback("CreateFileDetect", True)
+    assert 0.4 < limiter.reserve("CreateFileDetect") <= 0.5
+    assert limiter.reserve("GetFileDetectResult") == 0
+
+
+# 初始速率远高于配额时，首次限流即降到最近1秒内的成功次数
+def testThrottleCutsToSuccessRate():
+    limiter = RateLimiter(None, 0.1)
+    for i in range(5):
+        limiter.reserve("CreateFileDetect")
+        limiter.feedback("CreateFileDetect", False)
+    limiter.feedback("CreateFileDetect", True)
+    assert limiter.getRates()["CreateFileDetect"] <= 5
+
+
+# 默认配置下，服务端配额较低时大部分调用不应被限流
+def testDefaultStaysUnderQuota(tmp_path):
+    server = FakeServer(detect_delay=200, api_qps=5)
+    server.start()
+    detector = OpenAPIDetector.get_instance()
+    try:
+        assert detector.initConfig(query_result_interval=50, endpoint=server.getEndpoint(),
+                                   protocol="http") == ERR_CODE.ERR_SUCC
+        detector.init("<AccessKey ID>", "<AccessKey Secret>")
+        paths = []
+        for i in range(20):
+            path = str(tmp_path / str(i))
+            with open(path, "wb") as f:
+                f.write(os.urandom(64))
+            paths.append(path)
+        results = dict(detector.detectMany(paths, 60000))
+        assert all(result.isSucc() for result in results.values())
+        stats = server.getStats()
+        assert stats["calls.CreateFileDetect"] < 2 * len(paths)
+    finally:
+        detector.uninit()
+        server.shutdown()
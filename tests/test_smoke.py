@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import threading
+
+from alibabacloud_filedetect.ERR_CODE import ERR_CODE
+from alibabacloud_filedetect.DetectResult import DetectResult
+from alibabacloud_filedetect.IDetectResultCallback import IDetectResultCallback
+from alibabacloud_filedetect.IncrementalScanner import IncrementalScanner
+
+
+TIMEOUT = 10000 # 单个样本的超时时长，单位为毫秒
+WAIT = 10 # 等待Future的时长，单位为秒
+
+
+class _Collector(IDetectResultCallback):
+    def __init__(self):
+        self.results = {}
+        self.lock = threading.Lock()
+
+
+    def onScanResult(self, seq, file_path, result):
+        with self.lock:
+            self.results[file_path] = result
+
+
+def _assertWhite(result, content):
+    assert result.error_code == ERR_CODE.ERR_SUCC, result.error_string
+    assert result.result == DetectResult.RESULT.RES_WHITE
+    assert result.md5 == hashlib.md5(content).hexdigest()
+
+
+def testDetect(detector, makeFile):
+    path = makeFile("detect", b"detect")
+    callback = _Collector()
+    assert detector.detect(path, TIMEOUT, callback) > 0
+    assert detector.waitQueueEmpty(TIMEOUT) == ERR_CODE.ERR_SUCC
+    _assertWhite(callback.results[path], b"detect")
+
+
+def testDetectSync(detector, server, makeFile):
+    path = makeFile("sync", b"sync")
+    _assertWhite(detector.detectSync(path, TIMEOUT), b"sync")
+    assert server.getStats()["uploads"] == 1
+
+
+def testDetectFileNotFound(detector, tmp_path):
+    result = detector.detectSync(str(tmp_path / "missing"), TIMEOUT)
+    assert result.error_code == ERR_CODE.ERR_FILE_NOT_FOUND
+
+
+def testSubmit(detector, makeFile):
+    contents = [b"submit-" + str(i).encode() for i in range(5)]
+    futures = [detector.submit(makeFile("submit{}".format(i), content), TIMEOUT)
+               for i, content in enumerate(contents)]
+    for future, content in zip(futures, contents):
+        _assertWhite(future.result(WAIT), content)
+
+
+def testDetectMany(detector, server, makeFile, tmp_path):
+    contents = dict((makeFile("many{}".format(i), b"many-" + str(i).encode()), b"many-" + str(i).encode())
+                    for i in range(20))
+    missing = str(tmp_path / "missing")
+    url = ("http://127.0.0.1/sample", hashlib.md5(b"url").hexdigest())
+    items = list(contents.keys()) + [missing, url]
+    results = dict(detector.detectMany(items, TIMEOUT, max_pending=8))
+    assert len(results) == len(items)
+    for path, content in contents.items():
+        _assertWhite(results[path], content)
+    assert results[missing].error_code == ERR_CODE.ERR_FILE_NOT_FOUND
+    _assertWhite(results[url[0]], b"url")
+    assert server.getStats()["uploads"] == len(contents)
+
+
+# 检测结果已缓存时，同步接口直接返回，不应等待回调
+def testSyncOnVerdictCacheHit(detector, server, makeFile):
+    path = makeFile("cached", b"cached")
+    _assertWhite(detector.detectSync(path, TIMEOUT), b"cached")
+    calls = server.getStats()
+    _assertWhite(detector.detectSync(path, TIMEOUT), b"cached")
+    url = ("http://127.0.0.1/cached", hashlib.md5(b"cached").hexdigest())
+    _assertWhite(detector.detectUrlSync(url[0], url[1], TIMEOUT), b"cached")
+    assert server.getStats() == calls
+    assert detector.getVerdictCacheStats()["hits"] >= 2
+
+
+# 内容相同的文件同时检测时只上传、发起检测一次，结果分发给全部文件
+def testCoalescedDuplicates(detector, server, makeFile):
+    paths = [makeFile("dup{}".format(i), b"duplicate") for i in range(8)]
+    futures = [detector.submit(path, TIMEOUT) for path in paths]
+    for future in futures:
+        _assertWhite(future.result(WAIT), b"duplicate")
+    stats = server.getStats()
+    assert stats["uploads"] == 1
+    assert stats["calls.CreateFileDetect"] == 1
+
+
+# 未变化的文件跳过，修改后重新检测
+def testIncrementalScan(detector, server, makeFile, tmp_path):
+    paths = [makeFile("scan{}".format(i), b"scan-" + str(i).encode()) for i in range(5)]
+    manifest = str(tmp_path / "manifest.json")
+
+    stats = IncrementalScanner(detector, manifest).scan(os.path.dirname(paths[0]), TIMEOUT)
+    assert stats["submitted"] == 5
+    assert stats["succeeded"] == 5
+
+    scanner = IncrementalScanner(detector, manifest)
+    stats = scanner.scan(os.path.dirname(paths[0]), TIMEOUT)
+    assert stats["submitted"] == 0
+    assert stats["skipped"] == 5
+
+    with open(paths[0], "ab") as f:
+        f.write(b"-modified")
+    stats = scanner.scan(os.path.dirname(paths[0]), TIMEOUT)
+    assert stats["submitted"] == 1
+    assert stats["skipped"] == 4
+    assert scanner.getEntry(paths[0])["md5"] == hashlib.md5(b"scan-0-modified").hexdigest()
+    assert server.getStats()["uploads"] == 6